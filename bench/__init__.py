@@ -0,0 +1,11 @@
+"""
+Benchmark offline del pipeline completo (Gmail → LLM → Notion).
+
+- mailbox: genera newsletters sintéticos (HTML multipart con adjuntos)
+- imap_server: servidor IMAP local al que GmailClient se conecta
+- fake_llm: endpoint /v1/chat/completions con latencia y rate limits
+- fake_notion: API de Notion en memoria
+- run: arma todo y mide cada etapa y la ejecución completa
+
+Uso: python -m bench.run --sizes 10,100,1000
+"""
@@ -0,0 +1,101 @@
+"""
+Chequeo de los backends HTTP del LLM contra un transporte httpx simulado.
+
+El benchmark solo usa los backends openai y fake; esto ejercita también
+GroqBackend (el default) con el SDK real de groq, sin red ni API key:
+una respuesta 200 con headers x-ratelimit-* y un 429 con retry-after.
+
+    python -m bench.check_backends
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+
+from llm_backends import GroqBackend, OpenAICompatibleBackend, RateLimited
+
+CONTENT = json.dumps({"newsletters": [{"id": "N1", "titulo": "ok"}]})
+RATE_HEADERS = {"x-ratelimit-remaining-tokens": "11000", "x-ratelimit-reset-tokens": "1.5s"}
+
+
+def _handler(request: httpx.Request) -> httpx.Response:
+    """Endpoint /chat/completions: 429 si el prompt pide "rate-limit", si no 200."""
+    body = json.loads(request.content)
+    if not request.url.path.endswith("/chat/completions"):
+        return httpx.Response(404, json={"error": {"message": "not found"}})
+    if "rate-limit" in body["messages"][-1]["content"]:
+        return httpx.Response(
+            429, headers={"retry-after": "2"},
+            json={"error": {"message": "Rate limit reached", "type": "tokens"}},
+        )
+    return httpx.Response(200, headers=RATE_HEADERS, json={
+        "id": "chatcmpl-check",
+        "object": "chat.completion",
+        "created": 0,
+        "model": body["model"],
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": CONTENT},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 12, "completion_tokens": 8, "total_tokens": 20},
+    })
+
+
+async def _check(backend) -> list[str]:
+    """Correr los dos casos contra un backend y retornar los errores encontrados."""
+    errors = []
+    messages = [{"role": "user", "content": "Newsletter N1"}]
+    try:
+        completion = await backend.complete(messages, temperature=0.1, max_tokens=100)
+        if completion.content != CONTENT:
+            errors.append(f"contenido inesperado: {completion.content!r}")
+        if completion.total_tokens != 20:
+            errors.append(f"tokens inesperados: {completion.total_tokens}")
+        if completion.headers.get("x-ratelimit-remaining-tokens") != "11000":
+            errors.append("faltan los headers x-ratelimit-*")
+    except Exception as e:
+        errors.append(f"200 falló: {type(e).__name__}: {e}")
+
+    try:
+        await backend.complete([{"role": "user", "content": "rate-limit"}], 0.1, 100)
+        errors.append("429 no levantó RateLimited")
+    except RateLimited as e:
+        if e.retry_after != 2:
+            errors.append(f"retry-after inesperado: {e.retry_after}")
+    except Exception as e:
+        errors.append(f"429 falló: {type(e).__name__}: {e}")
+    finally:
+        await backend.close()
+    return errors
+
+
+def main() -> int:
+    os.environ.setdefault("GROQ_API_KEY", "check")
+    transport = httpx.MockTransport(_handler)
+
+    openai = OpenAICompatibleBackend(base_url="http://llm.check/v1")
+    openai.client = httpx.AsyncClient(transport=transport)
+    backends = [
+        GroqBackend(http_client=httpx.AsyncClient(transport=transport)),
+        openai,
+    ]
+
+    failed = False
+    for backend in backends:
+        errors = asyncio.run(_check(backend))
+        if errors:
+            failed = True
+            print(f"❌ {backend.name}:")
+            for error in errors:
+                print(f"   - {error}")
+        else:
+            print(f"✅ {backend.name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
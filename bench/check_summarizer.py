@@ -0,0 +1,136 @@
+"""
+Chequeo de los reintentos del summarizer contra un backend con guion.
+
+Casos que el benchmark no ejercita (el backend fake siempre responde bien):
+
+- un item válido en el primer intento y un error en el reintento del resto:
+  el válido se conserva y se cachea, solo el otro queda sin clasificar
+- un 429 seguido de un reintento exitoso: la reserva del request rechazado
+  se devuelve y el presupuesto del rate limiter se descuenta una sola vez
+
+    python -m bench.check_summarizer
+"""
+
+import json
+import sys
+from datetime import datetime
+
+from llm_backends import FakeBackend, RateLimited
+from rate_limiter import RateLimiter
+from summarizer import NewsletterSummarizer
+
+
+class ScriptedBackend(FakeBackend):
+    """Backend fake que recorre un guion: por cada llamada, una función que
+    recibe la respuesta normal y la modifica o levanta una excepción."""
+
+    def __init__(self, script):
+        super().__init__(latency=0)
+        self.script = list(script)
+
+    async def complete(self, messages, temperature, max_tokens):
+        self.requests += 1
+        completion = self.respond(messages)
+        step = self.script.pop(0) if self.script else None
+        return step(completion) if step else completion
+
+
+class MemoryCache:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def put(self, key, model, result):
+        self.data[key] = result
+
+
+def _newsletter(i: int) -> dict:
+    return {
+        "id": f"g{i}",
+        "subject": f"Newsletter de prueba {i}",
+        "from": f"Remitente {i} <r{i}@ejemplo.com>",
+        "date": datetime(2026, 10, 1),
+        "body": f"Novedades de la semana número {i}.\nMás texto del newsletter {i}.",
+    }
+
+
+def _only_first(completion):
+    """Responder solo N1: N2 queda pendiente para el reintento."""
+    data = json.loads(completion.content)
+    data["newsletters"] = [item for item in data["newsletters"] if item["id"] == "N1"]
+    completion.content = json.dumps(data)
+    return completion
+
+
+def _fail(completion):
+    raise RuntimeError("falla simulada en el reintento")
+
+
+def _rate_limited(completion):
+    raise RateLimited("429 simulado", headers={"retry-after": "0.01"})
+
+
+def check_retry_failure() -> list[str]:
+    """Válido en el intento 0, excepción en el intento 1."""
+    errors = []
+    cache = MemoryCache()
+    s = NewsletterSummarizer(cache=cache, backend=ScriptedBackend([_only_first, _fail]))
+    newsletters = [_newsletter(0), _newsletter(1)]
+
+    results = [result for batch in s.iter_batches(newsletters) for result in batch]
+    if [result["link"].rsplit("/", 1)[-1] for result in results] != ["g0"]:
+        errors.append(f"resultados inesperados: {results}")
+    if [nl_id for nl_id, _ in s.unclassified] != ["g1"]:
+        errors.append(f"sin clasificar inesperados: {s.unclassified}")
+    if s._cache_key(newsletters[0]) not in cache.data:
+        errors.append("el item validado no quedó en cache")
+    if s._cache_key(newsletters[1]) in cache.data:
+        errors.append("el item fallido quedó en cache")
+    return errors
+
+
+def check_rate_limit_refund() -> list[str]:
+    """Un 429 y luego éxito: el bucket queda como tras un solo request."""
+    errors = []
+    s = NewsletterSummarizer(backend=ScriptedBackend([_rate_limited]))
+    # Límites chicos: el refill durante el chequeo es despreciable
+    s.limiter = RateLimiter(tokens_per_minute=100_000, requests_per_minute=10)
+    estimated = 5_000
+    messages = [{"role": "user", "content": "N1.\nAsunto: x\nDe: y\nContenido:\nz"}]
+
+    s._submit(s._complete(messages, estimated_tokens=estimated)).result()
+    s.close()
+    if s.backend.requests != 2:
+        errors.append(f"se esperaban 2 requests al backend, hubo {s.backend.requests}")
+    # record_usage deja en el bucket los tokens reales del request exitoso
+    actual = s.backend.respond(messages).total_tokens
+    tokens_used = s.limiter.tokens.capacity - s.limiter.tokens.level
+    requests_used = s.limiter.requests.capacity - s.limiter.requests.level
+    if tokens_used > actual + 100:
+        errors.append(f"tokens descontados {tokens_used:.0f} para un request de {actual}")
+    if requests_used > 1.05:
+        errors.append(f"requests descontados {requests_used:.2f} para un request exitoso")
+    return errors
+
+
+CHECKS = [check_retry_failure, check_rate_limit_refund]
+
+
+def main() -> int:
+    failed = False
+    for check in CHECKS:
+        errors = check()
+        if errors:
+            failed = True
+            print(f"❌ {check.__name__}:")
+            for error in errors:
+                print(f"   - {error}")
+        else:
+            print(f"✅ {check.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
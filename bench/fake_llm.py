@@ -0,0 +1,127 @@
+"""
+Endpoint /v1/chat/completions compatible con OpenAI para el benchmark.
+
+Responde con FakeBackend (mismo JSON determinístico) y simula lo que importa
+de Groq para medir: latencia por request y límites de tokens y requests por
+minuto, devolviendo 429 con retry-after y headers x-ratelimit-* al pasarse.
+Con OpenAICompatibleBackend apuntando aquí, el summarizer hace exactamente
+el mismo trabajo que contra un proveedor real.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_backends import FakeBackend
+from rate_limiter import TokenBucket, estimate_tokens
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0, tokens_per_minute: int | None = None,
+                 requests_per_minute: int | None = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _LLMHandler)
+        self.latency = latency
+        self.backend = FakeBackend(latency=0)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "tokens": 0}
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def admit(self, tokens: int) -> tuple[float, dict]:
+        """
+        Decidir si el request entra en los límites.
+
+        Returns:
+            (segundos a esperar, 0 si entra; headers x-ratelimit-*)
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+            wait = max(
+                self.tokens.wait_time(tokens) if self.tokens else 0.0,
+                self.requests.wait_time(1) if self.requests else 0.0,
+            )
+            if wait > 0:
+                self.stats["rate_limited"] += 1
+            else:
+                if self.tokens:
+                    self.tokens.consume(tokens)
+                if self.requests:
+                    self.requests.consume(1)
+                self.stats["tokens"] += tokens
+
+            headers = {}
+            if self.tokens:
+                headers["x-ratelimit-limit-tokens"] = str(int(self.tokens.capacity))
+                headers["x-ratelimit-remaining-tokens"] = str(max(0, int(self.tokens.level)))
+                missing = self.tokens.capacity - self.tokens.level
+                headers["x-ratelimit-reset-tokens"] = f"{missing / self.tokens.rate:.2f}s"
+            return wait, headers
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="bench-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _LLMHandler(BaseHTTPRequestHandler):
+    server: FakeLLMServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict, headers: dict | None = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._reply(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        messages = body.get("messages", [])
+        # Como Groq: el prompt más max_tokens cuenta contra el límite por minuto
+        requested = sum(estimate_tokens(m.get("content", "")) for m in messages) + body.get("max_tokens", 0)
+        wait, headers = self.server.admit(requested)
+        if wait > 0:
+            headers["retry-after"] = f"{wait:.2f}"
+            self._reply(429, {"error": {"message": "Rate limit reached", "type": "tokens"}}, headers)
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        completion = self.server.backend.respond(messages)
+        self._reply(200, {
+            "id": f"chatcmpl-bench-{time.monotonic_ns()}",
+            "object": "chat.completion",
+            "model": body.get("model", "bench"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": completion.content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": completion.prompt_tokens,
+                "completion_tokens": completion.completion_tokens,
+                "total_tokens": completion.total_tokens,
+            },
+        }, headers)
@@ -0,0 +1,177 @@
+"""
+API de Notion en memoria para el benchmark.
+
+Cubre los endpoints que usa NotionClient: query de la base (paginada con
+cursor y con el filtro por last_edited_time), crear páginas y archivarlas.
+Aplica el límite promedio de Notion (3 requests/s con algo de ráfaga)
+devolviendo 429 con Retry-After, y puede inyectar 5xx para ejercitar los
+reintentos.
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from rate_limiter import TokenBucket
+
+PAGE_SIZE_MAX = 100
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class FakeNotionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0, requests_per_second: float | None = 3.0,
+                 burst: int = 10, error_rate: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _NotionHandler)
+        self.latency = latency
+        self.bucket = TokenBucket(burst, burst / requests_per_second) if requests_per_second else None
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.pages: list[dict] = []
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0, "created": 0}
+        self._random = random.Random(0)
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def reset(self):
+        """Vaciar la base (entre etapas del benchmark)."""
+        with self.lock:
+            self.pages.clear()
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def admit(self) -> tuple[int, float]:
+        """Retornar (status a forzar o 0, Retry-After) para el próximo request."""
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.bucket:
+                wait = self.bucket.wait_time(1)
+                if wait > 0:
+                    self.stats["rate_limited"] += 1
+                    return 429, wait
+                self.bucket.consume(1)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return 502, 0.0
+            return 0, 0.0
+
+    def query(self, body: dict) -> dict:
+        since = (body.get("filter") or {}).get("last_edited_time", {}).get("on_or_after")
+        start = int(body.get("start_cursor") or 0)
+        size = min(int(body.get("page_size") or PAGE_SIZE_MAX), PAGE_SIZE_MAX)
+        with self.lock:
+            pages = [p for p in self.pages if not p["archived"]]
+        if since:
+            since_dt = datetime.fromisoformat(since.replace("Z", "+00:00"))
+            pages = [p for p in pages
+                     if datetime.fromisoformat(p["last_edited_time"].replace("Z", "+00:00")) >= since_dt]
+        chunk = pages[start:start + size]
+        more = start + size < len(pages)
+        return {
+            "object": "list",
+            "results": chunk,
+            "has_more": more,
+            "next_cursor": str(start + size) if more else None,
+        }
+
+    def create(self, body: dict) -> dict:
+        now = _now()
+        page = {
+            "object": "page",
+            "id": str(uuid.uuid4()),
+            "created_time": now,
+            "last_edited_time": now,
+            "archived": False,
+            "parent": body.get("parent"),
+            "properties": body.get("properties", {}),
+        }
+        with self.lock:
+            self.pages.append(page)
+            self.stats["created"] += 1
+        return page
+
+    def update(self, page_id: str, body: dict) -> dict | None:
+        with self.lock:
+            for page in self.pages:
+                if page["id"] == page_id:
+                    page.update({k: v for k, v in body.items() if k in ("archived", "properties")})
+                    page["last_edited_time"] = _now()
+                    return page
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="bench-notion", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _NotionHandler(BaseHTTPRequestHandler):
+    server: FakeNotionServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict, headers: dict | None = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method: str):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+        status, retry_after = self.server.admit()
+        if status == 429:
+            self._reply(429, {"object": "error", "code": "rate_limited"},
+                        {"Retry-After": f"{retry_after:.2f}"})
+            return
+        if status:
+            self._reply(status, {"object": "error", "code": "service_unavailable"})
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        parts = self.path.strip("/").split("/")
+        if parts[:1] == ["v1"]:
+            parts = parts[1:]
+
+        if method == "POST" and len(parts) == 3 and parts[0] == "databases" and parts[2] == "query":
+            self._reply(200, self.server.query(body))
+        elif method == "POST" and parts == ["pages"]:
+            self._reply(200, self.server.create(body))
+        elif method == "PATCH" and len(parts) == 2 and parts[0] == "pages":
+            page = self.server.update(parts[1], body)
+            if page is None:
+                self._reply(404, {"object": "error", "code": "object_not_found"})
+            else:
+                self._reply(200, page)
+        else:
+            self._reply(404, {"object": "error", "code": "invalid_request_url"})
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
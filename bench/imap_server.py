@@ -0,0 +1,432 @@
+"""
+Servidor IMAP mínimo para el benchmark (texto plano, sin TLS).
+
+Implementa lo que usa GmailClient contra Gmail: LOGIN, LIST, SELECT/EXAMINE,
+UID SEARCH (SINCE, BEFORE, UID n:m, FROM, NOT, OR, ALL y un subconjunto de
+X-GM-RAW), UID FETCH con UID, X-GM-MSGID, INTERNALDATE, RFC822, BODYSTRUCTURE,
+BODY.PEEK[HEADER.FIELDS (...)] y BODY.PEEK[<sección>], e IDLE. Cada comando puede tener una latencia fija para
+simular el ida y vuelta a imap.gmail.com.
+
+`deliver()` agrega mensajes en caliente: las sesiones en IDLE reciben el
+EXISTS como con Gmail, e `idle_timeout` corta el IDLE con BYE (Gmail lo hace
+a los ~29 minutos) para probar la reconexión de --watch.
+"""
+
+import email.message
+import re
+import select
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+from bench.mailbox import MailboxMessage
+
+CAPABILITIES = "IMAP4rev1 IDLE X-GM-EXT-1"
+
+_FETCH_ITEM_RE = re.compile(r"BODY(?:\.PEEK)?\[[^\]]*\]|[A-Z0-9.\-]+", re.I)
+_SEARCH_TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+
+
+def _quote(value: str | None) -> str:
+    if value is None:
+        return "NIL"
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _params(pairs: list[tuple[str, str]]) -> str:
+    if not pairs:
+        return "NIL"
+    return "(" + " ".join(f"{_quote(k.upper())} {_quote(v)}" for k, v in pairs) + ")"
+
+
+def _payload_bytes(part: email.message.Message) -> bytes:
+    """Contenido de una parte tal como viaja (sin decodificar el transfer-encoding)."""
+    payload = part.get_payload(decode=False)
+    if isinstance(payload, str):
+        return payload.encode("ascii", "surrogateescape")
+    return b""
+
+
+def bodystructure(part: email.message.Message) -> str:
+    """BODYSTRUCTURE (RFC 3501) de un mensaje parseado."""
+    if part.is_multipart():
+        children = "".join(bodystructure(child) for child in part.get_payload())
+        boundary = part.get_boundary()
+        params = _params([("boundary", boundary)] if boundary else [])
+        return f"({children} {_quote(part.get_content_subtype().upper())} {params} NIL NIL)"
+
+    maintype = part.get_content_maintype().upper()
+    subtype = part.get_content_subtype().upper()
+    params = _params([(k, v) for k, v in part.get_params(header="content-type")[1:]])
+    encoding = (part.get("Content-Transfer-Encoding") or "7BIT").upper()
+    data = _payload_bytes(part)
+
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        disp = f"({_quote(disposition.upper())} {_params([('filename', filename)] if filename else [])})"
+    else:
+        disp = "NIL"
+
+    fields = f"{_quote(maintype)} {_quote(subtype)} {params} {_quote(part.get('Content-ID'))} NIL " \
+             f"{_quote(encoding)} {len(data)}"
+    if maintype == "TEXT":
+        fields += " %d" % data.count(b"\n")
+    return f"({fields} NIL {disp} NIL)"
+
+
+def _section(msg: email.message.Message, section: str) -> bytes:
+    """Contenido de BODY[<sección>] (p.ej. "1.2")."""
+    part = msg
+    for index in section.split("."):
+        if not part.is_multipart():
+            if index == "1":
+                continue
+            return b""
+        children = part.get_payload()
+        position = int(index) - 1
+        if not 0 <= position < len(children):
+            return b""
+        part = children[position]
+    return _payload_bytes(part)
+
+
+def _header_fields(raw: bytes, names: set[str]) -> bytes:
+    """Solo los headers pedidos, con sus líneas de continuación, más la línea en blanco."""
+    head = raw.split(b"\r\n\r\n", 1)[0]
+    out = []
+    keep = False
+    for line in head.split(b"\r\n"):
+        if line[:1] in (b" ", b"\t"):
+            if keep:
+                out.append(line)
+            continue
+        name = line.split(b":", 1)[0].decode(errors="replace").strip().upper()
+        keep = name in names
+        if keep:
+            out.append(line)
+    return b"\r\n".join(out) + b"\r\n\r\n"
+
+
+def _parse_set(spec: str, highest: int) -> list[tuple[int, int]]:
+    """Message-set IMAP ("1:3,7,9:*") a rangos (inicio, fin) inclusivos."""
+    ranges = []
+    for piece in spec.split(","):
+        if ":" in piece:
+            a, b = piece.split(":", 1)
+        else:
+            a = b = piece
+        start = highest if a == "*" else int(a)
+        end = highest if b == "*" else int(b)
+        ranges.append((min(start, end), max(start, end)))
+    return ranges
+
+
+def _in_set(uid: int, ranges: list[tuple[int, int]]) -> bool:
+    return any(start <= uid <= end for start, end in ranges)
+
+
+def _gmail_raw(query: str):
+    """
+    Predicado para un X-GM-RAW: solo from:, -from: y grupos {…} (OR) de from:.
+
+    El resto de los operadores de Gmail (has:, label:...) se aceptan y no filtran.
+    """
+    groups = []
+    for group in re.findall(r"\{[^}]*\}|\S+", query.replace("(", " ").replace(")", " ")):
+        terms = group.strip("{}").split() if group.startswith("{") else [group]
+        clauses = []
+        for term in terms:
+            negated = term.startswith("-")
+            name, _, value = term.lstrip("-").partition(":")
+            if name.lower() == "from" and value:
+                clauses.append((negated, value.lower()))
+        if clauses:
+            groups.append(clauses)
+
+    def matches(message: MailboxMessage) -> bool:
+        sender = (message.parsed.get("From") or "").lower()
+        return all(any((needle in sender) != negated for negated, needle in clauses)
+                   for clauses in groups)
+
+    return matches
+
+
+class Mailbox:
+    """Mensajes de un label, ordenados por UID."""
+
+    def __init__(self, name: str, messages: list[MailboxMessage], uidvalidity: int = 1):
+        self.name = name
+        self.messages = sorted(messages, key=lambda m: m.uid)
+        self.uidvalidity = uidvalidity
+
+    @property
+    def uidnext(self) -> int:
+        return (self.messages[-1].uid + 1) if self.messages else 1
+
+
+class BenchIMAPServer(socketserver.ThreadingTCPServer):
+    """Servidor IMAP con sus labels en memoria. `start()` lo corre en un thread."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailboxes: dict[str, list[MailboxMessage]], latency: float = 0.0,
+                 idle_timeout: float | None = None, gmail_extensions: bool = True,
+                 host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _IMAPHandler)
+        self.mailboxes = {name: Mailbox(name, msgs) for name, msgs in mailboxes.items()}
+        # False para simular un IMAP genérico (sin X-GM-EXT-1 ni X-GM-RAW)
+        self.gmail_extensions = gmail_extensions
+        self.latency = latency
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.commands = 0
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def deliver(self, label: str, messages: list[MailboxMessage]):
+        """Agregar mensajes a un label (llegan como correo nuevo)."""
+        mailbox = self.mailboxes.setdefault(label, Mailbox(label, []))
+        with self.lock:
+            mailbox.messages = sorted(mailbox.messages + list(messages), key=lambda m: m.uid)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="bench-imap", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    server: BenchIMAPServer
+
+    def setup(self):
+        super().setup()
+        self.mailbox: Mailbox | None = None
+        # Cantidad de mensajes que el cliente ya conoce (para los EXISTS)
+        self.reported = 0
+
+    def _send(self, data: bytes | str):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data)
+
+    def _updates(self) -> str:
+        """EXISTS no solicitado si llegaron mensajes desde la última respuesta."""
+        if self.mailbox is None or len(self.mailbox.messages) == self.reported:
+            return ""
+        self.reported = len(self.mailbox.messages)
+        return f"* {self.reported} EXISTS\r\n"
+
+    def handle(self):
+        self._send(f"* OK [CAPABILITY {self._capabilities()}] bench IMAP ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode(errors="replace").rstrip("\r\n")
+            if not line:
+                continue
+            tag, _, rest = line.partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                sub, _, args = args.partition(" ")
+                command = f"UID {sub.upper()}"
+
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            with self.server.lock:
+                self.server.commands += 1
+
+            handler = getattr(self, "do_" + command.replace(" ", "_"), None)
+            if handler is None:
+                self._send(f"{tag} BAD unknown command {command}\r\n")
+                continue
+            try:
+                if handler(tag, args) is False:
+                    return
+            except (ValueError, IndexError) as e:
+                self._send(f"{tag} BAD {e}\r\n")
+
+    # --- comandos ---
+
+    def _capabilities(self) -> str:
+        if self.server.gmail_extensions:
+            return CAPABILITIES
+        return CAPABILITIES.replace(" X-GM-EXT-1", "")
+
+    def do_CAPABILITY(self, tag, args):
+        self._send(f"* CAPABILITY {self._capabilities()}\r\n{tag} OK CAPABILITY completed\r\n")
+
+    def do_LOGIN(self, tag, args):
+        self._send(f"{tag} OK LOGIN completed\r\n")
+
+    def do_NOOP(self, tag, args):
+        self._send(f"{self._updates()}{tag} OK NOOP completed\r\n")
+
+    def do_IDLE(self, tag, args):
+        """IDLE (RFC 2177): avisar los mensajes nuevos hasta que el cliente mande DONE."""
+        if self.mailbox is None:
+            self._send(f"{tag} BAD no mailbox selected\r\n")
+            return
+        self._send("+ idling\r\n")
+        started = time.monotonic()
+        while True:
+            updates = self._updates()
+            if updates:
+                self._send(updates)
+            if self.server.idle_timeout and time.monotonic() - started > self.server.idle_timeout:
+                self._send("* BYE IDLE timeout\r\n")
+                return False
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable:
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                if line.strip().upper() != b"DONE":
+                    self._send(f"{tag} BAD expected DONE\r\n")
+                    return
+                self._send(f"{tag} OK IDLE terminated\r\n")
+                return
+
+    def do_LOGOUT(self, tag, args):
+        self._send(f"* BYE logging out\r\n{tag} OK LOGOUT completed\r\n")
+        return False
+
+    def do_CLOSE(self, tag, args):
+        self.mailbox = None
+        self._send(f"{tag} OK CLOSE completed\r\n")
+
+    def do_LIST(self, tag, args):
+        lines = [f'* LIST (\\HasNoChildren) "/" {_quote(name)}\r\n'
+                 for name in sorted(self.server.mailboxes)]
+        self._send("".join(lines) + f"{tag} OK LIST completed\r\n")
+
+    def do_SELECT(self, tag, args, readonly=False):
+        name = args.strip().strip('"')
+        mailbox = self.server.mailboxes.get(name)
+        if mailbox is None:
+            self._send(f"{tag} NO [NONEXISTENT] Unknown mailbox\r\n")
+            return
+        self.mailbox = mailbox
+        self.reported = len(mailbox.messages)
+        mode = "READ-ONLY" if readonly else "READ-WRITE"
+        self._send(
+            "* FLAGS (\\Answered \\Flagged \\Draft \\Deleted \\Seen)\r\n"
+            f"* {len(mailbox.messages)} EXISTS\r\n"
+            "* 0 RECENT\r\n"
+            f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n"
+            f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID\r\n"
+            f"{tag} OK [{mode}] {'EXAMINE' if readonly else 'SELECT'} completed\r\n"
+        )
+
+    def do_EXAMINE(self, tag, args):
+        self.do_SELECT(tag, args, readonly=True)
+
+    def do_UID_SEARCH(self, tag, args):
+        if self.mailbox is None:
+            self._send(f"{tag} BAD no mailbox selected\r\n")
+            return
+        messages = list(self.mailbox.messages)
+        highest = messages[-1].uid if messages else 0
+        tokens = [quoted if quoted is not None and plain == "" else plain
+                  for quoted, plain in _SEARCH_TOKEN_RE.findall(args.replace("(", " ").replace(")", " "))]
+
+        predicates = []
+        i = 0
+        while i < len(tokens):
+            if tokens[i].upper() == "CHARSET":
+                i += 2
+                continue
+            predicate, i = self._search_key(tokens, i, highest)
+            predicates.append(predicate)
+
+        matches = [m for m in messages if all(predicate(m) for predicate in predicates)]
+        uids = " ".join(str(m.uid) for m in matches)
+        self._send(f"* SEARCH {uids}\r\n".replace(" \r\n", "\r\n") + self._updates()
+                   + f"{tag} OK SEARCH completed\r\n")
+
+    def _search_key(self, tokens: list[str], i: int, highest: int):
+        """Parsear una clave de SEARCH desde tokens[i]: (predicado, índice siguiente)."""
+        key = tokens[i].upper()
+        if key == "ALL":
+            return (lambda m: True), i + 1
+        if key in ("SINCE", "BEFORE"):
+            day = datetime.strptime(tokens[i + 1], "%d-%b-%Y").date()
+            if key == "SINCE":
+                return (lambda m: m.internaldate.date() >= day), i + 2
+            return (lambda m: m.internaldate.date() < day), i + 2
+        if key == "UID":
+            ranges = _parse_set(tokens[i + 1], highest)
+            return (lambda m: _in_set(m.uid, ranges)), i + 2
+        if key == "FROM":
+            needle = tokens[i + 1].lower()
+            return (lambda m: needle in (m.parsed.get("From") or "").lower()), i + 2
+        if key == "NOT":
+            inner, i = self._search_key(tokens, i + 1, highest)
+            return (lambda m: not inner(m)), i
+        if key == "OR":
+            left, i = self._search_key(tokens, i + 1, highest)
+            right, i = self._search_key(tokens, i, highest)
+            return (lambda m: left(m) or right(m)), i
+        if key == "X-GM-RAW":
+            if not self.server.gmail_extensions:
+                raise ValueError("X-GM-RAW requires X-GM-EXT-1")
+            return _gmail_raw(tokens[i + 1]), i + 2
+        raise ValueError(f"unsupported search key {key}")
+
+    def do_UID_FETCH(self, tag, args):
+        if self.mailbox is None:
+            self._send(f"{tag} BAD no mailbox selected\r\n")
+            return
+        spec, _, items = args.partition(" ")
+        items = [item.upper() for item in _FETCH_ITEM_RE.findall(items)]
+        if "UID" not in items:
+            items.insert(0, "UID")
+
+        messages = list(self.mailbox.messages)
+        ranges = _parse_set(spec, messages[-1].uid if messages else 0)
+        out = bytearray()
+        for seq, message in enumerate(messages, 1):
+            if _in_set(message.uid, ranges):
+                out += self._fetch_one(seq, message, items)
+        out += f"{self._updates()}{tag} OK FETCH completed\r\n".encode()
+        self._send(bytes(out))
+
+    def _fetch_one(self, seq: int, message: MailboxMessage, items: list[str]) -> bytes:
+        out = f"* {seq} FETCH (".encode()
+        first = True
+        for item in items:
+            out += b"" if first else b" "
+            first = False
+            if item == "UID":
+                out += f"UID {message.uid}".encode()
+            elif item == "X-GM-MSGID":
+                out += f"X-GM-MSGID {message.gmail_msgid}".encode()
+            elif item == "INTERNALDATE":
+                out += f'INTERNALDATE "{message.internaldate.strftime("%d-%b-%Y %H:%M:%S %z")}"'.encode()
+            elif item == "BODYSTRUCTURE":
+                out += f"BODYSTRUCTURE {bodystructure(message.parsed)}".encode()
+            elif item in ("RFC822", "BODY[]", "BODY.PEEK[]"):
+                name = "RFC822" if item == "RFC822" else "BODY[]"
+                out += f"{name} {{{len(message.raw)}}}\r\n".encode() + message.raw
+            elif item.startswith("BODY"):
+                section = item[item.index("[") + 1:-1]
+                if section.startswith("HEADER.FIELDS"):
+                    names = set(section[section.index("(") + 1:section.rindex(")")].split())
+                    data = _header_fields(message.raw, names)
+                else:
+                    data = _section(message.parsed, section)
+                out += f"BODY[{section}] {{{len(data)}}}\r\n".encode() + data
+            else:
+                raise ValueError(f"unsupported fetch item {item}")
+        return out + b")\r\n"
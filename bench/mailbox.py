@@ -0,0 +1,178 @@
+"""
+Generador de un mailbox sintético de newsletters.
+
+Cada mensaje se parece a un newsletter real: multipart/alternative con texto
+plano y HTML de tablas, links de tracking, pie de "unsubscribe", a veces un
+logo inline (multipart/related) y a veces un PDF adjunto. Una fracción son
+re-envíos del contenido de otro remitente, para ejercitar la detección de
+casi duplicados. Todo es determinístico para una misma semilla.
+"""
+
+import email
+import email.policy
+import random
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+
+SENDERS = [
+    ("Data Elixir", "hello@dataelixir.com"),
+    ("TLDR AI", "dan@tldrnewsletter.com"),
+    ("Pandas Weekly", "news@pandasweekly.io"),
+    ("The Batch", "thebatch@deeplearning.ai"),
+    ("Towards Data Science", "noreply@medium.com"),
+    ("Python Weekly", "rahul@pythonweekly.com"),
+    ("MLOps Community", "team@mlops.community"),
+    ("Analytics Vidhya", "newsletter@analyticsvidhya.com"),
+]
+
+LIBRARIES = [
+    "pandas", "polars", "pyspark", "scikit-learn", "pytorch", "langchain", "duckdb",
+    "xgboost", "lightgbm", "huggingface transformers", "dbt", "mlflow", "ray", "jax",
+]
+TOPICS = [
+    "feature engineering", "time series forecasting", "retrieval augmented generation",
+    "model monitoring", "causal inference", "vector databases", "data contracts",
+    "LLM evaluation", "gradient boosting", "streaming pipelines", "bayesian optimization",
+]
+WORDS = (
+    "data model training pipeline performance release memory query latency team "
+    "production feature dataset benchmark inference deploy evaluation accuracy "
+    "experiment cluster notebook workflow schema embedding vector prompt agent "
+    "metrics dashboard cost scaling partition cache index storage compute"
+).split()
+
+
+class MailboxMessage:
+    """Un mensaje del mailbox: UID, X-GM-MSGID, INTERNALDATE y RFC822 crudo."""
+
+    def __init__(self, uid: int, gmail_msgid: int, internaldate: datetime, raw: bytes,
+                 labels: tuple[str, ...] = ("bench",)):
+        self.uid = uid
+        self.gmail_msgid = gmail_msgid
+        self.internaldate = internaldate
+        self.raw = raw
+        self.labels = labels
+        self._parsed = None
+
+    @property
+    def parsed(self) -> email.message.Message:
+        """Mensaje parseado (se calcula una vez, lo usa el servidor IMAP)."""
+        if self._parsed is None:
+            self._parsed = email.message_from_bytes(self.raw, policy=email.policy.compat32)
+        return self._parsed
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 18))]
+    if rng.random() < 0.5:
+        words.insert(rng.randrange(len(words)), rng.choice(LIBRARIES))
+    return " ".join(words).capitalize() + "."
+
+
+def _articles(rng: random.Random) -> list[tuple[str, str]]:
+    articles = []
+    for _ in range(rng.randint(3, 6)):
+        title = f"{rng.choice(LIBRARIES).title()} for {rng.choice(TOPICS)}"
+        body = " ".join(_sentence(rng) for _ in range(rng.randint(4, 9)))
+        articles.append((title, body))
+    return articles
+
+
+def _html(sender: str, subject: str, articles: list[tuple[str, str]], inline_logo: bool,
+          rng: random.Random) -> str:
+    track = f"https://click.example.com/{rng.getrandbits(48):x}"
+    logo = '<img src="cid:logo" alt="logo" width="120">' if inline_logo else \
+        f'<img src="{track}/logo.png" alt="logo" width="120">'
+    rows = "".join(
+        f"""<tr><td class="article">
+  <h2><a href="{track}/a{i}?utm_source=newsletter">{title}</a></h2>
+  <p>{body}</p>
+  <p><a href="{track}/r{i}">Read more &rarr;</a></p>
+</td></tr>"""
+        for i, (title, body) in enumerate(articles)
+    )
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><style>td {{ font-family: Arial; }} .article {{ padding: 12px; }}</style></head>
+<body>
+<table width="100%"><tr><td><a href="{track}/web">View in browser</a></td></tr>
+<tr><td>{logo}</td></tr>
+<tr><td><h1>{subject}</h1><p>Hi there, welcome to this week's issue of {sender}.</p></td></tr>
+{rows}
+<tr><td><p>You're receiving this because you subscribed to {sender}.</p>
+<p><a href="{track}/unsub">Unsubscribe</a> | <a href="{track}/prefs">Manage preferences</a></p>
+<p>&copy; 2026 {sender}. All rights reserved.</p></td></tr>
+</table></body></html>"""
+
+
+def _plain(subject: str, articles: list[tuple[str, str]]) -> str:
+    parts = [subject, ""]
+    for title, body in articles:
+        parts += [title, body, ""]
+    parts.append("Unsubscribe: https://click.example.com/unsub")
+    return "\n".join(parts)
+
+
+def build_message(rng: random.Random, sender: tuple[str, str], subject: str,
+                  articles: list[tuple[str, str]], date: datetime,
+                  attachment_ratio: float, inline_ratio: float) -> bytes:
+    """Armar un newsletter multipart y retornar sus bytes RFC822 (CRLF)."""
+    inline_logo = rng.random() < inline_ratio
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = f"{sender[0]} <{sender[1]}>"
+    msg["To"] = "bench@example.com"
+    msg["Date"] = format_datetime(date)
+    msg["Message-ID"] = make_msgid(domain=sender[1].split("@")[1])
+    msg["List-Unsubscribe"] = "<https://click.example.com/unsub>"
+
+    msg.set_content(_plain(subject, articles), cte="quoted-printable")
+    msg.add_alternative(_html(sender[0], subject, articles, inline_logo, rng),
+                        subtype="html", cte="quoted-printable")
+    if inline_logo:
+        html_part = msg.get_payload()[1]
+        html_part.add_related(rng.randbytes(rng.randint(4_000, 20_000)), maintype="image",
+                              subtype="png", cid="<logo>")
+    if rng.random() < attachment_ratio:
+        msg.add_attachment(rng.randbytes(rng.randint(20_000, 80_000)), maintype="application",
+                           subtype="pdf", filename=f"report-{rng.randint(1, 999)}.pdf")
+    return msg.as_bytes(policy=email.policy.SMTP)
+
+
+def generate_mailbox(count: int, seed: int = 0, days: int = 6,
+                     attachment_ratio: float = 0.2, inline_ratio: float = 0.3,
+                     resend_ratio: float = 0.1, label: str = "bench",
+                     now: datetime | None = None) -> list[MailboxMessage]:
+    """
+    Generar `count` mensajes repartidos en los últimos `days` días, con UIDs
+    crecientes en orden de llegada.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    start = now - timedelta(days=days)
+    step = timedelta(days=days) / max(count, 1)
+
+    messages = []
+    sent: list[tuple[str, list]] = []
+    for i in range(count):
+        date = (start + step * i).replace(microsecond=0)
+        sender = rng.choice(SENDERS)
+        if sent and rng.random() < resend_ratio:
+            # Mismo contenido desde otro remitente o re-envío con otro asunto
+            subject, articles = rng.choice(sent)
+            subject = rng.choice(["Fwd: ", "[Resend] ", "Re: ", ""]) + subject
+        else:
+            articles = _articles(rng)
+            subject = f"{sender[0]} #{i + 1}: {articles[0][0]}"
+            sent.append((subject, articles))
+            sent = sent[-200:]
+
+        raw = build_message(rng, sender, subject, articles, date, attachment_ratio, inline_ratio)
+        messages.append(MailboxMessage(
+            uid=i + 1,
+            gmail_msgid=1_700_000_000_000_000_000 + i * 7919,
+            internaldate=date,
+            raw=raw,
+            labels=(label,),
+        ))
+    return messages
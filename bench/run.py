@@ -0,0 +1,413 @@
+"""
+Benchmark offline: Gmail → LLM → Notion contra servidores locales.
+
+Para cada tamaño de mailbox levanta el servidor IMAP, el endpoint de chat
+completions y la API de Notion falsos, y corre cada etapa en un proceso
+propio (así el pico de RSS es el de esa etapa):
+
+- fetch: GmailClient.find_messages + iter_newsletters (IMAP + parseo)
+- summarize: PromptCompactor + NewsletterSummarizer (backend openai → fake_llm)
+- notion: NotionClient.add_newsletters en batches
+- e2e: digest.py completo, como se corre todos los días
+- backfill: digest.py --backfill (opcional: --stages ...,backfill)
+
+Cada etapa usa como entrada la salida de la anterior. Reporta mensajes/s,
+percentiles de latencia de la operación principal y pico de RSS; con
+--output guarda además los reportes de métricas completos en JSON.
+
+Uso:
+    python -m bench.run                          # 10, 100 y 1000 mensajes
+    python -m bench.run --sizes 10000 --stages fetch --fetch-mode partial
+    python -m bench.run --llm-tpm 12000 --llm-rpm 30 --notion-rps 3   # límites reales
+    python -m bench.run --sizes 400,1600,4000 --stages backfill --per-day 40
+"""
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+STAGES = ("fetch", "summarize", "notion", "e2e", "backfill")
+DEFAULT_STAGES = ("fetch", "summarize", "notion", "e2e")
+LABEL = "bench"
+NOTION_BATCH_SIZE = 10
+
+# Operación cuyos percentiles se muestran por etapa
+KEY_TIMINGS = {
+    "fetch": "imap.fetch",
+    "summarize": "llm.request",
+    "notion": "notion.request",
+    "e2e": "llm.request",
+    "backfill": "llm.request",
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} no es serializable")
+
+
+def _read_jsonl(path: Path) -> list[dict]:
+    with path.open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# --- etapas (corren en el proceso hijo) ---
+
+def _stage_fetch(args, workdir: Path) -> int:
+    from gmail_client import GmailClient
+    from metrics import metrics
+
+    client = GmailClient(
+        fetch_mode=args.fetch_mode,
+        fetch_workers=args.fetch_workers,
+        parse_workers=args.parse_workers,
+        cache=None,
+    ).authenticate()
+    count = 0
+    try:
+        with (workdir / "fetched.jsonl").open("w", encoding="utf-8") as out, \
+                metrics.timer("bench.stage"):
+            uids = client.find_messages(LABEL, args.days)
+            for nl in client.iter_newsletters(uids):
+                out.write(json.dumps(nl, default=_json_default, ensure_ascii=False) + "\n")
+                count += 1
+    finally:
+        client.close()
+    return count
+
+
+def _stage_summarize(args, workdir: Path) -> int:
+    from compaction import PromptCompactor
+    from metrics import metrics
+    from summarizer import NewsletterSummarizer
+
+    newsletters = _read_jsonl(workdir / "fetched.jsonl")
+    for nl in newsletters:
+        nl["date"] = datetime.fromisoformat(nl["date"])
+
+    summarizer = NewsletterSummarizer(cache=None, concurrency=args.llm_concurrency, backend="openai")
+    compactor = PromptCompactor()
+    count = 0
+    try:
+        with (workdir / "results.jsonl").open("w", encoding="utf-8") as out, \
+                metrics.timer("bench.stage"):
+            for results in summarizer.iter_batches(compactor.iter_compact(newsletters),
+                                                   total=len(newsletters)):
+                for result in results:
+                    out.write(json.dumps(result, default=_json_default, ensure_ascii=False) + "\n")
+                count += len(results)
+    finally:
+        summarizer.close()
+    return count
+
+
+def _stage_notion(args, workdir: Path) -> int:
+    from metrics import metrics
+    from notion_client import NotionClient
+
+    results = _read_jsonl(workdir / "results.jsonl")
+    notion = NotionClient()
+    count = 0
+    with metrics.timer("bench.stage"):
+        for start in range(0, len(results), NOTION_BATCH_SIZE):
+            with metrics.timer("stage.notion"):
+                stats = notion.add_newsletters(results[start:start + NOTION_BATCH_SIZE])
+            count += stats["success"] + stats["skipped"]
+    return count
+
+
+CHILD_STAGES = {
+    "fetch": _stage_fetch,
+    "summarize": _stage_summarize,
+    "notion": _stage_notion,
+}
+
+
+def child_main(args):
+    """Correr una etapa y dejar su resultado y métricas en --result."""
+    from metrics import metrics
+
+    workdir = Path(args.workdir)
+    metrics.reset()
+    started = time.perf_counter()
+    count = CHILD_STAGES[args.child](args, workdir)
+    wall = time.perf_counter() - started
+    Path(args.result).write_text(json.dumps({
+        "messages": count,
+        "wall_seconds": wall,
+        "report": metrics.report(),
+    }))
+
+
+# --- orquestación (proceso padre) ---
+
+def _peak_rss_kb(pid: int) -> int | None:
+    """VmHWM del proceso (Linux), o None si no se puede leer."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _run_process(cmd: list[str], env: dict, log_path: Path) -> tuple[int, float, float]:
+    """Correr un proceso hijo; retorna (returncode, segundos, pico de RSS en MB)."""
+    started = time.perf_counter()
+    peak_kb = None
+    with log_path.open("w") as log:
+        proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        while True:
+            pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            # En Linux, ru_maxrss del hijo incluye el RSS del padre al momento
+            # del fork/exec (que acá tiene el mailbox entero en memoria); VmHWM
+            # es solo el del programa del hijo
+            peak_kb = _peak_rss_kb(proc.pid) or peak_kb
+            time.sleep(0.05)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - started
+    if peak_kb is not None:
+        return proc.returncode, elapsed, peak_kb / 1024
+    # ru_maxrss: KB en Linux, bytes en macOS
+    rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return proc.returncode, elapsed, rss_mb
+
+
+def _child_env(args, workdir: Path, imap, llm, notion) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "IMAP_HOST": "127.0.0.1",
+        "IMAP_PORT": str(imap.port),
+        "IMAP_SSL": "0",
+        "GMAIL_EMAIL": "bench@example.com",
+        "GMAIL_APP_PASSWORD": "bench",
+        "LLM_BACKEND": "openai",
+        "LLM_BASE_URL": llm.base_url,
+        "LLM_MODEL": "bench-model",
+        "NOTION_TOKEN": "bench",
+        "NOTION_DATABASE_ID": "bench-database",
+        "NOTION_BASE_URL": notion.base_url,
+        # El cliente respeta el mismo límite que el servidor (o ninguno)
+        "NOTION_REQUESTS_PER_SECOND": str(args.notion_rps or 1000),
+        "MESSAGE_CACHE_FILE": str(workdir / "message_cache.db"),
+        "LLM_CACHE_FILE": str(workdir / "llm_cache.db"),
+        "SYNC_STATE_FILE": str(workdir / "sync_state.json"),
+        "NOTION_INDEX_FILE": str(workdir / "notion_index.db"),
+        "BOILERPLATE_FILE": str(workdir / "boilerplate.json"),
+        "DIGEST_JOURNAL_FILE": str(workdir / "journal.jsonl"),
+        "PYTHONUNBUFFERED": "1",
+    })
+    if args.llm_tpm:
+        env["LLM_TOKENS_PER_MINUTE"] = str(args.llm_tpm)
+    if args.llm_rpm:
+        env["LLM_REQUESTS_PER_MINUTE"] = str(args.llm_rpm)
+    env.pop("METRICS_DIR", None)
+    return env
+
+
+def _common_flags(args) -> list[str]:
+    return [
+        "--fetch-mode", args.fetch_mode,
+        "--fetch-workers", str(args.fetch_workers),
+        "--parse-workers", str(args.parse_workers),
+        "--llm-concurrency", str(args.llm_concurrency),
+    ]
+
+
+def _row(stage: str, size: int, returncode: int, elapsed: float, rss_mb: float,
+         messages: int, report: dict) -> dict:
+    timing = report.get("timings", {}).get(KEY_TIMINGS[stage], {})
+    return {
+        "stage": stage,
+        "size": size,
+        "ok": returncode == 0,
+        "messages": messages,
+        "wall_seconds": round(elapsed, 3),
+        "messages_per_second": round(messages / elapsed, 2) if elapsed else 0.0,
+        "latency_metric": KEY_TIMINGS[stage],
+        "p50_seconds": timing.get("p50_seconds"),
+        "p95_seconds": timing.get("p95_seconds"),
+        "p99_seconds": timing.get("p99_seconds"),
+        "peak_rss_mb": round(rss_mb, 1),
+        "report": report,
+    }
+
+
+def run_size(args, size: int) -> list[dict]:
+    from bench.fake_llm import FakeLLMServer
+    from bench.fake_notion import FakeNotionServer
+    from bench.imap_server import BenchIMAPServer
+    from bench.mailbox import generate_mailbox
+
+    days = args.days
+    mailbox_days = 6
+    if args.per_day:
+        # Densidad constante: el backlog crece en días, no en mensajes por día
+        mailbox_days = max(1, math.ceil(size / args.per_day))
+        days = mailbox_days + 1
+
+    print(f"\n📬 {size} mensajes: generando mailbox...")
+    mailbox = generate_mailbox(size, seed=args.seed, days=mailbox_days, label=LABEL)
+    megabytes = sum(len(m.raw) for m in mailbox) / 1e6
+    print(f"   {megabytes:.1f} MB de RFC822")
+
+    imap = BenchIMAPServer({LABEL: mailbox}, latency=args.imap_latency).start()
+    llm = FakeLLMServer(args.llm_latency, args.llm_tpm or None, args.llm_rpm or None).start()
+    notion = FakeNotionServer(args.notion_latency, args.notion_rps or None).start()
+
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"bench_{size}_") as tmp:
+            workdir = Path(tmp)
+            env = _child_env(args, workdir, imap, llm, notion)
+
+            for stage in args.stages:
+                result_path = workdir / f"{stage}_result.json"
+                log_path = workdir / f"{stage}.log"
+
+                if stage in ("e2e", "backfill"):
+                    # Estado limpio: sin caches, índice ni páginas de las etapas anteriores
+                    notion.reset()
+                    for name in ("notion_index.db", "boilerplate.json", "journal.jsonl"):
+                        (workdir / name).unlink(missing_ok=True)
+                    metrics_dir = workdir / f"{stage}_metrics"
+                    cmd = [sys.executable, "digest.py", "--label", LABEL, "--days", str(days),
+                           "--max", str(size), "--llm-backend", "openai", "--no-cache",
+                           "--metrics", str(metrics_dir),
+                           "--output", str(workdir / f"digest_{stage}.json"), *_common_flags(args)]
+                    if stage == "backfill":
+                        cmd += ["--backfill", "--backfill-window", "1"]
+                else:
+                    cmd = [sys.executable, "-m", "bench.run", "--child", stage,
+                           "--workdir", str(workdir), "--result", str(result_path),
+                           "--days", str(days), *_common_flags(args)]
+
+                print(f"   ⏱️  {stage}...", end=" ", flush=True)
+                returncode, elapsed, rss_mb = _run_process(cmd, env, log_path)
+
+                report = {}
+                messages = 0
+                if stage in ("e2e", "backfill"):
+                    reports = sorted(metrics_dir.glob("digest_report_*.json")) if metrics_dir.exists() else []
+                    if reports:
+                        report = json.loads(reports[-1].read_text())
+                    messages = int(report.get("counters", {}).get("messages.parsed", 0))
+                elif result_path.exists():
+                    child = json.loads(result_path.read_text())
+                    report = child["report"]
+                    messages = child["messages"]
+
+                row = _row(stage, size, returncode, elapsed, rss_mb, messages, report)
+                rows.append(row)
+                if returncode != 0:
+                    print(f"❌ falló (código {returncode})")
+                    print("      " + "\n      ".join(log_path.read_text().splitlines()[-15:]))
+                    if stage not in ("e2e", "backfill"):
+                        # Las etapas siguientes dependen de esta salida
+                        break
+                else:
+                    print(f"{elapsed:.2f}s, {row['messages_per_second']} msg/s, "
+                          f"pico {row['peak_rss_mb']} MB")
+    finally:
+        imap.stop()
+        llm.stop()
+        notion.stop()
+    return rows
+
+
+def _fmt(value) -> str:
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def print_table(rows: list[dict]):
+    print()
+    header = f"{'etapa':<10} {'tamaño':>6} {'msgs':>6} {'seg':>8} {'msg/s':>8} " \
+             f"{'métrica':<15} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'RSS MB':>7}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        status = "" if row["ok"] else "  ❌"
+        print(f"{row['stage']:<10} {row['size']:>6} {row['messages']:>6} {row['wall_seconds']:>8.2f} "
+              f"{row['messages_per_second']:>8.2f} {row['latency_metric']:<15} "
+              f"{_fmt(row['p50_seconds']):>7} {_fmt(row['p95_seconds']):>7} "
+              f"{_fmt(row['p99_seconds']):>7} {row['peak_rss_mb']:>7.1f}{status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del pipeline de newsletters")
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="Tamaños de mailbox separados por coma (default: 10,100,1000)")
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                        help=f"Etapas a correr: {', '.join(STAGES)} (default: {','.join(DEFAULT_STAGES)})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--per-day", type=int, default=0,
+                        help="Mensajes por día: el mailbox abarca tamaño/per-day días "
+                             "(0 = todo en los últimos 6 días)")
+    parser.add_argument("--fetch-mode", choices=["full", "partial"], default="full")
+    parser.add_argument("--fetch-workers", type=int, default=1)
+    parser.add_argument("--parse-workers", type=int, default=0)
+    parser.add_argument("--llm-concurrency", type=int, default=1)
+    parser.add_argument("--imap-latency", type=float, default=0.005,
+                        help="Segundos por comando IMAP (default: 0.005)")
+    parser.add_argument("--llm-latency", type=float, default=0.2,
+                        help="Segundos por request al LLM (default: 0.2)")
+    parser.add_argument("--llm-tpm", type=int, default=0,
+                        help="Tokens por minuto del LLM (0 = sin límite; Groq free: 12000)")
+    parser.add_argument("--llm-rpm", type=int, default=0,
+                        help="Requests por minuto del LLM (0 = sin límite; Groq free: 30)")
+    parser.add_argument("--notion-latency", type=float, default=0.02,
+                        help="Segundos por request a Notion (default: 0.02)")
+    parser.add_argument("--notion-rps", type=float, default=0,
+                        help="Requests por segundo de Notion (0 = sin límite; real: 3)")
+    parser.add_argument("--output", "-o", help="Guardar resultados y reportes completos en JSON")
+    # Uso interno: correr una etapa en el proceso hijo
+    parser.add_argument("--child", choices=list(CHILD_STAGES), help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(args)
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    args.stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"etapas desconocidas: {', '.join(sorted(unknown))}")
+
+    rows = []
+    for size in sizes:
+        rows.extend(run_size(args, size))
+    print_table(rows)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "settings": {k: v for k, v in vars(args).items()
+                         if k not in ("child", "workdir", "result", "output")},
+            "results": rows,
+        }, indent=2))
+        print(f"\n📄 Resultados: {args.output}")
+
+    if not all(row["ok"] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Compactación del cuerpo de los newsletters antes de enviarlos al LLM.
+
+El texto de html2text empieza casi siempre con links de tracking, "ver en el
+navegador" y otros restos de plantilla. Esta etapa (entre GmailClient y
+NewsletterSummarizer) deja solo el contenido útil:
+
+1. Quita URLs de links markdown, imágenes y URLs sueltas.
+2. Quita líneas de plantilla: patrones genéricos (unsubscribe, view in
+   browser...) y líneas que se repiten en varios mensajes del mismo remitente,
+   aprendidas entre ejecuciones en un archivo local.
+3. Colapsa espacios.
+4. Si el texto sigue excediendo el presupuesto de tokens por newsletter,
+   elige las oraciones más informativas (en su orden original).
+
+El resultado se guarda en newsletter["prompt_body"]; el cuerpo original no se toca.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter
+from email.utils import parseaddr
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from rate_limiter import estimate_tokens
+
+DEFAULT_BOILERPLATE_FILE = ".boilerplate.json"
+
+# Tokens del cuerpo que se envían por newsletter (~800 caracteres)
+PROMPT_ITEM_TOKENS = int(os.getenv("PROMPT_ITEM_TOKENS", "200"))
+
+# Una línea es plantilla si aparece en al menos N mensajes distintos del remitente
+BOILERPLATE_MIN_MESSAGES = 3
+# Límites del archivo de aprendizaje por remitente
+MAX_LINES_PER_SENDER = 500
+MAX_MESSAGES_PER_SENDER = 200
+
+_IMAGE_RE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+_LINK_RE = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_URL_RE = re.compile(r"(?:https?://|www\.)\S+")
+_MARKDOWN_RE = re.compile(r"[*#>|`]+")
+_SPACES_RE = re.compile(r"[ \t\xa0]+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD_RE = re.compile(r"[^\W\d_]{3,}")
+
+_GENERIC_BOILERPLATE = re.compile(
+    r"view (this|it)? ?(email|in (your |a |the )?browser|online)|ver (en|este correo en) (el|tu) navegador"
+    r"|unsubscribe|darse de baja|cancelar (la )?suscripci[oó]n|manage (your )?(preferences|subscription)"
+    r"|update your preferences|you('| a)re receiving this|recibes este correo|forwarded this email"
+    r"|privacy policy|pol[ií]tica de privacidad|all rights reserved|todos los derechos reservados"
+    r"|sent to .+@|add us to your address book|read online|open in app|powered by",
+    re.IGNORECASE,
+)
+
+_STOPWORDS = set("""
+the and for that this with you your are was were from have has but not all can will
+our more about into they their them what when which who how its out new one also just
+los las del que con para por una sus como pero más este esta estos estas son fue ser
+hay muy sin sobre entre cuando también desde hasta donde porque cada otro otra
+""".split())
+
+
+def _normalize_line(line: str) -> str:
+    """Normalizar una línea para detectar repeticiones (sin dígitos ni mayúsculas)."""
+    return re.sub(r"\d+", "#", line.lower()).strip()
+
+
+def _line_hash(line: str) -> str:
+    return hashlib.sha1(_normalize_line(line).encode()).hexdigest()[:12]
+
+
+def strip_markup(text: str) -> str:
+    """Quitar imágenes, URLs de links (dejando el texto) y URLs sueltas."""
+    text = _IMAGE_RE.sub("", text)
+    text = _LINK_RE.sub(r"\1", text)
+    text = _URL_RE.sub("", text)
+    return _MARKDOWN_RE.sub("", text)
+
+
+def select_sentences(text: str, budget_tokens: int) -> str:
+    """
+    Elegir las oraciones más informativas hasta `budget_tokens`.
+
+    Puntaje: frecuencia en el documento de sus palabras de contenido,
+    normalizada por largo, con un bonus para las primeras oraciones.
+    Las elegidas se devuelven en su orden original.
+    """
+    if estimate_tokens(text) <= budget_tokens:
+        return text
+
+    sentences = [s.strip() for s in _SENTENCE_RE.split(text) if s and s.strip()]
+    doc_words = Counter(
+        w for w in _WORD_RE.findall(text.lower()) if w not in _STOPWORDS
+    )
+
+    scored = []
+    for i, sentence in enumerate(sentences):
+        words = {w for w in _WORD_RE.findall(sentence.lower()) if w not in _STOPWORDS}
+        if not words:
+            continue
+        score = sum(doc_words[w] for w in words) / math.sqrt(len(words) + 1)
+        score *= 1.5 if i < 3 else 1.0
+        scored.append((score, i, sentence))
+
+    chosen = []
+    used = 0
+    for score, i, sentence in sorted(scored, reverse=True):
+        tokens = estimate_tokens(sentence)
+        if used + tokens > budget_tokens:
+            continue
+        chosen.append((i, sentence))
+        used += tokens
+
+    if not chosen:
+        return text[:budget_tokens * 4]
+    return " ".join(sentence for _, sentence in sorted(chosen))
+
+
+class PromptCompactor:
+    def __init__(self, path: str | None = None, budget_tokens: int | None = None):
+        self.path = Path(path or os.getenv("BOILERPLATE_FILE", DEFAULT_BOILERPLATE_FILE))
+        self.budget_tokens = budget_tokens or PROMPT_ITEM_TOKENS
+        self._senders = self._load()
+
+    def _load(self) -> dict:
+        """Leer lo aprendido en ejecuciones anteriores."""
+        if not self.path.exists():
+            return {}
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def save(self):
+        """Persistir las líneas de plantilla aprendidas."""
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self._senders))
+        os.replace(tmp, self.path)
+
+    def _learn(self, sender: str, message_id: str, lines: list[str]) -> set[str]:
+        """
+        Registrar las líneas de un mensaje y retornar los hashes que son
+        plantilla para ese remitente.
+        """
+        entry = self._senders.setdefault(sender, {"messages": [], "lines": {}})
+        counts = entry["lines"]
+
+        # Contar cada mensaje una sola vez aunque se re-procese
+        if message_id not in entry["messages"]:
+            entry["messages"] = (entry["messages"] + [message_id])[-MAX_MESSAGES_PER_SENDER:]
+            for h in {_line_hash(line) for line in lines}:
+                counts[h] = counts.get(h, 0) + 1
+            if len(counts) > MAX_LINES_PER_SENDER:
+                keep = sorted(counts.items(), key=lambda kv: kv[1], reverse=True)
+                entry["lines"] = dict(keep[:MAX_LINES_PER_SENDER])
+
+        return {h for h, n in entry["lines"].items() if n >= BOILERPLATE_MIN_MESSAGES}
+
+    def compact_text(self, body: str, sender: str = "", message_id: str = "") -> str:
+        """Compactar un cuerpo de texto (ver docstring del módulo)."""
+        if not body:
+            return ""
+
+        lines = [line.strip() for line in strip_markup(body).splitlines()]
+        lines = [_SPACES_RE.sub(" ", line) for line in lines if line]
+
+        boilerplate = self._learn(sender, message_id, lines) if sender else set()
+        lines = [
+            line for line in lines
+            if not _GENERIC_BOILERPLATE.search(line) and _WORD_RE.search(line)
+        ]
+        # Si todo parece plantilla (p.ej. un remitente que repite el mismo texto),
+        # mejor mandar las líneas sin filtrar que un cuerpo vacío
+        kept = [line for line in lines if _line_hash(line) not in boilerplate] or lines
+
+        return select_sentences("\n".join(kept), self.budget_tokens)
+
+    def compact(self, newsletter: dict) -> dict:
+        """Agregar newsletter["prompt_body"] con el cuerpo compactado."""
+        sender = parseaddr(newsletter.get("from", ""))[1].lower()
+        newsletter["prompt_body"] = self.compact_text(
+            newsletter.get("body", ""), sender, str(newsletter.get("id", ""))
+        )
+        return newsletter
+
+    def iter_compact(self, newsletters: Iterable[dict]) -> Iterator[dict]:
+        """Compactar newsletters a medida que llegan (etapa del pipeline)."""
+        for newsletter in newsletters:
+            yield self.compact(newsletter)
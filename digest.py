@@ -9,6 +9,10 @@ Uso:
     python digest.py --dry-run          # Solo generar JSON, no enviar
     python digest.py --label "News"     # Especificar label
     python digest.py --days 14          # Últimos 14 días
+    python digest.py --incremental      # Solo mensajes no vistos en ejecuciones previas
+    python digest.py --watch            # Quedarse escuchando (IMAP IDLE) y procesar al llegar
+    python digest.py --backfill --days 365   # Backlog de meses con memoria acotada
+    python digest.py --route "ml" --route "papers@trabajo=abc123"   # Varios labels/cuentas
     python digest.py --list-labels      # Listar labels disponibles
     python digest.py --setup-notion     # Ver instrucciones de Notion
 """
@@ -16,8 +20,9 @@ Uso:
 import argparse
 import json
 import os
+import signal
 import sys
-from datetime import datetime
+from datetime import date, datetime
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -25,6 +30,476 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def make_sink(journal, notion):
+    """Función que registra cada batch en el journal y lo envía a Notion."""
+    from notion_index import duplicate_gmail_ids, gmail_id_from_link
+
+    def sink(results: list[dict]) -> dict:
+        journal.record_summarized(
+            [(gmail_id_from_link(result.get("link")), result) for result in results]
+        )
+        if notion is None:
+            return {}
+        batch_stats = notion.add_newsletters(results)
+        # Los casi duplicados colapsados quedan escritos con la página de su representante
+        by_link = {result.get("link"): result for result in results}
+        journal.record_written([
+            (gmail_id, page_id)
+            for link, page_id in batch_stats["pages"]
+            for gmail_id in [gmail_id_from_link(link), *duplicate_gmail_ids(by_link.get(link, {}))]
+        ])
+        return batch_stats
+
+    return sink
+
+
+def record_collapsed(near_dups, notion, journal):
+    """
+    Registrar los casi duplicados colapsados en páginas ya creadas.
+
+    Quedan como alias en el índice de Notion y como escritos en el journal,
+    así ni una ejecución completa ni --resume los vuelven a procesar. Los
+    que colapsaron en un representante que no llegó a Notion se reintentan.
+    """
+    if near_dups is None or notion is None:
+        return
+    by_page = {}
+    for gmail_id, rep_id in near_dups.pop_collapsed():
+        page_id = notion.index.page_for_gmail_id(rep_id)
+        if page_id:
+            by_page.setdefault(page_id, []).append(gmail_id)
+    for page_id, gmail_ids in by_page.items():
+        notion.index.add_aliases(page_id, gmail_ids)
+        journal.record_written([(gmail_id, page_id) for gmail_id in gmail_ids])
+
+
+def make_route_sink(journal, notions: dict, default_route: str):
+    """
+    Sink para varias rutas: reparte cada batch según el campo "ruta" de los
+    resultados y lo envía a la base de Notion de cada una.
+
+    `notions` es {nombre de ruta: NotionClient o None}; los resultados sin
+    ruta conocida (p.ej. de un journal anterior) van a `default_route`.
+    """
+    sinks = {name: make_sink(journal, notion) for name, notion in notions.items()}
+
+    def sink(results: list[dict]) -> dict:
+        by_route = {}
+        for result in results:
+            name = result.get("ruta") if result.get("ruta") in sinks else default_route
+            by_route.setdefault(name, []).append(result)
+
+        stats = {"success": 0, "failed": 0, "skipped": 0, "errors": [], "pages": []}
+        for name, route_results in by_route.items():
+            route_stats = sinks[name](route_results)
+            for key in ("success", "failed", "skipped"):
+                stats[key] += route_stats.get(key, 0)
+            stats["errors"].extend(route_stats.get("errors", []))
+            stats["pages"].extend(route_stats.get("pages", []))
+        return stats
+
+    return sink
+
+
+def make_search_filter(args):
+    """Filtro de remitentes y consulta de Gmail de la línea de comandos (o del .env)."""
+    from search_filter import SearchFilter
+    return SearchFilter(allow=args.allow_from, deny=args.deny_from, query=args.gmail_query)
+
+
+def replay_journal(journal, verbose: bool = True) -> tuple[set[str], list[dict]]:
+    """
+    Leer el journal de una ejecución cortada (--resume, o el batch anterior en --watch).
+
+    Returns:
+        (IDs que no hay que volver a procesar, resultados ya clasificados
+        que falta enviar a Notion)
+    """
+    from notion_index import duplicate_gmail_ids
+
+    state = journal.replay()
+    written = {msg_id for msg_id, entry in state.items() if entry["stage"] == "written"}
+    summarized = {
+        msg_id: entry["result"] for msg_id, entry in state.items()
+        if entry["stage"] == "summarized" and entry["result"]
+    }
+    # Los casi duplicados colapsados en un resultado viajan con él
+    collapsed = {
+        gmail_id for entry in state.values() if entry["result"]
+        for gmail_id in duplicate_gmail_ids(entry["result"])
+    }
+    if state and (verbose or summarized):
+        print(f"♻️  Retomando: {len(written)} ya enviados, {len(summarized)} clasificados sin enviar")
+    elif verbose:
+        print("♻️  No hay ejecución para retomar, se procesa normalmente")
+    return written | set(summarized) | collapsed, list(summarized.values())
+
+
+def run_watch(args, gmail, notion):
+    """
+    Modo --watch: esperar en IMAP IDLE y procesar micro-batches al llegar.
+
+    Cada batch es una búsqueda incremental (UID > watermark), así que un
+    corte en cualquier punto se recupera en el siguiente batch. El índice de
+    Notion se vuelve a sincronizar cada NOTION_FULL_SYNC_HOURS.
+    """
+    from compaction import PromptCompactor
+    from journal import RunJournal
+    from llm_cache import LLMCache
+    from metrics import metrics
+    from neardup import NearDuplicateFilter
+    from pipeline import run_pipeline
+    from summarizer import NewsletterSummarizer
+    from watch import MicroBatcher, watch
+
+    summarizer = NewsletterSummarizer(
+        cache=None if args.no_cache else LLMCache(),
+        concurrency=args.llm_concurrency,
+        backend=args.llm_backend,
+    )
+    journal = RunJournal()
+    sink = make_sink(journal, notion)
+    compactor = None if args.no_compact else PromptCompactor()
+    # Los casi duplicados se agrupan dentro del mismo día
+    near_dups = {"day": None, "filter": None}
+
+    def process():
+        # Lo que quedó de un batch fallido: lo ya clasificado se re-envía sin
+        # pasar por el LLM y lo ya enviado no se vuelve a buscar
+        done_ids, pending = replay_journal(journal, verbose=False)
+        known_ids = set(done_ids)
+        if notion and not args.reprocess:
+            known_ids |= notion.known_gmail_ids()
+        uids = gmail.find_messages(args.label, args.days, incremental=True,
+                                   exclude_ids=known_ids or None)
+        if not uids and not pending:
+            gmail.commit_sync_state()
+            return
+
+        if not args.no_near_dup and near_dups["day"] != date.today():
+            near_dups.update(day=date.today(), filter=NearDuplicateFilter())
+
+        journal.open(resume=True)
+        try:
+            resent = sink(pending) if pending else {}
+            newsletters = journal.iter_fetched(gmail.iter_newsletters(uids))
+            if near_dups["filter"]:
+                newsletters = near_dups["filter"].iter_unique(newsletters)
+            if compactor:
+                newsletters = compactor.iter_compact(newsletters)
+            processed, stats = run_pipeline(newsletters, summarizer, total=len(uids), sink=sink)
+            record_collapsed(near_dups["filter"], notion, journal)
+        finally:
+            journal.close()
+        for key in ("success", "failed", "skipped"):
+            stats[key] += resent.get(key, 0)
+
+        print(f"✅ {datetime.now():%H:%M} · {len(pending) + len(processed)} procesados: "
+              f"{stats['success']} enviados, {stats['skipped']} saltados, {stats['failed']} fallidos")
+        if compactor:
+            compactor.save()
+        if args.metrics:
+            metrics.write(args.metrics)
+        if stats['failed']:
+            # Sin avanzar el watermark ni borrar el journal: watch() reintenta
+            # el batch con backoff y el próximo process() retoma desde el journal.
+            # El filtro ya vio estos mensajes: en el reintento se colapsarían
+            # contra sí mismos, así que se descarta el del día
+            near_dups.update(day=None, filter=None)
+            raise RuntimeError(f"{stats['failed']} newsletters sin llegar a Notion")
+        gmail.commit_sync_state()
+        journal.finish()
+
+    # SIGTERM (systemd, launchd) corta igual que Ctrl+C: se cierra todo en orden
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        watch(gmail, args.label, process,
+              MicroBatcher(args.watch_max_batch, args.watch_max_latency))
+    except KeyboardInterrupt:
+        print("\n👋 Saliendo del modo watch")
+    finally:
+        gmail.close()
+        summarizer.close()
+        journal.close()
+        if compactor:
+            compactor.save()
+
+
+def run_backfill(args, gmail, notion, known_ids: set, resumed: list[dict]):
+    """
+    Modo --backfill: procesar un backlog de meses con memoria acotada.
+
+    Busca por ventanas de días y no acumula nada en memoria: cada batch
+    clasificado va al journal, a Notion y a un JSON Lines de salida. El
+    pico de RSS depende del tamaño de los batches, no del backlog.
+    """
+    from compaction import PromptCompactor
+    from journal import RunJournal
+    from llm_cache import LLMCache
+    from metrics import metrics
+    from neardup import NearDuplicateFilter
+    from pipeline import run_pipeline
+    from summarizer import NewsletterSummarizer
+
+    summarizer = NewsletterSummarizer(
+        cache=None if args.no_cache else LLMCache(),
+        concurrency=args.llm_concurrency,
+        backend=args.llm_backend,
+    )
+    journal = RunJournal().open(resume=args.resume)
+    output_file = args.output or f"digest_backfill_{datetime.now().strftime('%Y-%m-%d')}.jsonl"
+    output = open(output_file, "a" if args.resume else "w", encoding="utf-8")
+    send = make_sink(journal, notion)
+    written = 0
+
+    def sink(results: list[dict]) -> dict:
+        nonlocal written
+        for result in results:
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()
+        written += len(results)
+        return send(results)
+
+    def newsletters():
+        for uids in gmail.iter_backfill(args.label, args.days, args.backfill_window,
+                                        exclude_ids=known_ids or None):
+            yield from gmail.iter_newsletters(uids)
+
+    stream = journal.iter_fetched(newsletters())
+    near_dups = None if args.no_near_dup else NearDuplicateFilter()
+    if near_dups:
+        stream = near_dups.iter_unique(stream)
+    compactor = None if args.no_compact else PromptCompactor()
+    if compactor:
+        stream = compactor.iter_compact(stream)
+
+    print(f"🤖 Backfill de {args.days} días con {summarizer.backend.label}...")
+    try:
+        stats = sink(resumed) if resumed else {}
+        _, pipeline_stats = run_pipeline(stream, summarizer, sink=sink, collect=False)
+        record_collapsed(near_dups, notion, journal)
+    finally:
+        gmail.close()
+        summarizer.close()
+        journal.close()
+        output.close()
+        if compactor:
+            compactor.save()
+        if args.metrics:
+            report_path, prom_path = metrics.write(args.metrics)
+            print(f"📊 Métricas: {report_path} y {prom_path}")
+
+    for key in ("success", "failed", "skipped"):
+        pipeline_stats[key] += stats.get(key, 0)
+    print(f"\n✅ Procesados {written} newsletters → {output_file}")
+    if near_dups and near_dups.collapsed:
+        print(f"🔗 {near_dups.collapsed} casi duplicados agrupados (ver 'otras_fuentes')")
+    if notion is not None:
+        print(f"   ✅ Enviados: {pipeline_stats['success']}")
+        print(f"   ⏭️  Saltados: {pipeline_stats['skipped']} (duplicados)")
+        print(f"   ❌ Fallidos: {pipeline_stats['failed']}")
+    if pipeline_stats['failed']:
+        print("\n   La próxima ejecución con --backfill retoma los fallidos (lo ya clasificado no vuelve al LLM)")
+    else:
+        journal.finish()
+
+
+def run_routes(args, routes: list):
+    """
+    Varias rutas (label, cuenta, base de Notion) en una sola ejecución.
+
+    Cada ruta busca y descarga con su propia conexión IMAP, en paralelo, y
+    todas alimentan un único summarizer (un solo rate limit de Groq) que
+    las atiende por turnos. Cada resultado se envía a la base de su ruta.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from compaction import PromptCompactor
+    from gmail_client import GmailClient
+    from journal import RunJournal
+    from llm_cache import LLMCache
+    from message_cache import MessageCache
+    from metrics import metrics
+    from neardup import NearDuplicateFilter
+    from notion_client import NotionClient
+    from pipeline import merge_fair, run_pipeline
+    from summarizer import NewsletterSummarizer
+    from sync_state import SyncState
+
+    search_filter = make_search_filter(args)
+    # Cache y estado de sync compartidos: un solo archivo para todas las rutas
+    cache = None if args.no_cache else MessageCache()
+    sync_state = SyncState()
+    clients = {}
+    for route in routes:
+        clients[route.name] = GmailClient(
+            fetch_mode=args.fetch_mode,
+            fetch_workers=args.fetch_workers,
+            parse_workers=args.parse_workers,
+            html_extractor=args.html_extractor,
+            cache=cache,
+            account=route.account,
+            search_filter=search_filter,
+        )
+        clients[route.name].sync_state = sync_state
+
+    # Un cliente de Notion por base; las rutas a la misma base lo comparten
+    notions = {route.name: None for route in routes}
+    if not args.dry_run:
+        by_database = {}
+        for route in routes:
+            if route.database_id not in by_database:
+                notion = NotionClient(database_id=route.database_id)
+                by_database[route.database_id] = notion if notion.is_configured() else None
+            notions[route.name] = by_database[route.database_id]
+
+    print("🔐 Conectando a Gmail...")
+    try:
+        with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+            list(executor.map(lambda client: client.authenticate(), clients.values()))
+    except (ValueError, Exception) as e:
+        print(f"\nError: {e}")
+        for client in clients.values():
+            client.close()
+        sys.exit(1)
+
+    journal = RunJournal()
+    skip_ids, resumed = set(), []
+    if args.resume:
+        skip_ids, resumed = replay_journal(journal)
+
+    def search(route):
+        known_ids = set(skip_ids)
+        notion = notions[route.name]
+        if notion and not args.reprocess:
+            known_ids |= notion.known_gmail_ids()
+        try:
+            return clients[route.name].find_messages(
+                route.label,
+                args.days,
+                incremental=args.incremental,
+                max_results=args.max,
+                exclude_ids=known_ids or None,
+            )
+        except ValueError as e:
+            print(f"❌ {route.name}: {e}")
+            return None
+
+    print(f"📥 Buscando newsletters en {len(routes)} rutas...")
+    with metrics.timer("stage.search"), ThreadPoolExecutor(max_workers=len(routes)) as executor:
+        found = dict(zip([route.name for route in routes], executor.map(search, routes)))
+
+    if all(uids is None for uids in found.values()):
+        print("\nUsa --list-labels para ver los labels disponibles")
+        sys.exit(1)
+    for route in routes:
+        if found[route.name]:
+            print(f"   {route.name}: {len(found[route.name])} newsletters")
+    total = sum(len(uids) for uids in found.values() if uids)
+
+    if not total and not resumed:
+        print(f"\nNo se encontraron newsletters nuevos en los últimos {args.days} días")
+        for client in clients.values():
+            client.commit_sync_state()
+            client.close()
+        journal.finish()
+        return
+
+    summarizer = NewsletterSummarizer(
+        cache=None if args.no_cache else LLMCache(),
+        concurrency=args.llm_concurrency,
+        backend=args.llm_backend,
+    )
+    journal.open(resume=args.resume)
+    sink = make_route_sink(journal, notions, routes[0].name)
+
+    def tagged(route, uids):
+        for newsletter in clients[route.name].iter_newsletters(uids):
+            newsletter["ruta"] = route.name
+            yield newsletter
+
+    # Los casi duplicados se agrupan dentro de cada ruta: cada base recibe los suyos
+    near_dups = {}
+    sources = {}
+    for route in routes:
+        if not found[route.name]:
+            continue
+        stream = journal.iter_fetched(tagged(route, found[route.name]))
+        if not args.no_near_dup:
+            near_dups[route.name] = NearDuplicateFilter()
+            stream = near_dups[route.name].iter_unique(stream)
+        sources[route.name] = stream
+
+    newsletters = merge_fair(sources)
+    compactor = None if args.no_compact else PromptCompactor()
+    if compactor:
+        newsletters = compactor.iter_compact(newsletters)
+
+    print(f"🤖 Descargando y clasificando con {summarizer.backend.label}...")
+    try:
+        resumed_stats = sink(resumed) if resumed else {}
+        processed, stats = run_pipeline(newsletters, summarizer, total=total, sink=sink)
+        for name, near_dup in near_dups.items():
+            record_collapsed(near_dup, notions[name], journal)
+    finally:
+        for client in clients.values():
+            client.close()
+        summarizer.close()
+        journal.close()
+        if compactor:
+            compactor.save()
+        if args.metrics:
+            report_path, prom_path = metrics.write(args.metrics)
+            print(f"📊 Métricas: {report_path} y {prom_path}")
+    processed = resumed + processed
+    for key in ("success", "failed", "skipped"):
+        stats[key] += resumed_stats.get(key, 0)
+    stats["errors"].extend(resumed_stats.get("errors", []))
+
+    print(f"\n✅ Procesados {len(processed)} newsletters")
+    for route in routes:
+        count = sum(1 for nl in processed if nl.get("ruta") == route.name)
+        print(f"   {route.name} → {route.database_id or 'sin base'}: {count}")
+    collapsed = sum(near_dup.collapsed for near_dup in near_dups.values())
+    if collapsed:
+        print(f"🔗 {collapsed} casi duplicados agrupados (ver 'otras_fuentes')")
+    print()
+
+    output_file = args.output or f"digest_{datetime.now().strftime('%Y-%m-%d')}.json"
+    Path(output_file).write_text(json.dumps({"newsletters": processed}, indent=2, ensure_ascii=False))
+    print(f"📄 JSON guardado: {output_file}")
+
+    if args.dry_run or not any(notions.values()):
+        if not args.dry_run:
+            print("\n⚠️  Notion no configurado")
+        if stats['failed']:
+            print(f"\n⚠️  {stats['failed']} newsletters sin clasificar")
+        else:
+            journal.finish()
+        return
+
+    # Rutas sin base configurada no avanzan su watermark: sus mensajes no
+    # llegaron a Notion. Con fallos no avanza ninguno (se vuelven a buscar)
+    for route in routes:
+        if notions[route.name] is not None and not stats['failed']:
+            clients[route.name].commit_sync_state()
+
+    print(f"\n✨ Completado!")
+    print(f"   ✅ Enviados: {stats['success']}")
+    print(f"   ⏭️  Saltados: {stats.get('skipped', 0)} (duplicados)")
+    print(f"   ❌ Fallidos: {stats['failed']}")
+
+    if stats['errors']:
+        print("\n   Errores:")
+        for err in stats['errors'][:3]:
+            print(f"   - {err[:100]}")
+
+    if stats['failed']:
+        print("\n   La próxima ejecución retoma los fallidos (lo ya clasificado no vuelve al LLM)")
+    else:
+        journal.finish()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Genera un digest de newsletters y lo envía a Notion'
@@ -34,6 +509,13 @@ def main():
         default=os.getenv('GMAIL_LABEL', 'Newsletters'),
         help='Label de Gmail donde están los newsletters'
     )
+    parser.add_argument(
+        '--route', '-r',
+        action='append',
+        metavar='LABEL[@CUENTA][=DATABASE_ID]',
+        help='Procesar varios labels/cuentas en una ejecución, cada uno a su base de Notion '
+             '(repetible; default: DIGEST_ROUTES separadas por ";")'
+    )
     parser.add_argument(
         '--days', '-d',
         type=int,
@@ -56,6 +538,131 @@ def main():
         action='store_true',
         help='Solo generar JSON, no enviar a Notion'
     )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Solo procesar mensajes nuevos desde la última ejecución (sync por UID)'
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Quedarse escuchando el label (IMAP IDLE) y procesar los newsletters al llegar'
+    )
+    parser.add_argument(
+        '--watch-max-batch',
+        type=int,
+        default=None,
+        help='Con --watch: procesar al juntar N mensajes (default: WATCH_MAX_BATCH o 10)'
+    )
+    parser.add_argument(
+        '--watch-max-latency',
+        type=float,
+        default=None,
+        help='Con --watch: segundos máximos que espera un mensaje (default: WATCH_MAX_LATENCY o 60)'
+    )
+    parser.add_argument(
+        '--backfill',
+        action='store_true',
+        help='Procesar todo el período (--days, sin --max) por ventanas y con memoria acotada'
+    )
+    parser.add_argument(
+        '--backfill-window',
+        type=int,
+        default=None,
+        help='Con --backfill: días por búsqueda IMAP (default: BACKFILL_WINDOW_DAYS o 30)'
+    )
+    parser.add_argument(
+        '--allow-from',
+        action='append',
+        metavar='REMITENTE',
+        help='Solo newsletters de estos remitentes (dirección o dominio; repetible o '
+             'separados por coma; default: SENDER_ALLOW)'
+    )
+    parser.add_argument(
+        '--deny-from',
+        action='append',
+        metavar='REMITENTE',
+        help='Omitir estos remitentes antes de descargar (default: SENDER_DENY)'
+    )
+    parser.add_argument(
+        '--gmail-query',
+        default=None,
+        help='Búsqueda de Gmail adicional, p.ej. "-from:noreply@foo.com has:nouserlabels" '
+             '(X-GM-RAW; default: GMAIL_QUERY)'
+    )
+    parser.add_argument(
+        '--fetch-mode',
+        choices=['full', 'partial'],
+        default=os.getenv('FETCH_MODE', 'full'),
+        help='full: descarga RFC822 completo; partial: solo la parte de texto (default: full)'
+    )
+    parser.add_argument(
+        '--fetch-workers',
+        type=int,
+        default=int(os.getenv('FETCH_WORKERS', '1')),
+        help='Conexiones IMAP en paralelo para descargar mensajes (default: 1)'
+    )
+    parser.add_argument(
+        '--parse-workers',
+        type=int,
+        default=int(os.getenv('PARSE_WORKERS', '0')),
+        help='Procesos para decode MIME y HTML → texto (default: 0, en el mismo proceso)'
+    )
+    parser.add_argument(
+        '--html-extractor',
+        choices=['html2text', 'lxml'],
+        default=os.getenv('HTML_EXTRACTOR', 'html2text'),
+        help='Conversor HTML → texto (lxml es más rápido, requiere pip install lxml)'
+    )
+    parser.add_argument(
+        '--llm-backend',
+        choices=['groq', 'openai', 'fake'],
+        default=os.getenv('LLM_BACKEND', 'groq'),
+        help='Backend del LLM: groq, openai (servidor local compatible) o fake (sin red)'
+    )
+    parser.add_argument(
+        '--llm-concurrency',
+        type=int,
+        default=int(os.getenv('LLM_CONCURRENCY', '1')),
+        help='Requests a Groq en paralelo (default: 1; subir en tiers pagos)'
+    )
+    parser.add_argument(
+        '--no-compact',
+        action='store_true',
+        help='Enviar el prefijo crudo del cuerpo al LLM, sin compactar'
+    )
+    parser.add_argument(
+        '--no-near-dup',
+        action='store_true',
+        help='Clasificar por separado los newsletters casi duplicados'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Retomar la última ejecución cortada desde el journal (.digest_journal.jsonl); '
+             'es automático si el journal quedó de una ejecución sin terminar'
+    )
+    parser.add_argument(
+        '--no-resume',
+        action='store_true',
+        help='Descartar el journal de una ejecución sin terminar y empezar de cero'
+    )
+    parser.add_argument(
+        '--reprocess',
+        action='store_true',
+        help='No omitir los mensajes que ya están en Notion (se vuelven a clasificar)'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='No usar los caches locales (.message_cache.db y .llm_cache.db)'
+    )
+    parser.add_argument(
+        '--metrics',
+        metavar='DIR',
+        default=os.getenv('METRICS_DIR'),
+        help='Guardar en DIR el reporte JSON de la ejecución y un textfile de Prometheus'
+    )
     parser.add_argument(
         '--list-labels',
         action='store_true',
@@ -68,6 +675,19 @@ def main():
     )
 
     args = parser.parse_args()
+    if args.watch and args.resume:
+        parser.error("--watch retoma solo lo pendiente; no se combina con --resume")
+    if args.resume and args.no_resume:
+        parser.error("--resume y --no-resume no se combinan")
+    if args.watch and args.backfill:
+        parser.error("--watch y --backfill no se combinan")
+    from routes import load_routes
+    try:
+        routes = load_routes(args.route)
+    except ValueError as e:
+        parser.error(str(e))
+    if routes and (args.watch or args.backfill):
+        parser.error("--route todavía no se combina con --watch ni --backfill")
 
     # Mostrar instrucciones de Notion
     if args.setup_notion:
@@ -87,65 +707,174 @@ def main():
         return
 
     from gmail_client import GmailClient, list_labels
+    from message_cache import MessageCache
+    from llm_cache import LLMCache
     from summarizer import NewsletterSummarizer
     from notion_client import NotionClient
+    from pipeline import run_pipeline
+    from compaction import PromptCompactor
+    from neardup import NearDuplicateFilter
+    from journal import RunJournal
+    from metrics import metrics
 
     # Listar labels
     if args.list_labels:
         list_labels()
         return
 
+    # Un journal que quedó es de una ejecución que no terminó: se retoma en
+    # lugar de truncarlo (p.ej. la próxima corrida de cron después de un corte)
+    if not args.resume and not args.no_resume and not args.watch and RunJournal().unfinished():
+        print("♻️  La ejecución anterior no terminó: se retoma desde el journal "
+              "(--no-resume para empezar de cero)")
+        args.resume = True
+
     print(f"\n📬 Newsletter Digest Generator")
     print(f"=" * 40)
-    print(f"Label: {args.label}")
+    if routes:
+        print(f"Rutas: {', '.join(route.name for route in routes)}")
+    else:
+        print(f"Label: {args.label}")
     print(f"Período: últimos {args.days} días")
-    print(f"Máximo: {args.max} newsletters")
+    search_filter = make_search_filter(args)
+    if search_filter:
+        print(f"Filtro: {search_filter.describe()}")
+    print(f"Máximo: {'sin límite (backfill)' if args.backfill else f'{args.max} newsletters'}")
     print()
 
+    if routes:
+        run_routes(args, routes)
+        return
+
     # Conectar a Gmail
     print("🔐 Conectando a Gmail...")
     try:
-        gmail = GmailClient().authenticate()
+        gmail = GmailClient(
+            fetch_mode=args.fetch_mode,
+            fetch_workers=args.fetch_workers,
+            parse_workers=args.parse_workers,
+            html_extractor=args.html_extractor,
+            cache=None if args.no_cache else MessageCache(),
+            search_filter=search_filter,
+        ).authenticate()
     except (ValueError, Exception) as e:
         print(f"\nError: {e}")
         sys.exit(1)
 
-    # Obtener newsletters
+    # Verificar configuración de Notion antes de empezar, para enviar
+    # cada batch apenas sale de Groq
+    notion = None
+    if not args.dry_run:
+        notion = NotionClient()
+        if not notion.is_configured():
+            notion = None
+
+    if args.watch:
+        print("Modo watch: procesando al llegar\n")
+        run_watch(args, gmail, notion)
+        return
+
+    # Mensajes que ya tienen página en Notion: se descartan antes de
+    # descargarlos y de gastar tokens en clasificarlos
+    known_ids = set()
+    if notion and not args.reprocess:
+        known_ids |= notion.known_gmail_ids()
+
+    # Retomar una ejecución cortada: lo ya enviado no se vuelve a procesar y
+    # lo ya clasificado se envía sin pasar otra vez por el LLM
+    journal = RunJournal()
+    resumed = []
+    if args.resume:
+        done_ids, resumed = replay_journal(journal)
+        known_ids |= done_ids
+
+    if args.backfill:
+        run_backfill(args, gmail, notion, known_ids, resumed)
+        return
+
+    # Buscar newsletters (solo UIDs; los cuerpos se descargan en el pipeline)
     print(f"📥 Buscando newsletters en '{args.label}'...")
     try:
-        newsletters = gmail.get_newsletters(args.label, args.days)
+        with metrics.timer("stage.search"):
+            uids = gmail.find_messages(
+                args.label,
+                args.days,
+                incremental=args.incremental,
+                max_results=args.max,
+                exclude_ids=known_ids or None,
+            )
     except ValueError as e:
         print(f"\nError: {e}")
         print("\nUsa --list-labels para ver los labels disponibles")
         sys.exit(1)
 
-    if not newsletters:
-        print(f"\nNo se encontraron newsletters en los últimos {args.days} días")
+    if not uids and not resumed:
+        print(f"\nNo se encontraron newsletters nuevos en los últimos {args.days} días")
+        # Los que se omitieron ya están en Notion: el watermark puede avanzar
+        gmail.commit_sync_state()
+        journal.finish()
         return
 
-    print(f"✅ Encontrados {len(newsletters)} newsletters\n")
+    print(f"✅ Encontrados {len(uids)} newsletters\n")
 
-    # Generar resúmenes con Groq
-    print("🤖 Clasificando con Groq...")
-    summarizer = NewsletterSummarizer()
-    result = summarizer.generate_digest(newsletters, max_newsletters=args.max)
+    summarizer = NewsletterSummarizer(
+        cache=None if args.no_cache else LLMCache(),
+        concurrency=args.llm_concurrency,
+        backend=args.llm_backend,
+    )
 
-    if "error" in result:
-        print(f"\n❌ Error procesando: {result['error']}")
-        if "raw" in result:
-            print(f"Respuesta raw guardada en digest_error.txt")
-            Path("digest_error.txt").write_text(result["raw"])
-        return
+    journal.open(resume=args.resume)
+
+    sink = make_sink(journal, notion)
 
-    processed = result.get("newsletters", [])
-    print(f"✅ Procesados {len(processed)} newsletters\n")
+    newsletters = journal.iter_fetched(gmail.iter_newsletters(uids))
+
+    # Colapsar casi duplicados (mismo anuncio de varios remitentes) en uno solo
+    near_dups = None if args.no_near_dup else NearDuplicateFilter()
+    if near_dups:
+        newsletters = near_dups.iter_unique(newsletters)
+
+    # Compactar cada cuerpo antes del LLM (links, plantilla, oraciones clave)
+    compactor = None if args.no_compact else PromptCompactor()
+    if compactor:
+        newsletters = compactor.iter_compact(newsletters)
+
+    # Descargar, clasificar y enviar en paralelo
+    print(f"🤖 Descargando y clasificando con {summarizer.backend.label}...")
+    try:
+        resumed_stats = sink(resumed) if resumed else {}
+        processed, stats = run_pipeline(
+            newsletters,
+            summarizer,
+            total=len(uids),
+            sink=sink,
+        )
+        record_collapsed(near_dups, notion, journal)
+    finally:
+        gmail.close()
+        summarizer.close()
+        journal.close()
+        if compactor:
+            compactor.save()
+        # También si la ejecución falló: es cuando más interesa saber dónde se fue el tiempo
+        if args.metrics:
+            report_path, prom_path = metrics.write(args.metrics)
+            print(f"📊 Métricas: {report_path} y {prom_path}")
+    processed = resumed + processed
+    for key in ("success", "failed", "skipped"):
+        stats[key] += resumed_stats.get(key, 0)
+    stats["errors"].extend(resumed_stats.get("errors", []))
+    result = {"newsletters": processed}
+    print(f"\n✅ Procesados {len(processed)} newsletters")
+    if near_dups and near_dups.collapsed:
+        print(f"🔗 {near_dups.collapsed} casi duplicados agrupados (ver 'otras_fuentes')")
+    print()
 
     # Guardar JSON si se especifica
     output_file = args.output or f"digest_{datetime.now().strftime('%Y-%m-%d')}.json"
     Path(output_file).write_text(json.dumps(result, indent=2, ensure_ascii=False))
     print(f"📄 JSON guardado: {output_file}")
 
-    # Enviar a Notion
     if args.dry_run:
         print("\n🔍 Dry run - No se envió a Notion")
         print("\nPreview:")
@@ -153,18 +882,25 @@ def main():
             print(f"  - [{nl.get('categoria')}] {nl.get('titulo')}")
         if len(processed) > 3:
             print(f"  ... y {len(processed) - 3} más")
+        if stats['failed']:
+            print(f"\n⚠️  {stats['failed']} newsletters sin clasificar")
+        else:
+            journal.finish()
         return
 
-    # Verificar configuración de Notion
-    notion = NotionClient()
-    if not notion.is_configured():
+    if notion is None:
         print("\n⚠️  Notion no configurado")
         print("Ejecuta: python digest.py --setup-notion")
         print("O usa --dry-run para solo generar el JSON")
+        if not stats['failed']:
+            journal.finish()
         return
 
-    print("\n📤 Enviando a Notion...")
-    stats = notion.add_newsletters(processed)
+    # Marcar como vistos los mensajes (modo incremental) solo si todos llegaron
+    # a Notion: con fallos la próxima ejecución vuelve a buscarlos, y los ya
+    # enviados se omiten por el índice de Notion
+    if not stats['failed']:
+        gmail.commit_sync_state()
 
     print(f"\n✨ Completado!")
     print(f"   ✅ Enviados: {stats['success']}")
@@ -176,6 +912,11 @@ def main():
         for err in stats['errors'][:3]:
             print(f"   - {err[:100]}")
 
+    # Con fallos el journal queda: la próxima ejecución re-envía solo lo que no llegó
+    if stats['failed']:
+        print("\n   La próxima ejecución retoma los fallidos (lo ya clasificado no vuelve al LLM)")
+    else:
+        journal.finish()
 
 if __name__ == '__main__':
     main()
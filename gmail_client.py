@@ -6,188 +6,746 @@ Usa App Password en lugar de OAuth2 — no expira.
 import email
 import email.message
 import imaplib
+import multiprocessing
 import os
-from datetime import datetime, timedelta
-from email.header import decode_header
-from email.utils import parsedate_to_datetime
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from typing import Container, Iterator
 
 from dotenv import load_dotenv
-import html2text
+
+from html_extract import EXTRACTORS
+from imap_pool import IMAPConnectionPool
+from imap_utils import find_text_part, message_set, parse_fetch_response
+from message_cache import MessageCache
+from message_parser import extract_body, parse_job
+from metrics import metrics
+from search_filter import SearchFilter
+from sync_state import SyncState
 
 load_dotenv()
 
-IMAP_SERVER = "imap.gmail.com"
-IMAP_PORT = 993
+# Configurables para apuntar a otro servidor (p.ej. el IMAP local de bench/)
+IMAP_SERVER = os.getenv("IMAP_HOST", "imap.gmail.com")
+IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+IMAP_SSL = os.getenv("IMAP_SSL", "1") != "0"
+
+# Mensajes por comando FETCH (un round trip por bloque en lugar de uno por mensaje)
+FETCH_CHUNK_SIZE = 50
+
+# "full": descarga el RFC822 completo. "partial": BODYSTRUCTURE + headers y
+# luego solo la parte de texto elegida (sin adjuntos ni imágenes inline)
+FETCH_MODES = ("full", "partial")
+HEADER_FIELDS = "BODY.PEEK[HEADER.FIELDS (SUBJECT FROM DATE)]"
+
+# UIDs por FETCH en la pasada barata de INTERNALDATE (sin cuerpos)
+DATE_CHUNK_SIZE = 500
+
+# Bloques descargados por adelantado por conexión (con fetch_workers > 1)
+FETCH_AHEAD_PER_WORKER = 2
+
+# Días por búsqueda en modo backfill
+BACKFILL_WINDOW_DAYS = int(os.getenv("BACKFILL_WINDOW_DAYS", "30"))
 
 
 class GmailClient:
-    def __init__(self):
+    def __init__(self, fetch_mode: str | None = None, fetch_workers: int | None = None,
+                 parse_workers: int | None = None, html_extractor: str | None = None,
+                 cache: MessageCache | None = None, account: str | None = None,
+                 search_filter: SearchFilter | None = None):
+        # Cuenta adicional (credenciales en GMAIL_EMAIL_<CUENTA>); None = la principal
+        self.account = account
+        # Remitentes permitidos/bloqueados y consulta de Gmail (default: SENDER_*, GMAIL_QUERY)
+        self.search_filter = search_filter if search_filter is not None else SearchFilter()
+        self._query_warned = False
+        self.fetch_mode = fetch_mode or os.getenv("FETCH_MODE", "full")
+        if self.fetch_mode not in FETCH_MODES:
+            raise ValueError(f"FETCH_MODE inválido: {self.fetch_mode} (usa {', '.join(FETCH_MODES)})")
+        # Conexiones IMAP en paralelo para descargar (1 = solo la conexión principal)
+        self.fetch_workers = max(1, fetch_workers or int(os.getenv("FETCH_WORKERS", "1")))
+        # Procesos para decode MIME + HTML → texto (0 = en el mismo thread de descarga)
+        if parse_workers is None:
+            parse_workers = int(os.getenv("PARSE_WORKERS", "0"))
+        self.parse_workers = max(0, parse_workers)
+        self.html_extractor = html_extractor or os.getenv("HTML_EXTRACTOR", "html2text")
+        if self.html_extractor not in EXTRACTORS:
+            raise ValueError(
+                f"HTML_EXTRACTOR inválido: {self.html_extractor} (usa {', '.join(EXTRACTORS)})"
+            )
+        # Cache local de mensajes parseados (None = siempre descargar)
+        self.cache = cache
         self.mail = None
-        self.h2t = html2text.HTML2Text()
-        self.h2t.ignore_links = False
-        self.h2t.ignore_images = True
-        self.h2t.body_width = 0
+        self.sync_state = None
+        self._label = None
+        # Mensajes en el label según el último SELECT/EXISTS (modo --watch)
+        self.exists = 0
+        self._idling = False
+        self._pending_sync = None
+        # UIDs que no se pudieron descargar desde la última búsqueda
+        # incremental: el watermark no los pasa (ver commit_sync_state)
+        self._failed_uids: set[int] = set()
+        self._parse_pool = None
+        self._parse_pool_lock = threading.Lock()
 
     def authenticate(self):
         """Conectar a Gmail vía IMAP con App Password."""
-        email_addr = os.getenv("GMAIL_EMAIL")
-        app_password = os.getenv("GMAIL_APP_PASSWORD")
+        self.mail = self._connect()
+        return self
+
+    def _connect(self) -> imaplib.IMAP4:
+        """Abrir una conexión IMAP nueva y autenticarla."""
+        suffix = account_env_suffix(self.account)
+        email_addr = os.getenv(f"GMAIL_EMAIL{suffix}")
+        app_password = os.getenv(f"GMAIL_APP_PASSWORD{suffix}")
 
         if not email_addr or not app_password:
             raise ValueError(
-                "GMAIL_EMAIL y GMAIL_APP_PASSWORD deben estar configurados.\n"
+                f"GMAIL_EMAIL{suffix} y GMAIL_APP_PASSWORD{suffix} deben estar configurados.\n"
                 "Genera un App Password en: https://myaccount.google.com/apppasswords"
             )
 
-        self.mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
-        self.mail.login(email_addr, app_password)
-        return self
+        if IMAP_SSL:
+            mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
+        else:
+            mail = imaplib.IMAP4(IMAP_SERVER, IMAP_PORT)
+        mail.login(email_addr, app_password)
+        return mail
 
-    def get_newsletters(self, label_name: str, days_back: int = 7) -> list[dict]:
+    def get_newsletters(self, label_name: str, days_back: int = 7,
+                        incremental: bool = False,
+                        max_results: int | None = None) -> list[dict]:
         """
         Obtener newsletters de un label específico.
 
         Args:
             label_name: Nombre del label en Gmail
             days_back: Cuántos días hacia atrás buscar
+            incremental: Solo mensajes con UID mayor al último procesado
+                (ver commit_sync_state). Si cambió el UIDVALIDITY del label
+                se re-escanea la ventana completa.
+            max_results: Si se indica, solo se descargan los cuerpos de los
+                max_results mensajes más recientes (por INTERNALDATE). Con
+                incremental, los max_results más antiguos sin procesar (por
+                UID), así el watermark no saltea los que quedan afuera
 
         Returns:
             Lista de diccionarios con subject, from, date, body
         """
-        # Seleccionar la carpeta/label
-        status, _ = self.mail.select(f'"{label_name}"', readonly=True)
+        uids = self.find_messages(label_name, days_back, incremental, max_results)
+        newsletters = list(self.iter_newsletters(uids))
+
+        # Ordenar por fecha (más reciente primero)
+        newsletters.sort(key=lambda x: x["date"], reverse=True)
+        return newsletters
+
+    def find_messages(self, label_name: str, days_back: int = 7,
+                      incremental: bool = False,
+                      max_results: int | None = None,
+                      exclude_ids: Container[str] | None = None) -> list[bytes]:
+        """
+        Buscar los UIDs a procesar sin descargar cuerpos.
+
+        Mismos argumentos que get_newsletters, más `exclude_ids`: IDs de Gmail
+        (hex, como en el link) ya procesados, que se descartan antes de
+        aplicar max_results. Retorna los UIDs del más reciente al más
+        antiguo, listos para iter_newsletters.
+        """
+        uids = self._search_uids(label_name, days_back, incremental)
+        if uids and exclude_ids:
+            uids = self._drop_known(uids, exclude_ids)
+        if not uids:
+            return []
+
+        if incremental and max_results is not None and len(uids) > max_results:
+            # Incremental: los más antiguos por UID, y el watermark solo hasta
+            # ahí; lo que sobra queda para la próxima ejecución en lugar de
+            # saltearse para siempre
+            uids = sorted(uids, key=int)[:max_results]
+            label_key, uidvalidity, _ = self._pending_sync
+            self._pending_sync = (label_key, uidvalidity, int(uids[-1]))
+            print(f"⏳ Quedan mensajes nuevos más allá de --max {max_results} para la próxima ejecución")
+        else:
+            uids = self._newest_uids(uids, max_results)
+        return sorted(uids, key=int, reverse=True)
+
+    def iter_backfill(self, label_name: str, days_back: int,
+                      window_days: int | None = None,
+                      exclude_ids: Container[str] | None = None) -> Iterator[list[bytes]]:
+        """
+        Buscar un backlog largo por ventanas de días, de la más antigua a la más nueva.
+
+        Produce los UIDs de cada ventana (SINCE/BEFORE) a medida que se
+        consumen, así un backfill de meses nunca tiene todo el label en
+        memoria. No toca el watermark de --incremental.
+        """
+        window = timedelta(days=max(1, window_days or BACKFILL_WINDOW_DAYS))
+        self._select_label(label_name)
+        end = datetime.now().date() + timedelta(days=1)
+        start = end - timedelta(days=days_back + 1)
+
+        while start < end:
+            stop = min(start + window, end)
+            criteria = f"(SINCE {start.strftime('%d-%b-%Y')} BEFORE {stop.strftime('%d-%b-%Y')})"
+            uids = self._filter_senders(self._uid_search(criteria))
+            if uids and exclude_ids:
+                uids = self._drop_known(uids, exclude_ids)
+            print(f"🗓️  {start} → {stop - timedelta(days=1)}: {len(uids)} mensajes")
+            if uids:
+                yield sorted(uids, key=int)
+            start = stop
+
+    def iter_newsletters(self, uids: list[bytes]) -> Iterator[dict]:
+        """
+        Descargar y parsear los mensajes, produciéndolos a medida que llegan.
+
+        Cada bloque de FETCH se entrega apenas se parsea, para que las etapas
+        siguientes (Groq, Notion) empiecen sin esperar al resto del label.
+        """
+        for newsletters in self._iter_fetch(uids):
+            yield from newsletters
+
+    def _select_label(self, label_name: str) -> int:
+        """Seleccionar el label en modo lectura y retornar su UIDVALIDITY."""
+        status, data = self.mail.select(f'"{label_name}"', readonly=True)
         if status != "OK":
             raise ValueError(f"Label '{label_name}' no encontrado en Gmail")
+        self._label = label_name
+        if data and data[0] and data[0].isdigit():
+            self.exists = int(data[0])
+
+        _, validity = self.mail.response("UIDVALIDITY")
+        return int(validity[0]) if validity and validity[0] else 0
+
+    def _search_uids(self, label_name: str, days_back: int,
+                     incremental: bool = False) -> list[bytes]:
+        """Buscar UIDs en la ventana de días (o desde el watermark si es incremental)."""
+        uidvalidity = self._select_label(label_name)
 
-        # Buscar mensajes desde la fecha límite
         since_date = (datetime.now() - timedelta(days=days_back)).strftime("%d-%b-%Y")
-        status, data = self.mail.search(None, f'(SINCE {since_date})')
-        if status != "OK" or not data[0]:
-            return []
+        criteria = f"(SINCE {since_date})"
+        last_uid = 0
+
+        if incremental:
+            if self.sync_state is None:
+                self.sync_state = SyncState()
+            saved = self.sync_state.get(self._sync_key(label_name))
+            if saved and saved[0] == uidvalidity:
+                last_uid = saved[1]
+                criteria = f"(UID {last_uid + 1}:* SINCE {since_date})"
+            elif saved:
+                print(f"⚠️  UIDVALIDITY de '{label_name}' cambió, re-escaneando la ventana completa")
+
+        # "n:*" siempre incluye el último mensaje aunque su UID sea < n
+        uids = [uid for uid in self._uid_search(criteria) if int(uid) > last_uid]
+
+        if incremental:
+            highest = max((int(uid) for uid in uids), default=last_uid)
+            self._pending_sync = (self._sync_key(label_name), uidvalidity, highest)
+            self._failed_uids = set()
+
+        # Después del watermark: los remitentes descartados no se vuelven a revisar
+        return self._filter_senders(uids)
+
+    def _is_gmail(self) -> bool:
+        """¿El servidor tiene las extensiones de Gmail (X-GM-RAW, X-GM-MSGID)?"""
+        return "X-GM-EXT-1" in self.mail.capabilities
+
+    def _uid_search(self, criteria: str) -> list[bytes]:
+        """
+        UID SEARCH con el filtro de remitentes y la consulta de Gmail.
 
-        msg_ids = data[0].split()
-        newsletters = []
+        En Gmail el filtro va como X-GM-RAW en el mismo comando: los mensajes
+        descartados nunca llegan a la lista de UIDs. En otros servidores se
+        busca solo con `criteria` (ver _filter_senders).
+        """
+        charset = None
+        raw = self.search_filter.gmail_raw()
+        if raw and self._is_gmail():
+            if raw.isascii():
+                criteria = f"{criteria} X-GM-RAW {_quote(raw)}"
+            else:
+                # imaplib manda el literal al final del comando
+                self.mail.literal = raw.encode()
+                charset = "CHARSET UTF-8"
+                criteria = f"{criteria} X-GM-RAW"
+        elif self.search_filter.query and not self._query_warned:
+            print(f"⚠️  El servidor no soporta X-GM-RAW, se ignora la consulta '{self.search_filter.query}'")
+            self._query_warned = True
+
+        with metrics.timer("imap.search"):
+            status, data = self.mail.uid("SEARCH", charset, criteria)
+        return data[0].split() if status == "OK" and data[0] else []
+
+    def _filter_senders(self, uids: list[bytes]) -> list[bytes]:
+        """
+        Aplicar SENDER_ALLOW/SENDER_DENY del lado del cliente (servidores sin X-GM-RAW).
 
-        for msg_id in msg_ids:
-            newsletter = self._parse_message(msg_id)
-            if newsletter:
-                newsletters.append(newsletter)
+        Pide solo el header From, así los descartados no cuestan la
+        descarga del cuerpo, el parseo ni tokens del LLM.
+        """
+        if not uids or not self.search_filter.has_senders or self._is_gmail():
+            return uids
+
+        senders = {}
+        for start in range(0, len(uids), DATE_CHUNK_SIZE):
+            chunk = uids[start:start + DATE_CHUNK_SIZE]
+            status, data = _uid_fetch(self.mail, message_set(chunk),
+                                      "(UID BODY.PEEK[HEADER.FIELDS (FROM)])")
+            if status != "OK":
+                continue
+            for seq, fields in parse_fetch_response(data).items():
+                header = next(
+                    (v for k, v in fields.items() if k.startswith("BODY[HEADER.FIELDS")), None
+                )
+                if fields.get("UID") and isinstance(header, bytes):
+                    senders[fields["UID"].encode()] = email.message_from_bytes(header).get("From")
+
+        # Sin header (FETCH fallido) el mensaje se conserva
+        remaining = [uid for uid in uids
+                     if uid not in senders or self.search_filter.sender_allowed(senders[uid])]
+        skipped = len(uids) - len(remaining)
+        if skipped:
+            metrics.inc("search.senders_filtered", skipped)
+            print(f"🚫 {skipped} mensajes de remitentes filtrados (se omiten antes de descargar)")
+        return remaining
+
+    def _sync_key(self, label_name: str) -> str:
+        """Clave del label en el estado de sync (los de otras cuentas llevan @cuenta)."""
+        return f"{label_name}@{self.account}" if self.account else label_name
+
+    def _gmail_ids(self, uids: list[bytes]) -> dict[bytes, str]:
+        """Pedir solo X-GM-MSGID de los UIDs y retornar {uid: ID de Gmail en hex}."""
+        gmail_ids = {}
+        for start in range(0, len(uids), DATE_CHUNK_SIZE):
+            chunk = uids[start:start + DATE_CHUNK_SIZE]
+            status, data = _uid_fetch(self.mail, message_set(chunk), "(UID X-GM-MSGID)")
+            if status != "OK":
+                continue
+            for seq, fields in parse_fetch_response(data).items():
+                uid = fields.get("UID")
+                x_gm_msgid = fields.get("X-GM-MSGID")
+                if uid and x_gm_msgid and x_gm_msgid.isdigit():
+                    gmail_ids[uid.encode()] = format(int(x_gm_msgid), "x")
+        return gmail_ids
+
+    def _drop_known(self, uids: list[bytes], known_ids: Container[str]) -> list[bytes]:
+        """Descartar los mensajes cuyo ID de Gmail ya fue procesado."""
+        gmail_ids = self._gmail_ids(uids)
+        remaining = [uid for uid in uids if gmail_ids.get(uid) not in known_ids]
+        skipped = len(uids) - len(remaining)
+        if skipped:
+            print(f"⏭️  {skipped} mensajes ya procesados (se omiten antes de descargar)")
+        return remaining
+
+    def _newest_uids(self, uids: list[bytes], limit: int | None) -> list[bytes]:
+        """
+        Quedarse con los `limit` UIDs más recientes según INTERNALDATE.
 
-        # Ordenar por fecha (más reciente primero)
-        newsletters.sort(key=lambda x: x["date"], reverse=True)
+        Solo pide INTERNALDATE (unos bytes por mensaje), así --max acota la
+        descarga de cuerpos y no solo el trabajo del LLM.
+        """
+        if limit is None or len(uids) <= limit:
+            return uids
+
+        dated = []
+        for start in range(0, len(uids), DATE_CHUNK_SIZE):
+            chunk = uids[start:start + DATE_CHUNK_SIZE]
+            status, data = _uid_fetch(self.mail, message_set(chunk), "(UID INTERNALDATE)")
+            if status != "OK":
+                continue
+            for seq, fields in parse_fetch_response(data).items():
+                uid = fields.get("UID")
+                if uid:
+                    dated.append((_parse_internaldate(fields.get("INTERNALDATE")), int(uid)))
+
+        if not dated:
+            # Sin fechas: los UIDs crecen con el orden de llegada
+            return sorted(uids, key=int)[-limit:]
+
+        dated.sort(reverse=True)
+        return [str(uid).encode() for _, uid in dated[:limit]]
+
+    def commit_sync_state(self):
+        """
+        Persistir el watermark de la última búsqueda incremental.
+
+        Se llama después de procesar los mensajes con éxito, para que una
+        ejecución fallida no marque como vistos mensajes que no llegaron a Notion.
+        Los mensajes que no se pudieron descargar quedan por encima del
+        watermark, así la próxima ejecución los vuelve a intentar.
+        """
+        if self._pending_sync is None:
+            return
+        key, uidvalidity, last_uid = self._pending_sync
+        if self._failed_uids:
+            last_uid = min(last_uid, min(self._failed_uids) - 1)
+            print(f"⚠️  {len(self._failed_uids)} mensajes no se pudieron descargar; "
+                  f"se reintentan en la próxima ejecución")
+        self.sync_state.update(key, uidvalidity, last_uid)
+        self._pending_sync = None
+        self._failed_uids = set()
+
+    def _fetch_messages(self, uids: list[bytes]) -> list[dict]:
+        """Descargar y parsear todos los mensajes (ver _iter_fetch)."""
+        newsletters = []
+        for chunk_newsletters in self._iter_fetch(uids):
+            newsletters.extend(chunk_newsletters)
         return newsletters
 
-    def _decode_header_value(self, value: str) -> str:
-        """Decodificar un header que puede tener encoding MIME."""
-        decoded_parts = decode_header(value)
-        result = []
-        for part, charset in decoded_parts:
-            if isinstance(part, bytes):
-                result.append(part.decode(charset or "utf-8", errors="replace"))
-            else:
-                result.append(part)
-        return "".join(result)
+    def _iter_fetch(self, uids: list[bytes]) -> Iterator[list[dict]]:
+        """
+        Descargar y parsear mensajes en bloques de FETCH_CHUNK_SIZE.
 
-    def _parse_message(self, msg_id: bytes) -> dict | None:
-        """Parsear un mensaje IMAP."""
+        Cada bloque se pide con un solo UID FETCH sobre un message-set
+        ("1:50" o lista con comas) y la respuesta se separa por mensaje.
+        Con fetch_workers > 1 los bloques se reparten entre un pool de
+        conexiones IMAP en paralelo y se entregan según van terminando.
+        """
+        chunks = [uids[i:i + FETCH_CHUNK_SIZE] for i in range(0, len(uids), FETCH_CHUNK_SIZE)]
+        workers = min(self.fetch_workers, len(chunks))
+
+        if workers <= 1:
+            for chunk in chunks:
+                try:
+                    yield self._fetch_chunk(chunk, self.mail)
+                except (imaplib.IMAP4.abort, OSError) as e:
+                    print(f"⚠️  Conexión IMAP caída ({e}), reconectando...")
+                    self.reconnect()
+                    yield self._fetch_chunk(chunk, self.mail)
+            return
+
+        with IMAPConnectionPool(self._connect, self._label, workers) as pool, \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            # Ventana acotada de bloques en vuelo: si las etapas siguientes van
+            # más lento, la descarga espera en lugar de acumular el label en memoria
+            pending = iter(chunks)
+            futures = {}
+
+            def submit_next():
+                chunk = next(pending, None)
+                if chunk is not None:
+                    futures[executor.submit(
+                        pool.run, lambda conn, chunk=chunk: self._fetch_chunk(chunk, conn)
+                    )] = chunk
+
+            for _ in range(workers * FETCH_AHEAD_PER_WORKER):
+                submit_next()
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    futures.pop(future)
+                    submit_next()
+                    # Igual que con una sola conexión: si el bloque falla aun
+                    # después de reconectar (pool.run), el error se propaga
+                    yield future.result()
+
+    def reconnect(self):
+        """Reabrir la conexión principal y volver a seleccionar el label."""
         try:
-            # Obtener el mensaje completo y el X-GM-MSGID para el link
-            status, data = self.mail.fetch(msg_id, "(RFC822 X-GM-MSGID)")
+            if self._idling:
+                self.mail.shutdown()
+            else:
+                self.mail.logout()
+        except Exception:
+            pass
+        self._idling = False
+        self.mail = self._connect()
+        if self._label:
+            self._select_label(self._label)
+
+    def _fetch_chunk(self, uids: list[bytes], mail: imaplib.IMAP4) -> list[dict]:
+        """Descargar un bloque con la conexión dada, según fetch_mode."""
+        chunk = uids
+        try:
+            cached = []
+            known_ids = set()
+            if self.cache is not None:
+                cached, uids, known_ids = self._split_cached(uids, mail)
+                if not uids:
+                    return cached
+
+            if self.fetch_mode == "partial":
+                fetched = self._fetch_chunk_partial(uids, mail)
+            else:
+                fetched = self._fetch_chunk_full(uids, mail)
+
+            if self.cache is not None:
+                # Solo se cachean los mensajes con X-GM-MSGID (IDs estables)
+                self.cache.put_many(
+                    [nl for nl in fetched if nl["id"] in known_ids], self.html_extractor
+                )
+            return cached + fetched
+        except imaplib.IMAP4.abort:
+            # Conexión caída: el pool se encarga de reconectar y reintentar
+            raise
+        except imaplib.IMAP4.error as e:
+            print(f"Error descargando mensajes {chunk[0]}-{chunk[-1]}: {e}")
+            self._fetch_failed(chunk)
+            return []
+
+    def _fetch_failed(self, uids: list[bytes]):
+        """Registrar UIDs que no se pudieron descargar (frenan el watermark)."""
+        self._failed_uids.update(int(uid) for uid in uids)
+        metrics.inc("messages.fetch_failed", len(uids))
+
+    def _split_cached(self, uids: list[bytes], mail: imaplib.IMAP4) -> tuple[list[dict], list[bytes], set]:
+        """
+        Separar los mensajes del bloque que ya están en cache.
+
+        Pide solo X-GM-MSGID (sin cuerpos) y busca esos IDs en el cache.
+
+        Returns:
+            (newsletters en cache, UIDs a descargar, IDs de Gmail del bloque)
+        """
+        status, data = _uid_fetch(mail, message_set(uids), "(UID X-GM-MSGID)")
+        if status != "OK":
+            return [], uids, set()
+
+        gmail_ids = {}
+        for seq, fields in parse_fetch_response(data).items():
+            x_gm_msgid = fields.get("X-GM-MSGID")
+            if fields.get("UID") and x_gm_msgid and x_gm_msgid.isdigit():
+                gmail_ids[fields["UID"]] = format(int(x_gm_msgid), "x")
+
+        hits = self.cache.get_many(list(gmail_ids.values()), self.html_extractor)
+        metrics.inc("message_cache.hits", len(hits))
+        missing = [uid for uid in uids if gmail_ids.get(uid.decode()) not in hits]
+        return list(hits.values()), missing, set(gmail_ids.values())
+
+    def _fetch_chunk_full(self, uids: list[bytes], mail: imaplib.IMAP4) -> list[dict]:
+        """Descargar un bloque de mensajes completos (RFC822)."""
+        status, data = _uid_fetch(mail, message_set(uids), "(UID RFC822 X-GM-MSGID)")
+        if status != "OK":
+            print(f"Error descargando mensajes {uids[0]}-{uids[-1]}: {status}")
+            self._fetch_failed(uids)
+            return []
+
+        jobs = []
+        for seq, fields in parse_fetch_response(data).items():
+            uid = fields.get("UID") or seq
+            jobs.append(("full", uid.encode(), fields, self.html_extractor))
+        return self._parse_jobs(jobs)
+
+    def _fetch_chunk_partial(self, uids: list[bytes], mail: imaplib.IMAP4) -> list[dict]:
+        """
+        Descargar un bloque en dos fases.
+
+        1. BODYSTRUCTURE, headers (Subject/From/Date) y X-GM-MSGID.
+        2. Solo la parte de texto elegida con BODY.PEEK[<sección>], agrupando
+           en un FETCH los mensajes que comparten sección.
+        """
+        status, data = _uid_fetch(
+            mail, message_set(uids), f"(UID X-GM-MSGID BODYSTRUCTURE {HEADER_FIELDS})"
+        )
+        if status != "OK":
+            print(f"Error descargando mensajes {uids[0]}-{uids[-1]}: {status}")
+            self._fetch_failed(uids)
+            return []
+
+        envelopes = {}
+        by_section: dict[str, list[str]] = {}
+        for seq, fields in parse_fetch_response(data).items():
+            uid = fields.get("UID") or seq
+            structure = fields.get("BODYSTRUCTURE")
+            part = find_text_part(structure) if isinstance(structure, list) else None
+            envelopes[uid] = (fields, part)
+            if part:
+                by_section.setdefault(part["section"], []).append(uid)
+
+        bodies = {}
+        for section, section_uids in by_section.items():
+            status, data = _uid_fetch(
+                mail, message_set(section_uids), f"(UID BODY.PEEK[{section}])"
+            )
             if status != "OK":
-                return None
-
-            # Extraer Gmail message ID del response
-            gmail_id = None
-            for part in data:
-                if isinstance(part, tuple) and b"X-GM-MSGID" in part[0]:
-                    # El formato es: b'1 (X-GM-MSGID 1234567890 RFC822 {size}'
-                    token = part[0].decode()
-                    for segment in token.split():
-                        if segment.isdigit() and len(segment) > 10:
-                            gmail_id = format(int(segment), "x")
-                            break
-
-            # Parsear el email
-            raw_email = None
-            for part in data:
-                if isinstance(part, tuple) and len(part) == 2 and isinstance(part[1], bytes):
-                    raw_email = part[1]
-                    break
-
-            if raw_email is None:
-                return None
-
-            msg = email.message_from_bytes(raw_email)
-
-            subject = self._decode_header_value(msg.get("Subject", "Sin asunto"))
-            sender = self._decode_header_value(msg.get("From", "Desconocido"))
-            date_str = msg.get("Date")
-
-            date = datetime.now()
-            if date_str:
-                try:
-                    date = parsedate_to_datetime(date_str)
-                except Exception:
-                    pass
-
-            body = self._extract_body(msg)
-
-            return {
-                "id": gmail_id or msg_id.decode(),
-                "subject": subject,
-                "from": sender,
-                "date": date,
-                "body": body[:15000],
-            }
-        except Exception as e:
-            print(f"Error parseando mensaje {msg_id}: {e}")
-            return None
+                # Sin cuerpo no se clasifican: quedan para la próxima ejecución
+                self._fetch_failed([uid.encode() for uid in section_uids])
+                for uid in section_uids:
+                    del envelopes[uid]
+                continue
+            for seq, fields in parse_fetch_response(data).items():
+                uid = fields.get("UID") or seq
+                bodies[uid] = fields.get(f"BODY[{section}]")
+
+        jobs = [
+            ("partial", uid.encode(), fields, part, bodies.get(uid), self.html_extractor)
+            for uid, (fields, part) in envelopes.items()
+        ]
+        return self._parse_jobs(jobs)
+
+    def _parse_jobs(self, jobs: list[tuple]) -> list[dict]:
+        """
+        Parsear mensajes descargados (ver message_parser.parse_job).
+
+        Con parse_workers > 0 el decode MIME y la conversión HTML → texto
+        corren en un pool de procesos, fuera del thread de descarga.
+        """
+        with metrics.timer("parse"):
+            if self.parse_workers > 0:
+                with self._parse_pool_lock:
+                    if self._parse_pool is None:
+                        # Acá ya corren los threads del pipeline y del event loop del
+                        # LLM: un fork podría heredar un lock tomado y colgar al hijo
+                        self._parse_pool = ProcessPoolExecutor(
+                            max_workers=self.parse_workers, mp_context=_parse_pool_context()
+                        )
+                results = self._parse_pool.map(parse_job, jobs)
+            else:
+                results = map(parse_job, jobs)
+            newsletters = [newsletter for newsletter in results if newsletter]
+        metrics.inc("messages.parsed", len(newsletters))
+        return newsletters
+
+    def _parse_message(self, uid: bytes) -> dict | None:
+        """Parsear un mensaje IMAP por UID."""
+        newsletters = self._fetch_messages([uid])
+        return newsletters[0] if newsletters else None
 
     def _extract_body(self, msg: email.message.Message) -> str:
         """Extraer el cuerpo del mensaje (preferir HTML, convertir a texto)."""
-        html_body = None
-        text_body = None
+        return extract_body(msg, self.html_extractor)
 
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition", ""))
+    def select(self, label_name: str):
+        """Seleccionar el label en modo lectura (para esperar novedades con idle)."""
+        self._select_label(label_name)
+        return self
 
-                # Saltar adjuntos
-                if "attachment" in content_disposition:
-                    continue
+    def _note_exists(self):
+        """Tomar los EXISTS que imaplib acumuló durante otros comandos."""
+        _, data = self.mail.response("EXISTS")
+        counts = [int(value) for value in data or () if value and value.isdigit()]
+        if counts:
+            self.exists = counts[-1]
 
-                try:
-                    payload = part.get_payload(decode=True)
-                    if payload is None:
-                        continue
-                    charset = part.get_content_charset() or "utf-8"
-                    text = payload.decode(charset, errors="replace")
-                except Exception:
-                    continue
-
-                if content_type == "text/html" and html_body is None:
-                    html_body = text
-                elif content_type == "text/plain" and text_body is None:
-                    text_body = text
-        else:
+    def idle(self, timeout: float) -> bool:
+        """
+        Esperar novedades del label seleccionado con IMAP IDLE (RFC 2177).
+
+        Bloquea hasta que el servidor avisa un cambio en el buzón o pasan
+        `timeout` segundos, y sale de IDLE (la conexión vuelve a aceptar
+        comandos). Si durante una descarga anterior ya llegaron mensajes
+        nuevos, retorna sin esperar.
+
+        Returns:
+            True si cambió la cantidad de mensajes (ver self.exists).
+        """
+        previous = self.exists
+        self._note_exists()
+        if self.exists != previous:
+            return True
+
+        mail = self.mail
+        tag = mail._new_tag()
+        mail.send(tag + b" IDLE\r\n")
+        line = mail.readline()
+        while line.startswith(b"* "):
+            self._idle_response(line)
+            line = mail.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"IDLE rechazado: {line.decode(errors='replace').strip()}")
+        self._idling = True
+
+        sock = mail.sock
+        default_timeout = sock.gettimeout()
+        sock.settimeout(max(timeout, 0.1))
+        try:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("el servidor cerró la conexión durante IDLE")
+            self._idle_response(line)
+        except TimeoutError:
+            # Tras un timeout el archivo del socket queda inutilizable
+            mail.file = sock.makefile("rb")
+        finally:
+            sock.settimeout(default_timeout)
+
+        mail.send(b"DONE\r\n")
+        while True:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("el servidor cerró la conexión durante IDLE")
+            if line.startswith(tag):
+                if not line[len(tag):].strip().upper().startswith(b"OK"):
+                    raise imaplib.IMAP4.error(f"IDLE falló: {line.decode(errors='replace').strip()}")
+                break
+            self._idle_response(line)
+        mail.tagged_commands.pop(tag, None)
+        self._idling = False
+
+        return self.exists != previous
+
+    def _idle_response(self, line: bytes):
+        """Procesar una respuesta no solicitada recibida en IDLE."""
+        parts = line.split()
+        if len(parts) >= 3 and parts[0] == b"*":
+            if parts[2].upper() == b"EXISTS" and parts[1].isdigit():
+                self.exists = int(parts[1])
+            elif parts[1].upper() == b"BYE":
+                # Gmail corta las sesiones IDLE a los ~29 minutos
+                raise imaplib.IMAP4.abort(line.decode(errors="replace").strip())
+
+    def close(self):
+        """Cerrar el pool de procesos de parseo, el cache y la conexión IMAP."""
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if self.mail is not None:
             try:
-                payload = msg.get_payload(decode=True)
-                if payload:
-                    charset = msg.get_content_charset() or "utf-8"
-                    text = payload.decode(charset, errors="replace")
-                    if msg.get_content_type() == "text/html":
-                        html_body = text
-                    else:
-                        text_body = text
+                if self._idling:
+                    # Cortado en medio de un IDLE (Ctrl+C): LOGOUT no tendría respuesta
+                    self.mail.shutdown()
+                else:
+                    self.mail.logout()
             except Exception:
                 pass
+            self.mail = None
+            self._idling = False
+
+
+def _parse_pool_context():
+    """Contexto para el pool de parseo: forkserver donde existe, si no spawn (nunca fork)."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
 
-        if html_body:
-            return self.h2t.handle(html_body).strip()
-        if text_body:
-            return text_body.strip()
+
+def account_env_suffix(account: str | None) -> str:
+    """Sufijo de las variables de entorno de una cuenta ("trabajo" → "_TRABAJO")."""
+    if not account:
         return ""
+    return "_" + re.sub(r"\W", "_", account).upper()
+
+
+def _quote(value: str) -> str:
+    """String IMAP entre comillas (para X-GM-RAW)."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _uid_fetch(mail: imaplib.IMAP4, msg_set: str, items: str):
+    """UID FETCH registrando el tiempo y los bytes recibidos."""
+    with metrics.timer("imap.fetch"):
+        status, data = mail.uid("FETCH", msg_set, items)
+    received = 0
+    for item in data or ():
+        for part in item if isinstance(item, tuple) else (item,):
+            if isinstance(part, bytes):
+                received += len(part)
+    metrics.inc("imap.bytes_fetched", received)
+    return status, data
+
+
+def _parse_internaldate(value) -> datetime:
+    """Parsear un INTERNALDATE ("17-Jul-1996 02:44:25 -0700") a datetime con zona."""
+    if isinstance(value, bytes):
+        value = value.decode(errors="replace")
+    try:
+        return datetime.strptime(value.strip(), "%d-%b-%Y %H:%M:%S %z")
+    except (AttributeError, ValueError):
+        return datetime.min.replace(tzinfo=timezone.utc)
 
 
 def list_labels():
@@ -0,0 +1,105 @@
+"""
+Conversores HTML → texto para el cuerpo de los newsletters.
+
+Todos exponen la misma interfaz (convert(html) -> str):
+- html2text: el conversor original, en Python puro (markdown con links)
+- lxml: extractor en C, bastante más rápido en HTML de marketing grande.
+  Requiere `pip install lxml`.
+"""
+
+import re
+import threading
+
+import html2text
+
+try:
+    import lxml.html
+except ImportError:  # lxml es opcional
+    lxml = None
+
+EXTRACTORS = ("html2text", "lxml")
+
+_BLOCK_TAGS = {
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "section", "article",
+    "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "hr",
+}
+_CELL_TAGS = {"td", "th"}
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_SPACES_RE = re.compile(r"[ \t\xa0]+")
+
+
+class Html2TextExtractor:
+    """Conversión con html2text (misma configuración que siempre)."""
+
+    def __init__(self):
+        self.h2t = html2text.HTML2Text()
+        self.h2t.ignore_links = False
+        self.h2t.ignore_images = True
+        self.h2t.body_width = 0
+
+    def convert(self, html: str) -> str:
+        return self.h2t.handle(html).strip()
+
+
+class LxmlExtractor:
+    """Conversión con lxml: texto plano por bloques, links como [texto](url)."""
+
+    def __init__(self):
+        if lxml is None:
+            raise ValueError("HTML_EXTRACTOR=lxml requiere instalar lxml: pip install lxml")
+
+    def convert(self, html: str) -> str:
+        try:
+            doc = lxml.html.fromstring(html)
+        except (ValueError, lxml.etree.ParserError):
+            return ""
+
+        for node in doc.xpath("//script | //style | //head | //noscript | //img"):
+            node.drop_tree()
+
+        for a in list(doc.iter("a")):
+            href = a.get("href")
+            label = a.text_content().strip()
+            tail = a.tail
+            for child in list(a):
+                a.remove(child)
+            a.text = f"[{label}]({href})" if href and label else label
+            a.tail = tail
+
+        for node in doc.iter():
+            if not isinstance(node.tag, str):
+                continue
+            tag = node.tag.lower()
+            if tag in _BLOCK_TAGS:
+                node.tail = "\n" + (node.tail or "")
+                if tag != "br":
+                    node.text = "\n" + (node.text or "")
+            elif tag in _CELL_TAGS:
+                node.tail = " " + (node.tail or "")
+
+        lines = (_SPACES_RE.sub(" ", line).strip() for line in doc.text_content().splitlines())
+        return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+_local = threading.local()
+
+
+def get_extractor(name: str = "html2text"):
+    """Retorna el extractor pedido (uno por thread; HTML2Text guarda estado)."""
+    extractors = getattr(_local, "extractors", None)
+    if extractors is None:
+        extractors = _local.extractors = {}
+
+    if name not in extractors:
+        if name == "html2text":
+            extractors[name] = Html2TextExtractor()
+        elif name == "lxml":
+            extractors[name] = LxmlExtractor()
+        else:
+            raise ValueError(f"HTML_EXTRACTOR inválido: {name} (usa {', '.join(EXTRACTORS)})")
+    return extractors[name]
+
+
+def html_to_text(html: str, extractor: str = "html2text") -> str:
+    """Convertir HTML a texto con el extractor indicado."""
+    return get_extractor(extractor).convert(html)
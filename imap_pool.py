@@ -0,0 +1,113 @@
+"""
+Pool acotado de conexiones IMAP autenticadas.
+
+Cada conexión tiene el label seleccionado en modo lectura, así que los
+workers pueden hacer UID FETCH en paralelo. Si una conexión se cae a mitad
+de la ejecución se reconecta y se reintenta la operación.
+"""
+
+import imaplib
+import queue
+import threading
+from typing import Callable
+
+
+class IMAPConnectionPool:
+    def __init__(self, connect: Callable[[], imaplib.IMAP4], label_name: str, size: int):
+        """
+        Args:
+            connect: Función que retorna una conexión IMAP ya autenticada
+            label_name: Label a seleccionar (read-only) en cada conexión
+            size: Máximo de conexiones abiertas a la vez
+        """
+        self._connect = connect
+        self.label_name = label_name
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open(self) -> imaplib.IMAP4:
+        """Abrir una conexión nueva con el label seleccionado."""
+        conn = self._connect()
+        status, _ = conn.select(f'"{self.label_name}"', readonly=True)
+        if status != "OK":
+            conn.logout()
+            raise ValueError(f"Label '{self.label_name}' no encontrado en Gmail")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def acquire(self) -> imaplib.IMAP4:
+        """Tomar una conexión libre, abriendo una nueva si no se alcanzó el límite."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if not can_create:
+            return self._idle.get()
+
+        try:
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, conn: imaplib.IMAP4):
+        """Devolver una conexión al pool."""
+        self._idle.put(conn)
+
+    def reconnect(self, conn: imaplib.IMAP4) -> imaplib.IMAP4:
+        """Reemplazar una conexión caída por una nueva."""
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.logout()
+        except Exception:
+            pass
+        return self._open()
+
+    def run(self, fn: Callable[[imaplib.IMAP4], object], retries: int = 1):
+        """
+        Ejecutar fn(conexión) con una conexión del pool.
+
+        Si la conexión se cae (abort o error de socket) se reconecta y se
+        reintenta hasta `retries` veces.
+        """
+        conn = self.acquire()
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    return fn(conn)
+                except (imaplib.IMAP4.abort, OSError) as e:
+                    if attempt == retries:
+                        raise
+                    print(f"⚠️  Conexión IMAP caída ({e}), reconectando...")
+                    conn = self.reconnect(conn)
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Cerrar todas las conexiones abiertas por el pool."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.logout()
+            except Exception:
+                pass
@@ -0,0 +1,247 @@
+"""
+Utilidades para interpretar respuestas IMAP.
+
+imaplib entrega las respuestas de FETCH como una lista mezclada de bytes y
+tuplas (header, literal). Cuando se piden varios mensajes en un solo comando
+los items de cada mensaje llegan intercalados, así que aquí se tokeniza la
+respuesta completa y se agrupa por mensaje.
+"""
+
+import binascii
+import email.message
+import quopri
+import re
+
+_LITERAL_RE = re.compile(rb"\{(\d+)\}$")
+
+
+def message_set(ids: list) -> str:
+    """
+    Construir un message-set IMAP compacto a partir de una lista de IDs.
+
+    Los IDs consecutivos se colapsan en rangos: [1, 2, 3, 7, 9, 10] → "1:3,7,9:10".
+    """
+    numbers = sorted({int(i) for i in ids})
+    if not numbers:
+        return ""
+
+    ranges = []
+    start = prev = numbers[0]
+    for n in numbers[1:]:
+        if n == prev + 1:
+            prev = n
+            continue
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+        start = prev = n
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+
+def _tokenize(chunks: list[bytes]):
+    """
+    Tokenizar los fragmentos de una respuesta IMAP.
+
+    Produce "(" y ")" para listas, str para atoms (None para NIL) y bytes
+    para strings entre comillas y literales.
+    """
+    pending_literal = False
+    for chunk in chunks:
+        if pending_literal:
+            # Este fragmento es el contenido de un literal {n}
+            pending_literal = False
+            yield chunk
+            continue
+
+        i = 0
+        n = len(chunk)
+        while i < n:
+            c = chunk[i:i + 1]
+            if c in b" \r\n\t":
+                i += 1
+            elif c == b"(" or c == b")":
+                yield c.decode()
+                i += 1
+            elif c == b'"':
+                i += 1
+                buf = bytearray()
+                while i < n and chunk[i:i + 1] != b'"':
+                    if chunk[i:i + 1] == b"\\" and i + 1 < n:
+                        i += 1
+                    buf += chunk[i:i + 1]
+                    i += 1
+                i += 1
+                yield bytes(buf)
+            elif c == b"{" and _LITERAL_RE.search(chunk[i:]):
+                # Marcador de literal al final del header: el siguiente
+                # fragmento trae los bytes
+                pending_literal = True
+                break
+            else:
+                start = i
+                depth = 0
+                while i < n:
+                    c = chunk[i:i + 1]
+                    if c == b"[":
+                        depth += 1
+                    elif c == b"]":
+                        depth -= 1
+                    elif depth == 0 and c in b" ()\r\n":
+                        break
+                    i += 1
+                atom = chunk[start:i].decode(errors="replace")
+                yield None if atom.upper() == "NIL" else atom
+
+
+def _build(tokens) -> list:
+    """Construir listas anidadas a partir de los tokens."""
+    stack = [[]]
+    for token in tokens:
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        else:
+            stack[-1].append(token)
+    while len(stack) > 1:
+        done = stack.pop()
+        stack[-1].append(done)
+    return stack[0]
+
+
+def parse_sexpr(data: bytes) -> list:
+    """Parsear una expresión IMAP (p.ej. un BODYSTRUCTURE) a listas anidadas."""
+    return _build(_tokenize([data]))
+
+
+def parse_fetch_response(data: list) -> dict[str, dict]:
+    """
+    Agrupar una respuesta de FETCH por número de secuencia.
+
+    Args:
+        data: Lista devuelta por imaplib (bytes y tuplas header/literal)
+
+    Returns:
+        Dict {seq: {ITEM: valor}} con los nombres de item en mayúsculas.
+        Si el mismo mensaje aparece varias veces, sus items se combinan.
+    """
+    chunks = []
+    for part in data:
+        if isinstance(part, tuple):
+            chunks.extend(p for p in part if p is not None)
+        elif isinstance(part, bytes):
+            chunks.append(part)
+
+    messages: dict[str, dict] = {}
+    tree = _build(_tokenize(chunks))
+
+    # Nivel superior: seq (items...) seq (items...) ...
+    i = 0
+    while i < len(tree):
+        seq = tree[i]
+        if isinstance(seq, str) and seq.isdigit() and i + 1 < len(tree):
+            items = tree[i + 1]
+            if isinstance(items, list):
+                fields = messages.setdefault(seq, {})
+                for k in range(0, len(items) - 1, 2):
+                    key = items[k]
+                    if isinstance(key, str):
+                        fields[key.upper()] = items[k + 1]
+                i += 2
+                continue
+        i += 1
+
+    return messages
+
+
+def _as_str(value) -> str:
+    """Normalizar un valor de BODYSTRUCTURE (bytes/str/None) a str en minúsculas."""
+    if isinstance(value, bytes):
+        return value.decode(errors="replace").lower()
+    if isinstance(value, str):
+        return value.lower()
+    return ""
+
+
+def _params(value) -> dict:
+    """Convertir una lista de parámetros ("CHARSET" "utf-8" ...) a dict."""
+    if not isinstance(value, list):
+        return {}
+    return {_as_str(value[i]): _as_str(value[i + 1]) for i in range(0, len(value) - 1, 2)}
+
+
+def _walk_bodystructure(structure: list, prefix: str = ""):
+    """Recorrer las partes hoja de un BODYSTRUCTURE, produciendo (sección, parte)."""
+    if structure and isinstance(structure[0], list):
+        # multipart: (parte1)(parte2)... subtype params ...
+        index = 1
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            section = f"{prefix}.{index}" if prefix else str(index)
+            yield from _walk_bodystructure(child, section)
+            index += 1
+        return
+
+    # Parte simple; en un mensaje no-multipart el cuerpo es la sección "1"
+    yield prefix or "1", structure
+
+
+def find_text_part(structure: list) -> dict | None:
+    """
+    Elegir la parte de texto a descargar de un BODYSTRUCTURE.
+
+    Sigue la misma preferencia que GmailClient._extract_body: primera parte
+    text/html que no sea adjunto, si no la primera text/plain.
+
+    Returns:
+        Dict con section, subtype, encoding, charset y size, o None si no hay texto.
+    """
+    html_part = None
+    text_part = None
+
+    for section, part in _walk_bodystructure(structure):
+        if len(part) < 7 or _as_str(part[0]) != "text":
+            continue
+
+        subtype = _as_str(part[1])
+        # Extensiones de text/*: lines(7) md5(8) disposition(9)
+        disposition = part[9] if len(part) > 9 else None
+        if isinstance(disposition, list) and _as_str(disposition[0]) == "attachment":
+            continue
+
+        info = {
+            "section": section,
+            "subtype": subtype,
+            "encoding": _as_str(part[5]) or "7bit",
+            "charset": _params(part[2]).get("charset") or "utf-8",
+            "size": int(part[6]) if isinstance(part[6], str) and part[6].isdigit() else 0,
+        }
+        if subtype == "html" and html_part is None:
+            html_part = info
+        elif subtype == "plain" and text_part is None:
+            text_part = info
+
+    return html_part or text_part
+
+
+def decode_transfer_encoding(data: bytes, encoding: str) -> bytes:
+    """
+    Decodificar el Content-Transfer-Encoding de una parte descargada por sección.
+
+    Un base64 mal formado (padding o largo inválido) se decodifica con la
+    misma tolerancia que el modo full (email.message), en vez de fallar.
+    """
+    encoding = (encoding or "").lower()
+    if encoding == "base64":
+        try:
+            return binascii.a2b_base64(b"".join(data.split()))
+        except binascii.Error:
+            part = email.message.Message()
+            part["Content-Transfer-Encoding"] = "base64"
+            part.set_payload(data.decode("ascii", "surrogateescape"))
+            return part.get_payload(decode=True)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(data)
+    return data
@@ -0,0 +1,123 @@
+"""
+Journal de avance de una ejecución (append-only, JSON Lines).
+
+Por cada mensaje se registra hasta dónde llegó:
+
+- fetched: descargado y parseado
+- summarized: clasificado por el LLM (con el resultado)
+- written: enviado a Notion (con el ID de la página)
+
+Los resultados y las páginas se escriben con flush + fsync, así un corte
+(red, error de Groq, notebook suspendida) no pierde lo ya hecho.
+`digest.py --resume` relee el journal y continúa desde el primer paso
+incompleto de cada mensaje; una ejecución que termina bien borra el journal.
+Como solo queda un journal si la ejecución anterior no terminó, digest.py
+retoma solo (sin --resume) cuando encuentra uno, en vez de truncarlo.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Iterator
+
+DEFAULT_JOURNAL_FILE = ".digest_journal.jsonl"
+
+STAGES = ("fetched", "summarized", "written")
+
+
+class RunJournal:
+    def __init__(self, path: str | None = None):
+        self.path = Path(path or os.getenv("DIGEST_JOURNAL_FILE", DEFAULT_JOURNAL_FILE))
+        self._lock = threading.Lock()
+        self._file = None
+
+    def replay(self) -> dict[str, dict]:
+        """
+        Leer el journal y retornar el último estado de cada mensaje:
+        {id: {"stage": ..., "result": ..., "page_id": ...}}.
+
+        Una última línea cortada (el proceso murió escribiéndola) se ignora.
+        """
+        state = {}
+        if not self.path.exists():
+            return state
+
+        with self.path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entry = state.setdefault(record["id"], {"stage": None, "result": None, "page_id": None})
+                if STAGES.index(record["stage"]) >= STAGES.index(entry["stage"] or "fetched"):
+                    entry["stage"] = record["stage"]
+                if "result" in record:
+                    entry["result"] = record["result"]
+                if record.get("page_id"):
+                    entry["page_id"] = record["page_id"]
+        return state
+
+    def unfinished(self) -> bool:
+        """¿Quedó el journal de una ejecución que no terminó? (finish lo borra)"""
+        return self.path.exists() and self.path.stat().st_size > 0
+
+    def open(self, resume: bool = False):
+        """Abrir para escribir: continúa el journal existente o empieza uno nuevo."""
+        self._file = self.path.open("a" if resume else "w", encoding="utf-8")
+        if resume and self._file.tell() > 0:
+            # Cerrar una última línea cortada para no pegarle el próximo registro
+            with self.path.open("rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+        return self
+
+    def _append(self, records: list[dict], sync: bool = True):
+        if not records or self._file is None:
+            return
+        now = time.time()
+        lines = "".join(
+            json.dumps({**record, "ts": now}, ensure_ascii=False) + "\n" for record in records
+        )
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def record_fetched(self, message_ids: Iterable[str]):
+        """Registrar mensajes descargados (sin fsync: se pueden volver a descargar)."""
+        self._append([{"id": message_id, "stage": "fetched"} for message_id in message_ids],
+                     sync=False)
+
+    def record_summarized(self, results: list[tuple[str, dict]]):
+        """Registrar resultados del LLM: [(id, resultado)]."""
+        self._append([
+            {"id": message_id, "stage": "summarized", "result": result}
+            for message_id, result in results
+        ])
+
+    def record_written(self, pages: list[tuple[str, str | None]]):
+        """Registrar páginas creadas en Notion: [(id, page_id)] (None si ya existía)."""
+        self._append([
+            {"id": message_id, "stage": "written", "page_id": page_id}
+            for message_id, page_id in pages
+        ])
+
+    def iter_fetched(self, newsletters: Iterable[dict]) -> Iterator[dict]:
+        """Registrar cada newsletter descargado a medida que pasa (etapa del pipeline)."""
+        for newsletter in newsletters:
+            self.record_fetched([newsletter["id"]])
+            yield newsletter
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def finish(self):
+        """La ejecución terminó bien: no queda nada por retomar."""
+        self.close()
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,222 @@
+"""
+Backends de LLM para el summarizer.
+
+Todos exponen la misma interfaz async:
+
+    completion = await backend.complete(messages, temperature, max_tokens)
+
+y levantan RateLimited ante un 429, así el batching, el cache y el rate
+limiter de NewsletterSummarizer funcionan igual con cualquiera:
+
+- groq: la API de Groq (default)
+- openai: cualquier servidor compatible con /v1/chat/completions
+  (LM Studio, llama.cpp server, vLLM, Ollama...) para backfills locales
+- fake: respuestas JSON determinísticas en el mismo proceso, con latencia
+  configurable. Para correr sin red ni cuota (benchmarks, pruebas).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+
+import httpx
+from groq import AsyncGroq, RateLimitError
+
+from rate_limiter import estimate_tokens, parse_duration
+
+BACKENDS = ("groq", "openai", "fake")
+
+DEFAULT_GROQ_MODEL = "llama-3.3-70b-versatile"
+DEFAULT_OPENAI_BASE_URL = "http://localhost:1234/v1"  # LM Studio
+DEFAULT_OPENAI_MODEL = "local-model"
+
+# Límites sin rate limit real (servidor propio o fake): prácticamente infinitos
+UNLIMITED_TOKENS_PER_MINUTE = 100_000_000
+UNLIMITED_REQUESTS_PER_MINUTE = 1_000_000
+
+OPENAI_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "300"))
+
+
+class RateLimited(Exception):
+    """El backend respondió 429. Lleva los headers para el rate limiter."""
+
+    def __init__(self, message: str, headers=None):
+        super().__init__(message)
+        self.headers = headers or {}
+
+    @property
+    def retry_after(self) -> float | None:
+        return parse_duration(self.headers.get("retry-after"))
+
+
+class Completion:
+    """Respuesta de un backend: contenido, headers HTTP y tokens usados."""
+
+    def __init__(self, content: str, headers=None, prompt_tokens: int | None = None,
+                 completion_tokens: int | None = None):
+        self.content = content
+        self.headers = headers or {}
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    @property
+    def total_tokens(self) -> int | None:
+        if self.prompt_tokens is None and self.completion_tokens is None:
+            return None
+        return (self.prompt_tokens or 0) + (self.completion_tokens or 0)
+
+
+class GroqBackend:
+    name = "groq"
+
+    def __init__(self, model: str | None = None, http_client: httpx.AsyncClient | None = None):
+        api_key = os.getenv("GROQ_API_KEY")
+        if not api_key:
+            raise ValueError(
+                "GROQ_API_KEY no configurada en .env\n"
+                "Obtén tu API key gratis en: https://console.groq.com/keys"
+            )
+
+        # Los reintentos ante 429 los maneja el summarizer con el rate limiter
+        # http_client permite inyectar un transporte (bench/check_backends.py)
+        self.client = AsyncGroq(api_key=api_key, max_retries=0, http_client=http_client)
+        self.model = model or DEFAULT_GROQ_MODEL
+        self.label = "Groq (Llama 3.3)" if self.model == DEFAULT_GROQ_MODEL else f"Groq ({self.model})"
+        # Tier gratuito por defecto: 12k tokens/min, 30 requests/min
+        self.tokens_per_minute = int(os.getenv("GROQ_TOKENS_PER_MINUTE", "12000"))
+        self.requests_per_minute = int(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30"))
+
+    async def complete(self, messages: list[dict], temperature: float, max_tokens: int) -> Completion:
+        try:
+            raw = await self.client.chat.completions.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+        except RateLimitError as e:
+            raise RateLimited(str(e), e.response.headers) from e
+
+        response = await raw.parse()
+        usage = getattr(response, "usage", None)
+        return Completion(
+            response.choices[0].message.content,
+            raw.headers,
+            getattr(usage, "prompt_tokens", None),
+            getattr(usage, "completion_tokens", None),
+        )
+
+    async def close(self):
+        await self.client.close()
+
+
+class OpenAICompatibleBackend:
+    name = "openai"
+
+    def __init__(self, model: str | None = None, base_url: str | None = None):
+        self.base_url = (base_url or os.getenv("LLM_BASE_URL", DEFAULT_OPENAI_BASE_URL)).rstrip("/")
+        self.model = model or DEFAULT_OPENAI_MODEL
+        self.label = f"{self.model} en {self.base_url}"
+        # Un servidor propio no tiene cuota: sin límite salvo que se configure
+        self.tokens_per_minute = int(os.getenv("LLM_TOKENS_PER_MINUTE", UNLIMITED_TOKENS_PER_MINUTE))
+        self.requests_per_minute = int(os.getenv("LLM_REQUESTS_PER_MINUTE", UNLIMITED_REQUESTS_PER_MINUTE))
+
+        headers = {}
+        api_key = os.getenv("LLM_API_KEY")
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        self.client = httpx.AsyncClient(headers=headers, timeout=OPENAI_TIMEOUT)
+
+    async def complete(self, messages: list[dict], temperature: float, max_tokens: int) -> Completion:
+        response = await self.client.post(
+            f"{self.base_url}/chat/completions",
+            json={
+                "model": self.model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+            },
+        )
+        if response.status_code == 429:
+            raise RateLimited(f"429 de {self.base_url}", response.headers)
+        response.raise_for_status()
+
+        data = response.json()
+        usage = data.get("usage") or {}
+        return Completion(
+            data["choices"][0]["message"]["content"],
+            response.headers,
+            usage.get("prompt_tokens"),
+            usage.get("completion_tokens"),
+        )
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class FakeBackend:
+    """
+    Backend en memoria: clasifica cada "Newsletter N<i>" del prompt con un
+    resultado válido derivado del hash de su texto (mismo input, misma salida).
+    """
+
+    name = "fake"
+
+    _ITEM_RE = re.compile(
+        r"Newsletter (N\d+):\s*\nAsunto: ([^\n]*)\nDe: ([^\n]*)\nContenido:\n(.*?)(?=\n---\n|\Z)", re.S
+    )
+    _CAMPOS = ("machine-learning", "data-engineering", "llm", "analytics-bi", "mlops")
+    _CATEGORIAS = ("Herramienta", "Tutorial", "Noticia")
+
+    def __init__(self, model: str | None = None, latency: float | None = None):
+        self.model = model or "fake"
+        self.label = "backend fake"
+        self.latency = latency if latency is not None else float(os.getenv("FAKE_LLM_LATENCY", "0"))
+        self.tokens_per_minute = int(os.getenv("LLM_TOKENS_PER_MINUTE", UNLIMITED_TOKENS_PER_MINUTE))
+        self.requests_per_minute = int(os.getenv("LLM_REQUESTS_PER_MINUTE", UNLIMITED_REQUESTS_PER_MINUTE))
+        self.requests = 0
+
+    async def complete(self, messages: list[dict], temperature: float, max_tokens: int) -> Completion:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond(messages)
+
+    def respond(self, messages: list[dict]) -> Completion:
+        """Armar la respuesta sin esperar (también la usa el endpoint fake de bench/)."""
+        prompt = messages[-1]["content"]
+        items = []
+        for item_id, subject, sender, body in self._ITEM_RE.findall(prompt):
+            h = int(hashlib.sha1(f"{subject}\n{body}".encode()).hexdigest(), 16)
+            categoria = self._CATEGORIAS[h % 3]
+            items.append({
+                "id": item_id,
+                "titulo": subject.strip() or "Sin asunto",
+                "fuente": sender.strip(),
+                "categoria": categoria,
+                "herramienta": "pandas" if categoria == "Herramienta" else None,
+                "resumen": body.strip().split("\n")[0][:160],
+                "tags": [categoria.lower(), self._CAMPOS[h % len(self._CAMPOS)]],
+            })
+
+        content = json.dumps({"newsletters": items}, ensure_ascii=False)
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        return Completion(content, {}, prompt_tokens, estimate_tokens(content))
+
+    async def close(self):
+        pass
+
+
+def create_backend(name: str | None = None, model: str | None = None):
+    """Crear el backend pedido (default: LLM_BACKEND o groq)."""
+    name = name or os.getenv("LLM_BACKEND", "groq")
+    model = model or os.getenv("LLM_MODEL") or None
+    if name == "groq":
+        return GroqBackend(model)
+    if name == "openai":
+        return OpenAICompatibleBackend(model)
+    if name == "fake":
+        return FakeBackend(model)
+    raise ValueError(f"LLM_BACKEND inválido: {name} (usa {', '.join(BACKENDS)})")
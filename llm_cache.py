@@ -0,0 +1,73 @@
+"""
+Cache persistente (SQLite) de clasificaciones del LLM, por contenido.
+
+La clave es un hash del modelo, el SYSTEM_PROMPT y el contenido original de
+cada newsletter (asunto, remitente y cuerpo sin compactar, más el modo de
+compactación). Si cambia cualquiera la entrada deja de coincidir, así que
+no hace falta invalidar a mano; lo que PromptCompactor aprende entre
+ejecuciones no la cambia. Repetir una ejecución
+(o un batch que falló a medias) no vuelve a gastar tokens en lo ya clasificado.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_LLM_CACHE_FILE = ".llm_cache.db"
+DEFAULT_MAX_AGE_DAYS = 90
+
+
+def cache_key(model: str, system_prompt: str, item_text: str) -> str:
+    """Hash del modelo, el prompt de sistema y el contenido del newsletter."""
+    digest = hashlib.sha256()
+    for part in (model, system_prompt, item_text):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str | None = None, max_age_days: float | None = None):
+        self.path = path or os.getenv("LLM_CACHE_FILE", DEFAULT_LLM_CACHE_FILE)
+        self.max_age_days = max_age_days if max_age_days is not None else float(
+            os.getenv("LLM_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE_DAYS)
+        )
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._db.execute(
+            "DELETE FROM results WHERE created_at < ?",
+            (time.time() - self.max_age_days * 86400,),
+        )
+        self._db.commit()
+
+    def get(self, key: str) -> dict | None:
+        """Retorna el resultado cacheado o None."""
+        with self._lock:
+            row = self._db.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, model: str, result: dict):
+        """Guardar el resultado de un newsletter."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, model, result, created_at) VALUES (?, ?, ?, ?)",
+                (key, model, json.dumps(result, ensure_ascii=False), time.time()),
+            )
+            self._db.commit()
+
+    def close(self):
+        """Cerrar la base de datos."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,134 @@
+"""
+Cache local (SQLite) de mensajes ya parseados, por Gmail message ID.
+
+Guarda el resultado de parsear cada mensaje (subject, from, date y el cuerpo
+ya convertido a texto), así una re-ejecución sobre la misma ventana no vuelve
+a descargar cuerpos ni a correr html2text. Se purga por antigüedad y tamaño.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_MESSAGE_CACHE_FILE = ".message_cache.db"
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_MB = 200
+
+
+class MessageCache:
+    def __init__(self, path: str | None = None, max_age_days: float | None = None,
+                 max_mb: float | None = None):
+        self.path = path or os.getenv("MESSAGE_CACHE_FILE", DEFAULT_MESSAGE_CACHE_FILE)
+        self.max_age_days = max_age_days if max_age_days is not None else float(
+            os.getenv("MESSAGE_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE_DAYS)
+        )
+        self.max_bytes = int((max_mb if max_mb is not None else float(
+            os.getenv("MESSAGE_CACHE_MAX_MB", DEFAULT_MAX_MB)
+        )) * 1024 * 1024)
+
+        # Una sola conexión compartida entre los threads de descarga
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                gmail_id TEXT NOT NULL,
+                extractor TEXT NOT NULL,
+                subject TEXT,
+                sender TEXT,
+                date TEXT,
+                body TEXT,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (gmail_id, extractor)
+            )
+        """)
+        self._db.commit()
+        self.evict()
+
+    def get_many(self, gmail_ids: list[str], extractor: str) -> dict[str, dict]:
+        """Retorna {gmail_id: newsletter} para los IDs que están en cache."""
+        if not gmail_ids:
+            return {}
+
+        found = {}
+        with self._lock:
+            for start in range(0, len(gmail_ids), 500):
+                chunk = gmail_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._db.execute(
+                    f"SELECT gmail_id, subject, sender, date, body FROM messages "
+                    f"WHERE extractor = ? AND gmail_id IN ({placeholders})",
+                    [extractor, *chunk],
+                ).fetchall()
+                for gmail_id, subject, sender, date, body in rows:
+                    found[gmail_id] = {
+                        "id": gmail_id,
+                        "subject": subject,
+                        "from": sender,
+                        "date": datetime.fromisoformat(date),
+                        "body": body,
+                    }
+            if found:
+                self._db.executemany(
+                    "UPDATE messages SET accessed_at = ? WHERE gmail_id = ? AND extractor = ?",
+                    [(time.time(), gmail_id, extractor) for gmail_id in found],
+                )
+                self._db.commit()
+        return found
+
+    def put_many(self, newsletters: list[dict], extractor: str):
+        """Guardar newsletters parseados (usa newsletter['id'] como clave)."""
+        if not newsletters:
+            return
+        now = time.time()
+        rows = [
+            (
+                nl["id"], extractor, nl["subject"], nl["from"], nl["date"].isoformat(),
+                nl["body"], len(nl["body"].encode()) + len(nl["subject"]), now, now,
+            )
+            for nl in newsletters
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO messages "
+                "(gmail_id, extractor, subject, sender, date, body, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+
+    def evict(self) -> int:
+        """Purgar entradas viejas y, si el cache excede el tamaño, las menos usadas."""
+        with self._lock:
+            cutoff = time.time() - self.max_age_days * 86400
+            deleted = self._db.execute(
+                "DELETE FROM messages WHERE created_at < ?", (cutoff,)
+            ).rowcount
+
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                rows = self._db.execute(
+                    "SELECT gmail_id, extractor, size FROM messages ORDER BY accessed_at"
+                ).fetchall()
+                victims = []
+                for gmail_id, extractor, size in rows:
+                    if excess <= 0:
+                        break
+                    victims.append((gmail_id, extractor))
+                    excess -= size
+                self._db.executemany(
+                    "DELETE FROM messages WHERE gmail_id = ? AND extractor = ?", victims
+                )
+                deleted += len(victims)
+
+            self._db.commit()
+        return deleted
+
+    def close(self):
+        """Cerrar la base de datos."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,204 @@
+"""
+Parseo de mensajes descargados por IMAP a diccionarios de newsletter.
+
+Son funciones puras (sin conexión IMAP) para poder correrlas en un pool de
+procesos: el decode MIME y la conversión HTML → texto son la parte de la
+descarga que más CPU consume.
+"""
+
+import email
+import email.message
+import email.policy
+from datetime import datetime
+from email.header import decode_header
+from email.parser import BytesParser
+from email.utils import parsedate_to_datetime
+
+from html_extract import html_to_text
+from imap_utils import decode_transfer_encoding
+
+# Máximo de caracteres de cuerpo que se guardan por newsletter
+MAX_BODY_CHARS = 15000
+
+
+class TextPartsMessage(email.message.Message):
+    """
+    Message que no guarda el contenido de las partes que no son texto.
+
+    El parser asigna el payload de cada parte al cerrarla: los adjuntos e
+    imágenes inline (base64, a veces MBs) se descartan ahí mismo en lugar de
+    quedar en el árbol hasta que termina el parseo del mensaje.
+    """
+
+    def set_payload(self, payload, charset=None):
+        if isinstance(payload, str) and self.get_content_maintype() not in ("text", "multipart", "message"):
+            payload = ""
+        super().set_payload(payload, charset)
+
+
+_text_parser = BytesParser(_class=TextPartsMessage, policy=email.policy.compat32)
+
+
+def decode_header_value(value: str) -> str:
+    """Decodificar un header que puede tener encoding MIME (y desplegar sus líneas)."""
+    decoded_parts = decode_header(value)
+    result = []
+    for part, charset in decoded_parts:
+        if isinstance(part, bytes):
+            result.append(part.decode(charset or "utf-8", errors="replace"))
+        else:
+            result.append(part)
+    # Los headers largos llegan plegados en varias líneas ("\r\n ")
+    return " ".join("".join(result).split())
+
+
+def convert_body(html_body: str | None, text_body: str | None,
+                 extractor: str = "html2text") -> str:
+    """Preferir HTML convertido a texto; si no hay, usar text/plain."""
+    if html_body:
+        return html_to_text(html_body, extractor)
+    if text_body:
+        return text_body.strip()
+    return ""
+
+
+def extract_body(msg: email.message.Message, extractor: str = "html2text") -> str:
+    """Extraer el cuerpo del mensaje (preferir HTML, convertir a texto)."""
+    html_body = None
+    text_body = None
+
+    if msg.is_multipart():
+        for part in msg.walk():
+            content_type = part.get_content_type()
+            content_disposition = str(part.get("Content-Disposition", ""))
+
+            # Saltar adjuntos
+            if "attachment" in content_disposition:
+                continue
+
+            try:
+                payload = part.get_payload(decode=True)
+                if payload is None:
+                    continue
+                charset = part.get_content_charset() or "utf-8"
+                text = payload.decode(charset, errors="replace")
+            except Exception:
+                continue
+
+            if content_type == "text/html" and html_body is None:
+                html_body = text
+            elif content_type == "text/plain" and text_body is None:
+                text_body = text
+    else:
+        try:
+            payload = msg.get_payload(decode=True)
+            if payload:
+                charset = msg.get_content_charset() or "utf-8"
+                text = payload.decode(charset, errors="replace")
+                if msg.get_content_type() == "text/html":
+                    html_body = text
+                else:
+                    text_body = text
+        except Exception:
+            pass
+
+    return convert_body(html_body, text_body, extractor)
+
+
+def gmail_link(gmail_id: str) -> str:
+    """Link al mensaje en la web de Gmail."""
+    return f"https://mail.google.com/mail/u/0/#inbox/{gmail_id}"
+
+
+def newsletter_record(msg_id: bytes, fields: dict,
+                      headers: email.message.Message, body: str) -> dict:
+    """Armar el dict final (id, subject, from, date, body)."""
+    # Gmail message ID (decimal) → hex para el link de Gmail
+    gmail_id = None
+    x_gm_msgid = fields.get("X-GM-MSGID")
+    if x_gm_msgid and x_gm_msgid.isdigit():
+        gmail_id = format(int(x_gm_msgid), "x")
+
+    subject = decode_header_value(headers.get("Subject", "Sin asunto"))
+    sender = decode_header_value(headers.get("From", "Desconocido"))
+    date_str = headers.get("Date")
+
+    date = datetime.now()
+    if date_str:
+        try:
+            date = parsedate_to_datetime(date_str)
+        except Exception:
+            pass
+
+    return {
+        "id": gmail_id or msg_id.decode(),
+        "subject": subject,
+        "from": sender,
+        "date": date,
+        "body": body[:MAX_BODY_CHARS],
+    }
+
+
+def parse_full(msg_id: bytes, fields: dict, extractor: str = "html2text") -> dict | None:
+    """Construir el dict del newsletter a partir de un FETCH con RFC822."""
+    try:
+        raw_email = fields.get("RFC822")
+        if not isinstance(raw_email, bytes):
+            return None
+
+        msg = _text_parser.parsebytes(raw_email)
+        body = extract_body(msg, extractor)
+        return newsletter_record(msg_id, fields, msg, body)
+    except Exception as e:
+        print(f"Error parseando mensaje {msg_id}: {e}")
+        return None
+
+
+def parse_partial(msg_id: bytes, fields: dict, part: dict | None, payload,
+                  extractor: str = "html2text") -> dict | None:
+    """Construir el dict del newsletter a partir de headers + una sola parte."""
+    try:
+        header_bytes = next(
+            (v for k, v in fields.items() if k.startswith("BODY[HEADER.FIELDS")), None
+        )
+        if not isinstance(header_bytes, bytes):
+            return None
+
+        headers = email.message_from_bytes(header_bytes)
+
+        html_body = None
+        text_body = None
+        if part and isinstance(payload, bytes):
+            try:
+                decoded = decode_transfer_encoding(payload, part["encoding"])
+            except Exception as e:
+                # Solo se pierde el cuerpo: el mensaje sigue con sus headers
+                print(f"Error decodificando el cuerpo de {msg_id}: {e}")
+                decoded = b""
+            try:
+                text = decoded.decode(part["charset"], errors="replace")
+            except LookupError:
+                text = decoded.decode("utf-8", errors="replace")
+            if part["subtype"] == "html":
+                html_body = text
+            else:
+                text_body = text
+
+        body = convert_body(html_body, text_body, extractor)
+        return newsletter_record(msg_id, fields, headers, body)
+    except Exception as e:
+        print(f"Error parseando mensaje {msg_id}: {e}")
+        return None
+
+
+def parse_job(job: tuple) -> dict | None:
+    """
+    Punto de entrada para el pool de procesos.
+
+    job es ("full", msg_id, fields, extractor) o
+    ("partial", msg_id, fields, part, payload, extractor).
+    """
+    kind, *args = job
+    if kind == "partial":
+        return parse_partial(*args)
+    return parse_full(*args)
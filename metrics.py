@@ -0,0 +1,184 @@
+"""
+Métricas de una ejecución: contadores y tiempos por etapa.
+
+GmailClient, NewsletterSummarizer, NotionClient y el pipeline registran en
+el registro global `metrics` (thread-safe). Al final, `digest.py --metrics DIR`
+lo exporta como reporte JSON y como textfile de Prometheus (para el
+textfile collector de node_exporter).
+
+Nombres usados:
+- counters: imap.bytes_fetched, messages.parsed, message_cache.hits,
+  llm.prompt_tokens, llm.completion_tokens, llm.rate_limited, llm.cache_hits,
+  notion.retries...
+- timings (segundos): stage.*, imap.search, imap.fetch, parse,
+  llm.request, llm.rate_limit_sleep, notion.request, notion.throttle_sleep
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+PROMETHEUS_PREFIX = "newsletter_digest"
+PROMETHEUS_FILE = "newsletter_digest.prom"
+
+# Muestras por timing para calcular percentiles (reservoir sampling)
+MAX_SAMPLES = 10000
+
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Percentil q (0-100) de una lista ya ordenada (interpolación lineal)."""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters: dict[str, float] = {}
+            # nombre -> [cantidad, total, máximo]
+            self.timings: dict[str, list[float]] = {}
+            self.samples: dict[str, list[float]] = {}
+
+    def inc(self, name: str, value: float = 1):
+        """Sumar `value` a un contador."""
+        if not value:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        """Registrar una duración."""
+        with self._lock:
+            entry = self.timings.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+            samples = self.samples.setdefault(name, [])
+            if len(samples) < MAX_SAMPLES:
+                samples.append(seconds)
+            else:
+                slot = random.randrange(int(entry[0]))
+                if slot < MAX_SAMPLES:
+                    samples[slot] = seconds
+
+    @contextmanager
+    def timer(self, name: str):
+        """Medir el bloque con `observe(name, ...)` (aunque termine con excepción)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def report(self) -> dict:
+        """Reporte JSON de la ejecución, con algunas tasas derivadas."""
+        with self._lock:
+            counters = dict(self.counters)
+            timings = {}
+            for name, (count, total, maximum) in self.timings.items():
+                samples = sorted(self.samples.get(name, ()))
+                timings[name] = {
+                    "count": count,
+                    "total_seconds": round(total, 3),
+                    "avg_seconds": round(total / count, 4) if count else 0.0,
+                    "p50_seconds": round(percentile(samples, 50), 4),
+                    "p95_seconds": round(percentile(samples, 95), 4),
+                    "p99_seconds": round(percentile(samples, 99), 4),
+                    "max_seconds": round(maximum, 3),
+                }
+
+        def _total(name):
+            return timings.get(name, {}).get("total_seconds", 0.0)
+
+        derived = {}
+        if _total("parse"):
+            derived["messages_parsed_per_second"] = round(
+                counters.get("messages.parsed", 0) / _total("parse"), 2
+            )
+        if _total("imap.fetch"):
+            derived["imap_bytes_per_second"] = round(
+                counters.get("imap.bytes_fetched", 0) / _total("imap.fetch"), 1
+            )
+
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_seconds": round(time.time() - self.started, 3),
+            "counters": counters,
+            "timings": timings,
+            "derived": derived,
+        }
+
+    def prometheus(self) -> str:
+        """Formato de exposición de Prometheus (counters y summaries)."""
+        report = self.report()
+        lines = []
+
+        def _name(name):
+            return f"{PROMETHEUS_PREFIX}_{_NAME_RE.sub('_', name)}"
+
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_run_wall_seconds gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}_run_wall_seconds {report['wall_seconds']}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_run_timestamp_seconds gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}_run_timestamp_seconds {int(self.started)}")
+
+        for name, value in sorted(report["counters"].items()):
+            metric = _name(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+
+        for name, timing in sorted(report["timings"].items()):
+            metric = _name(name) + "_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for q in (50, 95, 99):
+                lines.append(f'{metric}{{quantile="{q / 100}"}} {timing[f"p{q}_seconds"]}')
+            lines.append(f"{metric}_sum {timing['total_seconds']}")
+            lines.append(f"{metric}_count {timing['count']}")
+            lines.append(f"# TYPE {metric}_max gauge")
+            lines.append(f"{metric}_max {timing['max_seconds']}")
+
+        for name, value in sorted(report["derived"].items()):
+            metric = _name(name)
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str) -> tuple[Path, Path]:
+        """
+        Escribir el reporte JSON y el textfile de Prometheus en `directory`.
+
+        El .prom se escribe con rename atómico: el collector nunca lee un
+        archivo a medio escribir.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        report_path = directory / f"digest_report_{time.strftime('%Y-%m-%d_%H%M%S', time.localtime(self.started))}.json"
+        report_path.write_text(json.dumps(self.report(), indent=2))
+
+        prom_path = directory / PROMETHEUS_FILE
+        tmp = prom_path.with_name(prom_path.name + ".tmp")
+        tmp.write_text(self.prometheus())
+        os.replace(tmp, prom_path)
+        return report_path, prom_path
+
+
+# Registro global de la ejecución
+metrics = Metrics()
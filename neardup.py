@@ -0,0 +1,200 @@
+"""
+Detección de newsletters casi duplicados (MinHash + LSH).
+
+El mismo anuncio suele llegar de varios remitentes, o como re-envío con otro
+asunto. Esta etapa (entre GmailClient y el summarizer) agrupa los cuerpos
+casi iguales y deja pasar solo el primero de cada grupo; los demás quedan
+como metadata en newsletter["duplicados"] en lugar de clasificarse aparte.
+
+Cada cuerpo se reduce a una firma MinHash de sus shingles (5 palabras) y la
+firma se indexa por bandas (LSH): solo se comparan los mensajes que
+comparten alguna banda, así el costo no crece en forma cuadrática.
+
+Los re-envíos llegan a los pocos días del original: un representante más
+viejo que NEAR_DUP_HORIZON_DAYS (respecto del mensaje más nuevo visto) se
+olvida. Así en un --backfill de meses el estado queda acotado a la
+ventana de días, no al tamaño del backlog.
+"""
+
+import hashlib
+import os
+import random
+import re
+from array import array
+from typing import Iterable, Iterator, Sequence
+
+from compaction import strip_markup
+from message_parser import gmail_link
+
+# Similitud de Jaccard estimada a partir de la cual dos cuerpos son el mismo contenido
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.7"))
+# Días que un representante sigue agrupando casi duplicados
+NEAR_DUP_HORIZON_DAYS = float(os.getenv("NEAR_DUP_HORIZON_DAYS", "7"))
+
+SHINGLE_WORDS = 5
+NUM_PERM = 64
+# 16 bandas de 4 filas: candidatos desde ~50% de similitud, luego se verifica el umbral
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+
+# Cuerpos con menos palabras no se comparan (demasiado poco texto para decidir)
+MIN_WORDS = 30
+
+# Permutaciones aproximadas: XOR del hash de 64 bits del shingle con máscaras fijas
+_MASKS = [random.Random(1337 + i).getrandbits(64) for i in range(NUM_PERM)]
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: str) -> set[int]:
+    """Hashes de 64 bits de los shingles de SHINGLE_WORDS palabras (sin URLs ni mayúsculas)."""
+    words = _WORD_RE.findall(strip_markup(text).lower())
+    if len(words) < MIN_WORDS:
+        return set()
+    return {
+        int.from_bytes(
+            hashlib.blake2b(" ".join(words[i:i + SHINGLE_WORDS]).encode(), digest_size=8).digest(),
+            "big",
+        )
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
+
+def minhash(hashes: set[int]) -> tuple[int, ...]:
+    """Firma MinHash de NUM_PERM valores."""
+    return tuple(min([h ^ mask for h in hashes]) for mask in _MASKS)
+
+
+def similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """Similitud de Jaccard estimada entre dos firmas."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+class _Representative:
+    """Lo que se guarda de cada grupo: firma y fuentes extra (no el newsletter con su cuerpo)."""
+
+    __slots__ = ("signature", "duplicados", "gmail_id", "seen")
+
+    def __init__(self, signature: array, duplicados: list, gmail_id: str | None = None,
+                 seen: float = 0.0):
+        self.signature = signature
+        self.duplicados = duplicados
+        self.gmail_id = gmail_id
+        # Fecha del mensaje (timestamp) para expirarlo después del horizonte
+        self.seen = seen
+
+
+class NearDuplicateFilter:
+    def __init__(self, threshold: float | None = None, horizon_days: float | None = None):
+        self.threshold = threshold if threshold is not None else NEAR_DUP_THRESHOLD
+        horizon_days = horizon_days if horizon_days is not None else NEAR_DUP_HORIZON_DAYS
+        self.horizon = horizon_days * 86400
+        # hash de (banda, valores de la banda) -> índices de representantes
+        self._buckets: dict[int, list[int]] = {}
+        # índice -> representante, en orden de llegada (los más viejos primero)
+        self._representatives: dict[int, _Representative] = {}
+        self._next_idx = 0
+        # Fecha del mensaje más nuevo visto (timestamp)
+        self._clock = 0.0
+        self.collapsed = 0
+        # (ID colapsado, ID del representante) aún no registrados (ver pop_collapsed)
+        self._collapsed_ids: list[tuple[str, str]] = []
+
+    def _bands(self, signature: tuple[int, ...]) -> list[int]:
+        # Una colisión de hash solo agrega un candidato: la similitud se verifica igual
+        return [
+            hash((band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]))
+            for band in range(LSH_BANDS)
+        ]
+
+    def find(self, signature: tuple[int, ...]) -> _Representative | None:
+        """Representante casi igual a la firma dada, o None."""
+        seen = set()
+        best, best_score = None, self.threshold
+        for key in self._bands(signature):
+            for idx in self._buckets.get(key, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                rep = self._representatives[idx]
+                score = similarity(signature, rep.signature)
+                if score >= best_score:
+                    best, best_score = rep, score
+        return best
+
+    def add(self, signature: tuple[int, ...], newsletter: dict, seen: float = 0.0):
+        """Registrar un newsletter como representante de su grupo."""
+        idx = self._next_idx
+        self._next_idx += 1
+        # La lista se crea ya: el resultado del LLM la comparte y ve los que lleguen después
+        newsletter["duplicados"] = []
+        # Firma como array de 64 bits: ~0.5 KB por representante
+        self._representatives[idx] = _Representative(
+            array("Q", signature), newsletter["duplicados"], newsletter.get("id"), seen
+        )
+        for key in self._bands(signature):
+            self._buckets.setdefault(key, []).append(idx)
+
+    def _expire(self):
+        """Olvidar los representantes más viejos que el horizonte (en orden de llegada)."""
+        limit = self._clock - self.horizon
+        while self._representatives:
+            idx, rep = next(iter(self._representatives.items()))
+            if rep.seen >= limit:
+                return
+            del self._representatives[idx]
+            for key in self._bands(tuple(rep.signature)):
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    continue
+                bucket.remove(idx)
+                if not bucket:
+                    del self._buckets[key]
+
+    def check(self, newsletter: dict) -> bool:
+        """
+        Retorna True si el newsletter es nuevo (representante) y False si es
+        casi duplicado de uno anterior, al que se agrega como fuente extra.
+        """
+        hashes = shingles(newsletter.get("body", ""))
+        if not hashes:
+            return True
+
+        date = newsletter.get("date")
+        seen = date.timestamp() if date else self._clock
+        if seen > self._clock:
+            self._clock = seen
+            self._expire()
+
+        signature = minhash(hashes)
+        rep = self.find(signature)
+        if rep is None:
+            self.add(signature, newsletter, seen)
+            return True
+
+        rep.duplicados.append({
+            "fuente": newsletter.get("from", ""),
+            "asunto": newsletter.get("subject", ""),
+            "fecha": newsletter["date"].strftime("%Y-%m-%d") if newsletter.get("date") else None,
+            "link": gmail_link(newsletter["id"]),
+        })
+        self.collapsed += 1
+        if rep.gmail_id and newsletter.get("id"):
+            self._collapsed_ids.append((newsletter["id"], rep.gmail_id))
+        return False
+
+    def pop_collapsed(self) -> list[tuple[str, str]]:
+        """
+        Retornar y olvidar los pares (ID colapsado, ID del representante).
+
+        Un casi duplicado puede llegar después de que su representante ya
+        se envió a Notion; con estos pares se registra igual como cubierto
+        por esa página y no se vuelve a procesar en la próxima ejecución.
+        """
+        collapsed, self._collapsed_ids = self._collapsed_ids, []
+        return collapsed
+
+    def iter_unique(self, newsletters: Iterable[dict]) -> Iterator[dict]:
+        """Dejar pasar solo un newsletter por grupo de casi duplicados."""
+        for newsletter in newsletters:
+            if self.check(newsletter):
+                yield newsletter
@@ -1,81 +1,252 @@
 """
 Módulo para enviar newsletters a Notion.
+
+Las páginas se crean en paralelo con un pool chico de threads sobre una
+requests.Session compartida, sin pasarse del límite de ~3 requests/segundo
+de Notion. Los 429 (respetando Retry-After), los 5xx y los errores de red
+se reintentan con backoff; al crear páginas, antes de reintentar se
+verifica por Link que la página no se haya creado igual.
 """
 
 import os
+import threading
+import time
 import requests
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+from notion_index import NotionIndex, duplicate_gmail_ids, normalize_title
+from rate_limiter import TokenBucket, parse_duration
+
+# Margen al pedir páginas editadas desde la última sincronización:
+# Notion redondea last_edited_time al minuto
+SYNC_MARGIN = timedelta(minutes=2)
+
+# Cada cuántas horas se recorre la base completa para descartar del índice
+# las páginas borradas (la sincronización incremental no las ve)
+NOTION_FULL_SYNC_HOURS = float(os.getenv("NOTION_FULL_SYNC_HOURS", "24"))
+
+# Límite promedio de Notion: 3 requests por segundo por integración
+NOTION_REQUESTS_PER_SECOND = float(os.getenv("NOTION_REQUESTS_PER_SECOND", "3"))
+# Páginas que se crean en paralelo
+NOTION_WORKERS = int(os.getenv("NOTION_WORKERS", "3"))
+# Reintentos ante 429, 5xx y errores de red
+NOTION_MAX_RETRIES = 5
+NOTION_TIMEOUT = 30
 
 
 class NotionClient:
-    def __init__(self):
+    def __init__(self, index: NotionIndex | None = None, database_id: str | None = None):
         self.token = os.getenv("NOTION_TOKEN")
-        self.database_id = os.getenv("NOTION_DATABASE_ID")
-        self.base_url = "https://api.notion.com/v1"
+        # Otra base que NOTION_DATABASE_ID (rutas de digest.py --route)
+        self.database_id = database_id or os.getenv("NOTION_DATABASE_ID")
+        self.base_url = os.getenv("NOTION_BASE_URL", "https://api.notion.com/v1").rstrip("/")
         self.headers = {
             "Authorization": f"Bearer {self.token}",
             "Content-Type": "application/json",
             "Notion-Version": "2022-06-28"
         }
-        self._existing_titles = None
+        # Índice local de páginas existentes (se crea al primer uso)
+        self._index = index
+        # Última sincronización en este proceso (time.monotonic), None = nunca
+        self._index_synced_at = None
+
+        self.workers = max(1, NOTION_WORKERS)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=self.workers))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=self.workers))
+
+        # Rate limit compartido por todos los threads
+        self._bucket = TokenBucket(NOTION_REQUESTS_PER_SECOND, period=1.0)
+        self._blocked_until = 0.0
+        self._rate_lock = threading.Lock()
+        # Claves (título normalizado, link) de páginas que se están creando
+        self._pending: set[str] = set()
+        self._pending_lock = threading.Lock()
 
     def is_configured(self) -> bool:
         """Verificar si Notion está configurado."""
         return bool(self.token and self.database_id)
 
+    @property
+    def index(self) -> NotionIndex:
+        if self._index is None:
+            self._index = NotionIndex(self.database_id)
+        return self._index
+
+    def _throttle(self):
+        """Esperar el turno del request dentro del límite por segundo."""
+        with self._rate_lock:
+            wait = max(self._blocked_until - time.monotonic(), self._bucket.wait_time(1), 0.0)
+            # Se descuenta ya: los threads siguientes se encolan detrás
+            self._bucket.consume(1)
+        if wait > 0:
+            metrics.observe("notion.throttle_sleep", wait)
+            time.sleep(wait)
+
+    def _request(self, method: str, path: str, idempotent: bool = True,
+                 **kwargs) -> requests.Response:
+        """
+        Hacer un request a la API respetando el rate limit.
+
+        Reintenta con backoff ante 429 (esperando el Retry-After, que frena a
+        todos los threads), 5xx y errores de conexión. Retorna la última
+        respuesta; los errores de red se propagan si se agotan los reintentos.
+
+        Con idempotent=False (crear páginas) solo se reintenta lo que Notion
+        seguro no procesó: 429 y timeouts de conexión. Un 5xx o un error a
+        mitad del request se devuelve/propaga enseguida, porque la página
+        puede haberse creado igual.
+        """
+        for attempt in range(NOTION_MAX_RETRIES + 1):
+            self._throttle()
+            last = attempt == NOTION_MAX_RETRIES
+            if attempt:
+                metrics.inc("notion.retries")
+            try:
+                with metrics.timer("notion.request"):
+                    response = self.session.request(
+                        method, f"{self.base_url}{path}", timeout=NOTION_TIMEOUT, **kwargs
+                    )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.inc("notion.errors")
+                if last or not (idempotent or isinstance(e, requests.ConnectTimeout)):
+                    raise
+                time.sleep(2 ** attempt * 0.5)
+                continue
+
+            metrics.inc(f"notion.responses_{response.status_code // 100}xx")
+            if response.status_code == 429:
+                metrics.inc("notion.rate_limited")
+            if response.status_code == 429 and not last:
+                retry_after = parse_duration(response.headers.get("Retry-After")) or 2 ** attempt
+                with self._rate_lock:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                continue
+            if response.status_code >= 500 and idempotent and not last:
+                time.sleep(2 ** attempt * 0.5)
+                continue
+            return response
+
+    def query_pages(self, filter: dict | None = None) -> Iterator[dict]:
+        """Recorrer todas las páginas de la base, siguiendo next_cursor."""
+        payload = {"page_size": 100}
+        if filter:
+            payload["filter"] = filter
+
+        while True:
+            response = self._request(
+                "POST", f"/databases/{self.database_id}/query", json=payload
+            )
+            response.raise_for_status()
+            data = response.json()
+            yield from data.get("results", [])
+
+            if not data.get("has_more") or not data.get("next_cursor"):
+                return
+            payload["start_cursor"] = data["next_cursor"]
+
+    def sync_index(self) -> int:
+        """
+        Poner al día el índice local de páginas existentes.
+
+        La primera vez (y cada NOTION_FULL_SYNC_HOURS) recorre la base
+        completa y descarta del índice las páginas que ya no están; en el
+        medio solo pide las páginas editadas desde la última
+        sincronización. Retorna la cantidad de páginas en el índice.
+        """
+        index = self.index
+        started_at = datetime.now(timezone.utc)
+
+        full_synced_at = index.full_synced_at
+        full = (not index.synced_at or not full_synced_at
+                or started_at - datetime.fromisoformat(full_synced_at)
+                >= timedelta(hours=NOTION_FULL_SYNC_HOURS))
+
+        filter = None
+        if not full:
+            since = datetime.fromisoformat(index.synced_at) - SYNC_MARGIN
+            filter = {
+                "timestamp": "last_edited_time",
+                "last_edited_time": {"on_or_after": since.isoformat()},
+            }
+
+        pages = []
+        seen = set()
+        for page in self.query_pages(filter):
+            pages.append(page)
+            seen.add(page["id"])
+            if len(pages) == 500:
+                index.add_pages(pages)
+                pages.clear()
+        index.add_pages(pages)
+
+        if full:
+            removed = index.prune(seen)
+            if removed:
+                print(f"  🗑️  {removed} páginas borradas en Notion salieron del índice")
+
+        # Solo se avanza la marca si la sincronización terminó completa
+        index.mark_synced(started_at.isoformat(), full=full)
+        self._index_synced_at = time.monotonic()
+        return len(index)
+
+    @property
+    def _index_synced(self) -> bool:
+        """
+        ¿El índice está al día? Un proceso largo (--watch) lo vuelve a
+        sincronizar cada NOTION_FULL_SYNC_HOURS, así ve las páginas editadas
+        o borradas en Notion y le toca el recorrido completo que las descarta.
+        """
+        return (self._index_synced_at is not None
+                and time.monotonic() - self._index_synced_at < NOTION_FULL_SYNC_HOURS * 3600)
+
+    def _ensure_index(self):
+        """Sincronizar el índice si no está al día; si falla, usar el local hasta la próxima vez."""
+        if self._index_synced:
+            return
+        try:
+            self.sync_index()
+        except requests.RequestException as e:
+            print(f"  ⚠️  No se pudo sincronizar el índice de Notion ({e}); se usa el índice local")
+            self._index_synced_at = time.monotonic()
+
     def get_existing_titles(self) -> set:
-        """Obtener títulos existentes en la base de datos para evitar duplicados."""
-        if self._existing_titles is not None:
-            return self._existing_titles
-
-        self._existing_titles = set()
-
-        response = requests.post(
-            f"{self.base_url}/databases/{self.database_id}/query",
-            headers=self.headers,
-            json={"page_size": 100}
-        )
-
-        if response.status_code == 200:
-            results = response.json().get("results", [])
-            for page in results:
-                title_prop = page.get("properties", {}).get("Título", {})
-                title_list = title_prop.get("title", [])
-                if title_list:
-                    title = title_list[0].get("text", {}).get("content", "")
-                    self._existing_titles.add(title.lower().strip())
-
-        return self._existing_titles
-
-    def newsletter_exists(self, titulo: str) -> bool:
-        """Verificar si un newsletter ya existe por título."""
-        existing = self.get_existing_titles()
-        return titulo.lower().strip() in existing
+        """Obtener títulos existentes (normalizados) para evitar duplicados."""
+        self._ensure_index()
+        return self.index.titles
+
+    def known_gmail_ids(self) -> set[str]:
+        """IDs de Gmail de los newsletters que ya tienen página (para filtrar antes del LLM)."""
+        self._ensure_index()
+        return self.index.gmail_ids
+
+    def newsletter_exists(self, titulo: str, link: str | None = None) -> bool:
+        """Verificar si un newsletter ya existe por ID de Gmail / link o por título."""
+        self._ensure_index()
+        return self.index.contains(titulo, link)
 
     def clear_database(self) -> int:
         """Eliminar todas las entradas de la base de datos."""
         deleted = 0
 
-        response = requests.post(
-            f"{self.base_url}/databases/{self.database_id}/query",
-            headers=self.headers,
-            json={"page_size": 100}
-        )
-
-        if response.status_code == 200:
-            results = response.json().get("results", [])
-            for page in results:
-                page_id = page["id"]
-                del_response = requests.patch(
-                    f"{self.base_url}/pages/{page_id}",
-                    headers=self.headers,
-                    json={"archived": True}
-                )
-                if del_response.status_code == 200:
-                    deleted += 1
-
-        # Limpiar cache
-        self._existing_titles = None
+        # Listar primero: archivar mientras se pagina corre los cursores
+        for page in list(self.query_pages()):
+            page_id = page["id"]
+            del_response = self._request(
+                "PATCH", f"/pages/{page_id}", json={"archived": True}
+            )
+            if del_response.status_code == 200:
+                deleted += 1
+
+        # Limpiar índice local
+        self.index.clear()
+        self._index_synced_at = None
         return deleted
 
     def add_newsletter(self, newsletter: dict) -> dict:
@@ -85,13 +256,18 @@ class NotionClient:
         Args:
             newsletter: Dict con titulo, fuente, fecha, categoria, resumen, tags, link
         """
+        fuente = newsletter.get("fuente", "")
+        otras = [dup["fuente"] for dup in newsletter.get("otras_fuentes", []) if dup.get("fuente")]
+        if otras:
+            fuente = f"{fuente} (también: {', '.join(otras)})"
+
         # Construir propiedades según el schema de Notion
         properties = {
             "Título": {
                 "title": [{"text": {"content": newsletter.get("titulo", "Sin título")}}]
             },
             "Fuente": {
-                "rich_text": [{"text": {"content": newsletter.get("fuente", "")}}]
+                "rich_text": [{"text": {"content": fuente[:2000]}}]
             },
             "Fecha": {
                 "date": {"start": newsletter.get("fecha", datetime.now().strftime("%Y-%m-%d"))}
@@ -124,50 +300,118 @@ class NotionClient:
             "properties": properties
         }
 
-        response = requests.post(
-            f"{self.base_url}/pages",
-            headers=self.headers,
-            json=payload
-        )
+        return self._create_page(payload, newsletter.get("link"))
 
-        if response.status_code != 200:
-            print(f"    Error Notion: {response.status_code} - {response.text[:200]}")
-            return {"error": response.text}
+    def _create_page(self, payload: dict, link: str | None) -> dict:
+        """
+        Crear una página sin duplicarla si la respuesta se pierde.
 
-        return response.json()
+        Crear no es idempotente: ante un 5xx o un error de red a mitad del
+        request, Notion puede haber creado la página igual. Antes de
+        reintentar se busca en la base por Link; si ya está, se usa esa.
+        Sin link no hay forma de verificarlo y no se reintenta.
+        """
+        for attempt in range(NOTION_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(2 ** attempt * 0.5)
+            try:
+                response = self._request("POST", "/pages", idempotent=False, json=payload)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                error = f"{response.status_code} - {response.text[:200]}"
+                if response.status_code < 500:
+                    break
+
+            if not link or attempt == NOTION_MAX_RETRIES:
+                break
+            try:
+                existing = self._find_page_by_link(link)
+            except requests.RequestException:
+                break
+            if existing is not None:
+                return existing
+            metrics.inc("notion.retries")
+
+        print(f"    Error Notion: {error}")
+        return {"error": error}
+
+    def _find_page_by_link(self, link: str) -> dict | None:
+        """Página de la base con ese Link, o None si no existe."""
+        filter = {"property": "Link", "url": {"equals": link}}
+        for page in self.query_pages(filter):
+            if (page.get("properties", {}).get("Link") or {}).get("url") == link:
+                return page
+        return None
+
+    def _claim(self, titulo: str, link: str | None) -> bool:
+        """
+        Reservar un newsletter para crearlo. False si ya existe en el índice
+        o si otro thread lo está creando (misma clave de título o link).
+        """
+        keys = {normalize_title(titulo)} | ({link} if link else set())
+        with self._pending_lock:
+            if self.newsletter_exists(titulo, link) or keys & self._pending:
+                return False
+            self._pending |= keys
+            return True
+
+    def _create(self, nl: dict) -> dict:
+        """Crear la página de un newsletter ya reservado y liberar la reserva."""
+        titulo = nl.get('titulo', 'Sin título')
+        link = nl.get('link')
+        try:
+            result = self.add_newsletter(nl)
+            if "error" not in result:
+                # Al índice antes de liberar la reserva: nunca queda sin cubrir
+                self.index.add_pages([result])
+                self.index.add_aliases(result["id"], duplicate_gmail_ids(nl))
+            return result
+        finally:
+            with self._pending_lock:
+                self._pending -= {normalize_title(titulo)} | ({link} if link else set())
 
     def add_newsletters(self, newsletters: list[dict]) -> dict:
         """
         Agregar múltiples newsletters a Notion, evitando duplicados.
 
+        Las páginas se crean en paralelo (NOTION_WORKERS threads) dentro del
+        rate limit de Notion.
+
         Returns:
-            Dict con estadísticas de la operación
+            Dict con estadísticas de la operación; "pages" lista (link, page_id)
+            de los newsletters que quedaron en Notion (page_id None si ya existía)
         """
-        results = {"success": 0, "failed": 0, "skipped": 0, "errors": []}
+        results = {"success": 0, "failed": 0, "skipped": 0, "errors": [], "pages": []}
 
-        print("  Verificando duplicados...")
-        self.get_existing_titles()
+        if not self._index_synced:
+            print("  Verificando duplicados...")
+            self._ensure_index()
 
+        to_create = []
         for i, nl in enumerate(newsletters, 1):
             titulo = nl.get('titulo', 'Sin título')
 
-            # Verificar si ya existe
-            if self.newsletter_exists(titulo):
+            # Verificar si ya existe (o si ya se está enviando en este batch)
+            if not self._claim(titulo, nl.get('link')):
                 print(f"  ⏭️  Saltando {i}/{len(newsletters)}: {titulo[:40]}... (ya existe)")
                 results["skipped"] += 1
+                results["pages"].append((nl.get('link'), None))
                 continue
 
             print(f"  📤 Enviando {i}/{len(newsletters)}: {titulo[:40]}...")
-
-            result = self.add_newsletter(nl)
-
-            if "error" in result:
-                results["failed"] += 1
-                results["errors"].append(result["error"])
-            else:
-                results["success"] += 1
-                # Agregar a cache para evitar duplicados en el mismo batch
-                self._existing_titles.add(titulo.lower().strip())
+            to_create.append(nl)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for nl, result in zip(to_create, executor.map(self._create, to_create)):
+                if "error" in result:
+                    results["failed"] += 1
+                    results["errors"].append(result["error"])
+                else:
+                    results["success"] += 1
+                    results["pages"].append((nl.get('link'), result.get("id")))
 
         return results
 
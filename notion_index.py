@@ -0,0 +1,275 @@
+"""
+Índice local (SQLite) de las páginas que ya existen en la base de Notion.
+
+Reemplaza la query de 100 páginas que se hacía al inicio de cada ejecución:
+la primera vez se recorre la base completa con paginación por cursor y
+después solo se piden las páginas editadas desde la última sincronización
+(filtro por last_edited_time). Los chequeos de duplicados se hacen contra
+sets en memoria cargados del índice, sin importar el tamaño de la base.
+
+La query de la base no devuelve páginas archivadas ni en la papelera, así
+que la sincronización incremental no se entera de las borradas: cada
+NOTION_FULL_SYNC_HOURS se recorre la base completa y se descarta del
+índice lo que ya no está (y sus alias), así un mensaje cuya página se
+borró vuelve a importarse.
+
+Cada página se indexa por título normalizado y por ID de Gmail / link. Los
+casi duplicados que se colapsaron en una página (otras_fuentes) quedan como
+alias de su ID de Gmail, así no se vuelven a descargar ni a clasificar.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+
+DEFAULT_NOTION_INDEX_FILE = ".notion_index.db"
+
+_SPACES_RE = re.compile(r"\s+")
+_GMAIL_LINK_RE = re.compile(r"mail\.google\.com/mail/.*#[^/]+/([^/?#\s]+)")
+
+
+def normalize_title(title: str) -> str:
+    """Título en minúsculas y con espacios colapsados (clave de deduplicación)."""
+    return _SPACES_RE.sub(" ", (title or "").lower()).strip()
+
+
+def gmail_id_from_link(link: str | None) -> str | None:
+    """Extraer el ID de mensaje de un link de Gmail (…/#inbox/<id>)."""
+    if not link:
+        return None
+    match = _GMAIL_LINK_RE.search(link)
+    return match.group(1) if match else None
+
+
+def duplicate_gmail_ids(newsletter: dict) -> list[str]:
+    """IDs de Gmail de los casi duplicados colapsados en un resultado (otras_fuentes)."""
+    ids = (gmail_id_from_link(dup.get("link")) for dup in newsletter.get("otras_fuentes") or ())
+    return [gmail_id for gmail_id in ids if gmail_id]
+
+
+def page_entry(page: dict) -> tuple[str, str, str | None, str | None, str]:
+    """Extraer (page_id, título normalizado, gmail_id, link, last_edited_time) de una página."""
+    properties = page.get("properties", {})
+    title_list = properties.get("Título", {}).get("title", [])
+    title = "".join(part.get("plain_text") or part.get("text", {}).get("content", "")
+                    for part in title_list)
+    link = properties.get("Link", {}).get("url")
+    return (
+        page["id"],
+        normalize_title(title),
+        gmail_id_from_link(link),
+        link,
+        page.get("last_edited_time", ""),
+    )
+
+
+class NotionIndex:
+    def __init__(self, database_id: str, path: str | None = None):
+        self.database_id = database_id
+        self.path = path or os.getenv("NOTION_INDEX_FILE", DEFAULT_NOTION_INDEX_FILE)
+
+        # Compartido entre los threads que escriben en Notion
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                database_id TEXT NOT NULL,
+                page_id TEXT NOT NULL,
+                title TEXT,
+                gmail_id TEXT,
+                link TEXT,
+                last_edited_time TEXT,
+                PRIMARY KEY (database_id, page_id)
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS aliases (
+                database_id TEXT NOT NULL,
+                gmail_id TEXT NOT NULL,
+                page_id TEXT NOT NULL,
+                PRIMARY KEY (database_id, gmail_id)
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS sync (
+                database_id TEXT PRIMARY KEY,
+                synced_at TEXT NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS full_sync (
+                database_id TEXT PRIMARY KEY,
+                synced_at TEXT NOT NULL
+            )
+        """)
+        self._db.commit()
+
+        self.titles: set[str] = set()
+        self.gmail_ids: set[str] = set()
+        self.links: set[str] = set()
+        self._load()
+
+    def _load(self):
+        rows = self._db.execute(
+            "SELECT title, gmail_id, link FROM pages WHERE database_id = ?", (self.database_id,)
+        ).fetchall()
+        aliases = self._db.execute(
+            "SELECT gmail_id FROM aliases WHERE database_id = ?", (self.database_id,)
+        ).fetchall()
+        self.titles = {title for title, _, _ in rows if title}
+        self.gmail_ids = {gmail_id for _, gmail_id, _ in rows if gmail_id}
+        self.gmail_ids |= {gmail_id for gmail_id, in aliases}
+        self.links = {link for _, _, link in rows if link}
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    @property
+    def synced_at(self) -> str | None:
+        """Inicio de la última sincronización (ISO 8601) o None si nunca se sincronizó."""
+        row = self._db.execute(
+            "SELECT synced_at FROM sync WHERE database_id = ?", (self.database_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    @property
+    def full_synced_at(self) -> str | None:
+        """Inicio del último recorrido completo de la base (ISO 8601) o None."""
+        row = self._db.execute(
+            "SELECT synced_at FROM full_sync WHERE database_id = ?", (self.database_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def contains(self, titulo: str | None = None, link: str | None = None) -> bool:
+        """¿Ya existe una página con ese ID de Gmail / link o con ese título?"""
+        with self._lock:
+            gmail_id = gmail_id_from_link(link)
+            if gmail_id and gmail_id in self.gmail_ids:
+                return True
+            if link and link in self.links:
+                return True
+            return bool(titulo) and normalize_title(titulo) in self.titles
+
+    def add_pages(self, pages: list[dict]):
+        """Agregar o actualizar páginas (respuestas de la API de Notion)."""
+        entries = [page_entry(page) for page in pages if not page.get("archived")
+                   and not page.get("in_trash")]
+        removed = [page["id"] for page in pages if page.get("archived") or page.get("in_trash")]
+        with self._lock:
+            # Páginas ya indexadas con otro título o link (renombradas): la
+            # clave vieja tiene que salir de los sets
+            changed = False
+            for page_id, *keys, _ in entries:
+                row = self._db.execute(
+                    "SELECT title, gmail_id, link FROM pages WHERE database_id = ? AND page_id = ?",
+                    (self.database_id, page_id),
+                ).fetchone()
+                changed = changed or (row is not None and list(row) != keys)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO pages "
+                "(database_id, page_id, title, gmail_id, link, last_edited_time) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.database_id, *entry) for entry in entries],
+            )
+            if removed:
+                self._db.executemany(
+                    "DELETE FROM pages WHERE database_id = ? AND page_id = ?",
+                    [(self.database_id, page_id) for page_id in removed],
+                )
+                self._db.executemany(
+                    "DELETE FROM aliases WHERE database_id = ? AND page_id = ?",
+                    [(self.database_id, page_id) for page_id in removed],
+                )
+            self._db.commit()
+
+            if removed or changed:
+                self._load()
+            else:
+                for _, title, gmail_id, link, _ in entries:
+                    if title:
+                        self.titles.add(title)
+                    if gmail_id:
+                        self.gmail_ids.add(gmail_id)
+                    if link:
+                        self.links.add(link)
+
+    def prune(self, page_ids: set[str]) -> int:
+        """
+        Descartar las páginas que no están en `page_ids` (las vistas en un
+        recorrido completo de la base) y los alias que apuntaban a ellas.
+        Retorna cuántas páginas se descartaron.
+        """
+        with self._lock:
+            stale = [
+                (self.database_id, page_id) for page_id, in self._db.execute(
+                    "SELECT page_id FROM pages WHERE database_id = ?", (self.database_id,)
+                ).fetchall()
+                if page_id not in page_ids
+            ]
+            self._db.executemany(
+                "DELETE FROM pages WHERE database_id = ? AND page_id = ?", stale
+            )
+            self._db.execute(
+                "DELETE FROM aliases WHERE database_id = ? AND page_id NOT IN "
+                "(SELECT page_id FROM pages WHERE database_id = ?)",
+                (self.database_id, self.database_id),
+            )
+            self._db.commit()
+            self._load()
+        return len(stale)
+
+    def page_for_gmail_id(self, gmail_id: str) -> str | None:
+        """ID de la página que tiene ese mensaje (por su link), o None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT page_id FROM pages WHERE database_id = ? AND gmail_id = ?",
+                (self.database_id, gmail_id),
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_aliases(self, page_id: str, gmail_ids: list[str]):
+        """Registrar mensajes colapsados en la página `page_id` (casi duplicados)."""
+        if not gmail_ids:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO aliases (database_id, gmail_id, page_id) VALUES (?, ?, ?)",
+                [(self.database_id, gmail_id, page_id) for gmail_id in gmail_ids],
+            )
+            self._db.commit()
+            self.gmail_ids.update(gmail_ids)
+
+    def mark_synced(self, synced_at: str, full: bool = False):
+        """
+        Guardar el instante en que empezó la última sincronización completa
+        (con full=True, además, el del último recorrido de toda la base).
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync (database_id, synced_at) VALUES (?, ?)",
+                (self.database_id, synced_at),
+            )
+            if full:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO full_sync (database_id, synced_at) VALUES (?, ?)",
+                    (self.database_id, synced_at),
+                )
+            self._db.commit()
+
+    def clear(self):
+        """Vaciar el índice de esta base (p.ej. después de clear_database)."""
+        with self._lock:
+            self._db.execute("DELETE FROM pages WHERE database_id = ?", (self.database_id,))
+            self._db.execute("DELETE FROM aliases WHERE database_id = ?", (self.database_id,))
+            self._db.execute("DELETE FROM sync WHERE database_id = ?", (self.database_id,))
+            self._db.execute("DELETE FROM full_sync WHERE database_id = ?", (self.database_id,))
+            self._db.commit()
+            self.titles.clear()
+            self.gmail_ids.clear()
+            self.links.clear()
+
+    def close(self):
+        """Cerrar la base de datos."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,194 @@
+"""
+Pipeline por etapas Gmail → Groq → Notion.
+
+Cada etapa corre en su propio thread y se comunica con la siguiente por una
+cola: mientras el summarizer espera el rate limit de Groq, la descarga IMAP
+sigue avanzando y los resultados del batch anterior ya se están escribiendo
+en Notion. El tiempo total queda cerca de la etapa más lenta en lugar de la
+suma de las tres.
+"""
+
+import queue
+import threading
+from collections import deque
+from typing import Callable, Iterable, Iterator
+
+from metrics import metrics
+
+# Máximo de elementos en espera entre etapas (acota memoria si una etapa se atrasa)
+QUEUE_SIZE = 100
+
+_DONE = object()
+
+
+class _Stage(threading.Thread):
+    """Thread que vuelca un iterable en una cola y guarda cualquier excepción."""
+
+    def __init__(self, name: str, source: Callable[[], Iterable], out: queue.Queue):
+        super().__init__(name=name, daemon=True)
+        self._source = source
+        self._out = out
+        self.error = None
+
+    def run(self):
+        try:
+            with metrics.timer(f"stage.{self.name}"):
+                for item in self._source():
+                    self._out.put(item)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._out.put(_DONE)
+
+
+def _drain(q: queue.Queue) -> Iterator:
+    """Iterar una cola hasta encontrar el marcador de fin."""
+    while True:
+        item = q.get()
+        if item is _DONE:
+            return
+        yield item
+
+
+class _FairQueue:
+    """
+    Una cola acotada por fuente y una salida que las atiende por turnos.
+
+    Si una fuente produce mucho más rápido que otra (un label con cientos de
+    mensajes y otro con diez), cada una igual recibe un turno de cada N en
+    el summarizer en lugar de esperar a que la más grande termine.
+    """
+
+    def __init__(self, names: Iterable[str], maxsize: int = QUEUE_SIZE):
+        self._items = {name: deque() for name in names}
+        self._turns = deque(self._items)
+        self._open = set(self._items)
+        self._maxsize = maxsize
+        self._cond = threading.Condition()
+
+    def put(self, name: str, item):
+        with self._cond:
+            while len(self._items[name]) >= self._maxsize:
+                self._cond.wait()
+            self._items[name].append(item)
+            self._cond.notify_all()
+
+    def close(self, name: str):
+        """La fuente terminó: no va a producir más."""
+        with self._cond:
+            self._open.discard(name)
+            self._cond.notify_all()
+
+    def get(self):
+        """Siguiente elemento por turnos, o _DONE cuando todas las fuentes terminaron."""
+        with self._cond:
+            while True:
+                for _ in range(len(self._turns)):
+                    name = self._turns[0]
+                    self._turns.rotate(-1)
+                    if self._items[name]:
+                        item = self._items[name].popleft()
+                        self._cond.notify_all()
+                        return item
+                if not self._open:
+                    return _DONE
+                self._cond.wait()
+
+
+def merge_fair(sources: dict[str, Iterable[dict]]) -> Iterator[dict]:
+    """
+    Combinar varias fuentes de newsletters (p.ej. una por label) en un solo flujo.
+
+    Cada fuente se consume en su propio thread (su propia conexión IMAP) y
+    el flujo resultante las intercala por turnos. Si alguna fuente falla,
+    las demás siguen y el error se propaga al terminar.
+    """
+    fair = _FairQueue(sources)
+    errors = []
+
+    def feed(name: str, source: Iterable[dict]):
+        try:
+            for item in source:
+                fair.put(name, item)
+        except BaseException as e:
+            print(f"❌ Error descargando '{name}': {e}")
+            errors.append(e)
+        finally:
+            fair.close(name)
+
+    threads = [
+        threading.Thread(target=feed, args=(name, source), name=f"gmail-{name}", daemon=True)
+        for name, source in sources.items()
+    ]
+    for thread in threads:
+        thread.start()
+
+    while True:
+        item = fair.get()
+        if item is _DONE:
+            break
+        yield item
+
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def run_pipeline(newsletters: Iterable[dict], summarizer, total: int | None = None,
+                 sink: Callable[[list[dict]], dict] | None = None,
+                 collect: bool = True) -> tuple[list[dict], dict]:
+    """
+    Ejecutar descarga, clasificación y envío en paralelo.
+
+    Args:
+        newsletters: Iterable que produce newsletters (GmailClient.iter_newsletters)
+        summarizer: NewsletterSummarizer (usa iter_batches)
+        total: Cantidad esperada de newsletters, para el progreso
+        sink: Función que recibe los resultados de cada batch apenas están
+            listos (p.ej. NotionClient.add_newsletters). None para no enviar.
+        collect: False para no acumular los resultados (backfill: el sink
+            ya los guarda y la memoria no crece con el backlog)
+
+    Returns:
+        (resultados de todos los batches o [] si collect=False,
+        estadísticas combinadas del sink; "failed" incluye los newsletters
+        que el LLM no pudo clasificar)
+    """
+    fetched = queue.Queue(maxsize=QUEUE_SIZE)
+    summarized = queue.Queue(maxsize=QUEUE_SIZE)
+
+    fetch_stage = _Stage("gmail", lambda: newsletters, fetched)
+    summarize_stage = _Stage(
+        "llm", lambda: summarizer.iter_batches(_drain(fetched), total=total), summarized
+    )
+    fetch_stage.start()
+    summarize_stage.start()
+
+    all_results = []
+    stats = {"success": 0, "failed": 0, "skipped": 0, "errors": []}
+
+    for results in _drain(summarized):
+        if collect:
+            all_results.extend(results)
+        if sink and results:
+            with metrics.timer("stage.notion"):
+                batch_stats = sink(results)
+            for key in ("success", "failed", "skipped"):
+                stats[key] += batch_stats.get(key, 0)
+            stats["errors"].extend(batch_stats.get("errors", []))
+
+    summarize_stage.join()
+    if summarize_stage.error is not None:
+        # La descarga puede quedar bloqueada en una cola llena; es daemon
+        raise summarize_stage.error
+
+    fetch_stage.join()
+    if fetch_stage.error is not None:
+        raise fetch_stage.error
+
+    # Lo que el LLM no pudo clasificar nunca llegó al sink: también es un fallo
+    stats["failed"] += len(summarizer.unclassified)
+    stats["errors"].extend(f"Sin clasificar: {subject}" for _, subject in summarizer.unclassified)
+
+    return all_results, stats
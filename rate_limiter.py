@@ -0,0 +1,161 @@
+"""
+Control de rate limit por tokens y requests por minuto (token bucket).
+
+Reemplaza las pausas fijas entre batches: cada request reserva los tokens
+estimados de su prompt y solo espera lo necesario para no pasarse del límite.
+El estado se corrige con los headers x-ratelimit-* que devuelve el proveedor
+y con el Retry-After de las respuestas 429.
+"""
+
+import re
+import threading
+import time
+
+# Aproximación estándar para modelos tipo Llama: ~4 caracteres por token
+CHARS_PER_TOKEN = 4
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimar los tokens de un texto sin tokenizer."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Parsear duraciones de headers ("7.66s", "2m59.56s", "120ms") a segundos."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    factors = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(amount) * factors[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    """Bucket que se rellena de forma continua hasta `capacity` por `period` segundos."""
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos hasta que haya `amount` disponible."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        """Descontar `amount` (el nivel puede quedar negativo: deuda a pagar)."""
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        """Devolver `amount` consumido por un request que no se procesó."""
+        self._refill()
+        self.level = min(self.capacity, self.level + min(amount, self.capacity))
+
+    def cap(self, level: float):
+        """Limitar el nivel a lo que reporta el servidor."""
+        self._refill()
+        self.level = min(self.level, level)
+
+
+class RateLimiter:
+    def __init__(self, tokens_per_minute: int, requests_per_minute: int):
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        # Tiempo total de espera impuesto por el limiter (para reportes)
+        self.waited_seconds = 0.0
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reservar un request de `tokens` tokens.
+
+        Retorna los segundos que hay que esperar antes de enviarlo. La reserva
+        se descuenta de inmediato, así varios requests concurrentes se encolan
+        sin pasarse del límite.
+        """
+        with self._lock:
+            wait = max(
+                self._blocked_until - time.monotonic(),
+                self.tokens.wait_time(tokens),
+                self.requests.wait_time(1),
+                0.0,
+            )
+            self.tokens.consume(tokens)
+            self.requests.consume(1)
+            self.waited_seconds += wait
+            return wait
+
+    def acquire(self, tokens: int) -> float:
+        """Reservar y esperar lo necesario (versión bloqueante de reserve)."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def release(self, tokens: int):
+        """
+        Devolver una reserva cuyo request fue rechazado con 429: el proveedor
+        no lo procesó, y el reintento vuelve a reservar con reserve().
+        """
+        with self._lock:
+            self.tokens.refund(tokens)
+            self.requests.refund(1)
+
+    def record_usage(self, estimated: int, actual: int | None):
+        """Corregir la reserva con los tokens reales reportados por la API."""
+        if actual is None:
+            return
+        with self._lock:
+            self.tokens.consume(actual - estimated)
+
+    def update_from_headers(self, headers):
+        """Sincronizar con los headers x-ratelimit-* de la respuesta."""
+        if not headers:
+            return
+
+        def _number(name):
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        remaining_tokens = _number("x-ratelimit-remaining-tokens")
+        remaining_requests = _number("x-ratelimit-remaining-requests")
+        reset_tokens = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+        reset_requests = parse_duration(headers.get("x-ratelimit-reset-requests"))
+
+        with self._lock:
+            if remaining_tokens is not None:
+                self.tokens.cap(remaining_tokens)
+                if remaining_tokens <= 0 and reset_tokens:
+                    self._block(reset_tokens)
+            # Groq reporta requests por día: solo se usa para bloquear al agotarse
+            if remaining_requests is not None and remaining_requests <= 0 and reset_requests:
+                self._block(reset_requests)
+
+    def backoff(self, seconds: float):
+        """Bloquear todos los requests durante `seconds` (p.ej. Retry-After de un 429)."""
+        with self._lock:
+            self._block(seconds)
+
+    def _block(self, seconds: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
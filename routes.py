@@ -0,0 +1,63 @@
+"""
+Rutas label → base de Notion para procesar varios labels (y cuentas) en una ejecución.
+
+Cada ruta se escribe como LABEL[@CUENTA][=DATABASE_ID]:
+
+- "data_science": label de la cuenta principal (GMAIL_EMAIL) a NOTION_DATABASE_ID
+- "ml@trabajo": label de la cuenta "trabajo", con credenciales en
+  GMAIL_EMAIL_TRABAJO y GMAIL_APP_PASSWORD_TRABAJO
+- "papers@trabajo=abc123": lo mismo, pero a otra base de Notion
+
+Las rutas se pasan con --route (repetible) o en DIGEST_ROUTES separadas por ";".
+"""
+
+import os
+
+ROUTES_SEPARATOR = ";"
+
+
+class Route:
+    """Un label de una cuenta de Gmail y la base de Notion donde terminan sus newsletters."""
+
+    __slots__ = ("label", "account", "database_id")
+
+    def __init__(self, label: str, account: str | None = None, database_id: str | None = None):
+        self.label = label
+        self.account = account
+        self.database_id = database_id or os.getenv("NOTION_DATABASE_ID")
+
+    @property
+    def name(self) -> str:
+        """Identificador de la ruta (va en el campo "ruta" de cada resultado)."""
+        return f"{self.label}@{self.account}" if self.account else self.label
+
+    def __repr__(self) -> str:
+        return f"Route({self.name!r} → {self.database_id!r})"
+
+
+def parse_route(spec: str) -> Route:
+    """Parsear LABEL[@CUENTA][=DATABASE_ID]."""
+    spec = spec.strip()
+    target, _, database_id = spec.partition("=")
+    label, _, account = target.rpartition("@") if "@" in target else (target, "", "")
+    label = label.strip()
+    if not label:
+        raise ValueError(f"Ruta inválida: '{spec}' (formato LABEL[@CUENTA][=DATABASE_ID])")
+    return Route(label, account.strip() or None, database_id.strip() or None)
+
+
+def load_routes(specs: list[str] | None) -> list[Route]:
+    """
+    Rutas de la línea de comandos o, si no hay, de DIGEST_ROUTES.
+
+    Retorna [] si no hay ninguna configurada (modo de un solo label).
+    """
+    if not specs:
+        specs = os.getenv("DIGEST_ROUTES", "").split(ROUTES_SEPARATOR)
+    routes = [parse_route(spec) for spec in specs if spec.strip()]
+
+    names = [route.name for route in routes]
+    repeated = {name for name in names if names.count(name) > 1}
+    if repeated:
+        raise ValueError(f"Rutas repetidas: {', '.join(sorted(repeated))}")
+    return routes
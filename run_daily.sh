@@ -10,7 +10,7 @@ echo "Ejecutando: $(date)"
 echo "========================================"
 
 # Ejecutar procesamiento con Groq
-python3 digest.py --label "data_science" --days 7 --max 50
+python3 digest.py --label "data_science" --days 7 --max 50 --incremental --fetch-mode partial
 
 EXIT_CODE=$?
 
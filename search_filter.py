@@ -0,0 +1,81 @@
+"""
+Filtros de remitentes y búsqueda libre de Gmail, aplicados en el SEARCH.
+
+- SENDER_ALLOW: solo estos remitentes (direcciones o dominios)
+- SENDER_DENY: nunca estos remitentes (gana sobre SENDER_ALLOW)
+- GMAIL_QUERY: expresión de búsqueda de Gmail, p.ej.
+  "-from:noreply@foo.com has:nouserlabels"
+
+En Gmail todo se compila a un solo X-GM-RAW dentro del UID SEARCH, así el
+servidor filtra antes de descargar nada. En otros servidores IMAP los
+remitentes se filtran del lado del cliente pidiendo solo el header From
+(nunca cuerpos); GMAIL_QUERY no tiene equivalente y se ignora.
+"""
+
+import os
+from email.utils import parseaddr
+
+from message_parser import decode_header_value
+
+
+def _split(value: str | None) -> list[str]:
+    """Lista separada por comas o espacios, en minúsculas y sin vacíos."""
+    return [item.strip().lower() for item in (value or "").replace(",", " ").split() if item.strip()]
+
+
+SENDER_ALLOW = _split(os.getenv("SENDER_ALLOW"))
+SENDER_DENY = _split(os.getenv("SENDER_DENY"))
+GMAIL_QUERY = os.getenv("GMAIL_QUERY", "").strip()
+
+
+def sender_matches(address: str, entry: str) -> bool:
+    """¿La dirección coincide con la entrada (dirección exacta, @dominio o dominio)?"""
+    address = address.lower()
+    if "@" in entry and not entry.startswith("@"):
+        return address == entry
+    domain = entry.lstrip("@")
+    sender_domain = address.rpartition("@")[2]
+    return sender_domain == domain or sender_domain.endswith("." + domain)
+
+
+class SearchFilter:
+    def __init__(self, allow: list[str] | None = None, deny: list[str] | None = None,
+                 query: str | None = None):
+        self.allow = _split(" ".join(allow)) if allow is not None else SENDER_ALLOW
+        self.deny = _split(" ".join(deny)) if deny is not None else SENDER_DENY
+        self.query = (query if query is not None else GMAIL_QUERY).strip()
+
+    def __bool__(self) -> bool:
+        return bool(self.allow or self.deny or self.query)
+
+    @property
+    def has_senders(self) -> bool:
+        return bool(self.allow or self.deny)
+
+    def gmail_raw(self) -> str:
+        """Todo el filtro como una búsqueda de Gmail (para X-GM-RAW)."""
+        parts = []
+        if self.allow:
+            # {a b} es OR en la sintaxis de búsqueda de Gmail
+            parts.append("{" + " ".join(f"from:{entry}" for entry in self.allow) + "}")
+        parts.extend(f"-from:{entry}" for entry in self.deny)
+        if self.query:
+            parts.append(f"({self.query})")
+        return " ".join(parts)
+
+    def sender_allowed(self, sender: str | None) -> bool:
+        """Filtro del lado del cliente sobre el header From (servidores sin X-GM-RAW)."""
+        address = parseaddr(decode_header_value(sender or ""))[1]
+        if any(sender_matches(address, entry) for entry in self.deny):
+            return False
+        return not self.allow or any(sender_matches(address, entry) for entry in self.allow)
+
+    def describe(self) -> str:
+        parts = []
+        if self.allow:
+            parts.append(f"solo de {', '.join(self.allow)}")
+        if self.deny:
+            parts.append(f"excepto {', '.join(self.deny)}")
+        if self.query:
+            parts.append(f"'{self.query}'")
+        return "; ".join(parts)
@@ -3,14 +3,25 @@ Módulo para generar resúmenes estructurados usando Groq (Llama 3).
 Genera JSON listo para Notion.
 
 Groq es gratis y muy rápido. Obtén tu API key en: https://console.groq.com/keys
+El backend se puede cambiar (servidor local o fake) con LLM_BACKEND; ver llm_backends.py.
 """
 
+import asyncio
 import json
 import os
-import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Iterable, Iterator
 
 from dotenv import load_dotenv
-from groq import Groq
+
+from compaction import PROMPT_ITEM_TOKENS
+from llm_backends import RateLimited, create_backend
+from llm_cache import LLMCache, cache_key
+from message_parser import gmail_link
+from metrics import metrics
+from rate_limiter import RateLimiter, estimate_tokens
 
 load_dotenv()
 
@@ -18,6 +29,7 @@ SYSTEM_PROMPT = """Clasifica newsletters de data science.
 
 Para CADA newsletter extrae:
 
+0. **id**: El ID del newsletter tal como aparece en la entrada (ej: "N3")
 1. **titulo**: Asunto limpio
 2. **fuente**: Remitente
 3. **categoria**: Herramienta | Tutorial | Noticia
@@ -28,49 +40,204 @@ Para CADA newsletter extrae:
    - Campo: machine-learning, deep-learning, nlp, computer-vision, time-series, recommender-systems, reinforcement-learning, causal-inference, statistical-modeling, data-engineering, mlops, analytics-bi, feature-engineering, optimization, bayesian-methods, generative-ai, llm, rag-systems
 
 JSON:
-{"newsletters":[{"titulo":"...","fuente":"...","categoria":"...","herramienta":"...","resumen":"...","tags":["tipo","campo"]}]}
+{"newsletters":[{"id":"N1","titulo":"...","fuente":"...","categoria":"...","herramienta":"...","resumen":"...","tags":["tipo","campo"]}]}
 
 Solo JSON."""
 
-# Tamaño de batch para respetar límites de Groq (12k tokens/min en tier gratuito)
-BATCH_SIZE = 10
-BATCH_DELAY_SECONDS = 65  # Esperar 65s entre batches para reset de rate limit
+# Tokens estimados (prompt + respuesta) con los que se llena cada request
+BATCH_TARGET_TOKENS = int(os.getenv("BATCH_TARGET_TOKENS", "6000"))
+MAX_OUTPUT_TOKENS = 4000
+OUTPUT_TOKENS_PER_ITEM = 120  # ~1 objeto JSON por newsletter
+MAX_BATCH_ITEMS = MAX_OUTPUT_TOKENS // OUTPUT_TOKENS_PER_ITEM
+
+# Reintentos ante 429 (se espera el Retry-After del proveedor)
+MAX_RATE_LIMIT_RETRIES = 3
+
+# Rondas extra para re-enviar solo los items faltantes o inválidos de un batch
+MAX_ITEM_RETRIES = 2
+
+CATEGORIAS = ("Herramienta", "Tutorial", "Noticia")
+
+# Requests al LLM en vuelo a la vez (1 = secuencial, como en el tier gratuito)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "1"))
+
+# Caracteres del cuerpo que se envían por newsletter
+BODY_PROMPT_CHARS = 800
+
+
+def validate_result(result) -> list[str]:
+    """Validar un item de la respuesta del LLM. Retorna la lista de problemas."""
+    if not isinstance(result, dict):
+        return ["no es un objeto"]
+
+    problems = []
+    titulo = result.get("titulo")
+    if not isinstance(titulo, str) or not titulo.strip():
+        problems.append("falta titulo")
+    if result.get("categoria") not in CATEGORIAS:
+        problems.append(f"categoria inválida: {result.get('categoria')!r}")
+    tags = result.get("tags")
+    if not isinstance(tags, list) or len(tags) != 2 or not all(isinstance(t, str) and t for t in tags):
+        problems.append(f"tags inválidos: {tags!r}")
+    return problems
 
 
 class NewsletterSummarizer:
-    def __init__(self):
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
-            raise ValueError(
-                "GROQ_API_KEY no configurada en .env\n"
-                "Obtén tu API key gratis en: https://console.groq.com/keys"
+    def __init__(self, cache: LLMCache | None = None, concurrency: int | None = None,
+                 backend=None):
+        """
+        Args:
+            backend: Nombre del backend ("groq", "openai", "fake") o una
+                instancia ya creada. Default: LLM_BACKEND o groq.
+        """
+        if backend is None or isinstance(backend, str):
+            backend = create_backend(backend)
+        # Los reintentos ante 429 los maneja _complete con el rate limiter
+        self.backend = backend
+        self.model = backend.model
+        # Cache de clasificaciones por newsletter (None = siempre llamar al LLM)
+        self.cache = cache
+        self.limiter = RateLimiter(backend.tokens_per_minute, backend.requests_per_minute)
+        self.concurrency = max(1, concurrency or LLM_CONCURRENCY)
+        self._batch_num = 0
+        # (id, asunto) de los newsletters sin resultado en el último iter_batches:
+        # no llegan al sink, así que se cuentan aparte como fallidos
+        self.unclassified: list[tuple[str, str]] = []
+        # Event loop propio en un thread: los requests corren en asyncio
+        # mientras iter_batches sigue consumiendo el iterable de entrada
+        self._loop = None
+        self._loop_thread = None
+
+    def _submit(self, coro) -> Future:
+        """Programar una corrutina en el event loop del summarizer."""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(
+                target=self._loop.run_forever, name="llm-loop", daemon=True
             )
+            self._loop_thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def close(self):
+        """Detener el event loop y cerrar el cliente HTTP."""
+        if self._loop is None:
+            return
+        self._submit(self.backend.close()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def _item_text(self, nl: dict) -> str:
+        """Texto de un newsletter tal como se envía en el prompt."""
+        # prompt_body viene de PromptCompactor; si no pasó por esa etapa, prefijo crudo
+        body = nl.get('prompt_body')
+        if body is None:
+            body = nl['body'][:BODY_PROMPT_CHARS]
+        body = body or "Sin contenido"
+        return f"""Asunto: {nl['subject']}
+De: {nl['from']}
+Contenido:
+{body}"""
+
+    def _item_tokens(self, nl: dict) -> int:
+        """Tokens estimados que agrega un newsletter a un request (prompt + respuesta)."""
+        return estimate_tokens(self._item_text(nl)) + 10 + OUTPUT_TOKENS_PER_ITEM
 
-        self.client = Groq(api_key=api_key)
-        self.model = "llama-3.3-70b-versatile"
+    def _cache_key(self, nl: dict) -> str:
+        """
+        Clave del cache por el cuerpo original, no por prompt_body: las
+        líneas de plantilla que PromptCompactor aprende entre ejecuciones
+        cambian la compactación, y el mismo mensaje nunca volvería a pegar.
+        """
+        if nl.get('prompt_body') is not None:
+            version = f"compact:{PROMPT_ITEM_TOKENS}"
+        else:
+            version = f"raw:{BODY_PROMPT_CHARS}"
+        return cache_key(self.model, SYSTEM_PROMPT, f"""{version}
+Asunto: {nl['subject']}
+De: {nl['from']}
+Contenido:
+{nl['body']}""")
+
+    def _attach_metadata(self, result: dict, nl: dict) -> dict:
+        """Agregar fecha real, link de Gmail, ruta y fuentes casi duplicadas a un resultado."""
+        result["fecha"] = nl['date'].strftime('%Y-%m-%d')
+        if not result.get("link"):
+            result["link"] = gmail_link(nl['id'])
+        if "ruta" in nl:
+            # Con varias rutas, indica a qué base de Notion va el resultado
+            result["ruta"] = nl["ruta"]
+        if "duplicados" in nl:
+            # Misma lista que usa NearDuplicateFilter: incluye los que lleguen después
+            result["otras_fuentes"] = nl["duplicados"]
+        return result
+
+    async def _process_batch(self, newsletters: list[dict], batch_offset: int) -> list[dict | None]:
+        """
+        Procesa un batch de newsletters y retorna los resultados alineados
+        con la entrada (None para los que no se pudieron clasificar).
 
-    def _process_batch(self, newsletters: list[dict], batch_offset: int) -> list[dict]:
-        """Procesa un batch de newsletters y retorna la lista de resultados."""
+        Cada item se valida y se asocia por su ID explícito, no por posición.
+        Los faltantes o inválidos se re-envían solos en un request más chico,
+        hasta MAX_ITEM_RETRIES veces. Si un request falla, los items ya
+        validados se conservan y solo los pendientes quedan en None.
+        """
+        results: list[dict | None] = [None] * len(newsletters)
+        pending = list(range(len(newsletters)))
 
-        # Guardar metadata original (fecha, link a Gmail)
-        metadata = {}
-        for i, nl in enumerate(newsletters, 1):
-            metadata[i] = {
-                "fecha": nl['date'].strftime('%Y-%m-%d'),
-                "gmail_link": f"https://mail.google.com/mail/u/0/#inbox/{nl['id']}"
-            }
+        for attempt in range(MAX_ITEM_RETRIES + 1):
+            if attempt:
+                print(f"     🔁 Re-enviando {len(pending)} newsletters faltantes o inválidos...")
+                metrics.inc("llm.items_retried", len(pending))
 
+            try:
+                returned = await self._request_items([newsletters[i] for i in pending])
+            except Exception as e:
+                # Los ya validados en intentos anteriores se conservan (y se
+                # cachean); solo los pendientes quedan sin resultado
+                print(f"     ❌ Error en el request ({len(pending)} newsletters): {e}")
+                break
+
+            still_pending = []
+            for pos, i in enumerate(pending):
+                result = returned.get(pos)
+                if result is not None and not validate_result(result):
+                    results[i] = result
+                else:
+                    still_pending.append(i)
+            pending = still_pending
+            if not pending:
+                break
+
+        for i in pending:
+            print(f"    ⚠️  Sin resultado válido para: {newsletters[i]['subject'][:60]}")
+
+        for nl, result in zip(newsletters, results):
+            if result is None:
+                continue
+            if self.cache is not None:
+                self.cache.put(self._cache_key(nl), self.model, dict(result))
+            # Agregar fecha real y link de Gmail
+            self._attach_metadata(result, nl)
+
+        return results
+
+    async def _request_items(self, newsletters: list[dict]) -> dict[int, dict]:
+        """
+        Enviar un request con los newsletters dados.
+
+        Returns:
+            {posición en newsletters: item de la respuesta}, asociando cada
+            item por su "id" (N1, N2, ...). Items sin ID reconocible se descartan.
+        """
         # Preparar contenido de cada newsletter
         newsletter_texts = []
         for i, nl in enumerate(newsletters, 1):
-            body = nl['body'][:800] if nl['body'] else "Sin contenido"
             newsletter_texts.append(f"""
 ---
-Newsletter {i}:
-Asunto: {nl['subject']}
-De: {nl['from']}
-Contenido:
-{body}
+Newsletter N{i}:
+{self._item_text(nl)}
 """)
 
         all_newsletters = "\n".join(newsletter_texts)
@@ -80,17 +247,14 @@ Contenido:
 {all_newsletters}
 """
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
+        content = (await self._complete(
+            [
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
             ],
-            temperature=0.2,
-            max_tokens=4000,
-        )
-
-        content = response.choices[0].message.content.strip()
+            estimated_tokens=estimate_tokens(SYSTEM_PROMPT + user_prompt)
+            + OUTPUT_TOKENS_PER_ITEM * len(newsletters),
+        )).strip()
 
         # Limpiar y parsear JSON
         if content.startswith("```"):
@@ -101,53 +265,168 @@ Contenido:
 
         try:
             data = json.loads(content)
-            results = data.get("newsletters", [])
-
-            # Agregar fecha real y link de Gmail a cada newsletter
-            for i, nl in enumerate(results, 1):
-                if i in metadata:
-                    nl["fecha"] = metadata[i]["fecha"]
-                    if not nl.get("link"):
-                        nl["link"] = metadata[i]["gmail_link"]
-
-            return results
+            items = data.get("newsletters", []) if isinstance(data, dict) else []
         except json.JSONDecodeError as e:
             print(f"    ⚠️  Error parseando JSON del batch: {e}")
-            return []
+            return {}
+
+        by_position = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            item_id = str(item.pop("id", "")).strip().upper().lstrip("N")
+            if item_id.isdigit() and 1 <= int(item_id) <= len(newsletters):
+                by_position.setdefault(int(item_id) - 1, item)
+        return by_position
+
+    async def _complete(self, messages: list[dict], estimated_tokens: int) -> str:
+        """
+        Enviar un request respetando el rate limit y retornar el contenido.
+
+        Espera lo que indique el token bucket, actualiza el bucket con los
+        headers x-ratelimit-* de la respuesta y ante un 429 devuelve la
+        reserva, espera el Retry-After y reintenta.
+        """
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            wait = self.limiter.reserve(estimated_tokens)
+            if wait >= 1:
+                print(f"     ⏳ Esperando {wait:.0f}s (rate limit)...")
+            if wait > 0:
+                metrics.observe("llm.rate_limit_sleep", wait)
+                await asyncio.sleep(wait)
+
+            try:
+                with metrics.timer("llm.request"):
+                    completion = await self.backend.complete(
+                        messages, temperature=0.2, max_tokens=MAX_OUTPUT_TOKENS
+                    )
+            except RateLimited as e:
+                metrics.inc("llm.rate_limited")
+                if attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                retry_after = e.retry_after or 2 ** attempt * 5
+                print(f"     ⚠️  429 de {self.backend.label}, reintentando en {retry_after:.0f}s...")
+                # El reintento reserva de nuevo: sin devolver esta reserva cada
+                # 429 gastaría el presupuesto dos veces. Los headers se aplican
+                # después para que el nivel reportado por el servidor mande.
+                self.limiter.release(estimated_tokens)
+                self.limiter.update_from_headers(e.headers)
+                self.limiter.backoff(retry_after)
+                continue
+
+            self.limiter.update_from_headers(completion.headers)
+            self.limiter.record_usage(estimated_tokens, completion.total_tokens)
+            metrics.inc("llm.prompt_tokens", completion.prompt_tokens or 0)
+            metrics.inc("llm.completion_tokens", completion.completion_tokens or 0)
+            return completion.content
 
     def generate_digest(self, newsletters: list[dict], max_newsletters: int = 10) -> dict:
         """
         Generar digest estructurado en JSON.
-        Procesa en batches para respetar límites de rate de Groq.
+        Procesa en batches dimensionados por tokens para respetar límites de rate de Groq.
         """
         if not newsletters:
             return {"newsletters": []}
 
         newsletters = newsletters[:max_newsletters]
-        total = len(newsletters)
         all_results = []
+        for results in self.iter_batches(newsletters, total=len(newsletters)):
+            all_results.extend(results)
 
-        # Calcular número de batches
-        num_batches = (total + BATCH_SIZE - 1) // BATCH_SIZE
-
-        for batch_num in range(num_batches):
-            start_idx = batch_num * BATCH_SIZE
-            end_idx = min(start_idx + BATCH_SIZE, total)
-            batch = newsletters[start_idx:end_idx]
+        return {"newsletters": all_results}
 
-            print(f"  📦 Batch {batch_num + 1}/{num_batches} ({start_idx + 1}-{end_idx} de {total})")
-            print(f"     Enviando a Groq (Llama 3.3)...")
+    def iter_batches(self, newsletters: Iterable[dict], total: int | None = None) -> Iterator[list[dict]]:
+        """
+        Clasificar newsletters a medida que llegan, un batch a la vez.
+
+        Produce los resultados de cada batch apenas vuelven de Groq, en el
+        orden de entrada. Cada request se llena hasta BATCH_TARGET_TOKENS y
+        se envía por el cliente async, con hasta `concurrency` requests en
+        vuelo; el rate limiter solo espera si el presupuesto por minuto
+        realmente se agotó.
+        Los newsletters que están en cache no ocupan lugar en el request; sus
+        resultados se intercalan en su posición original (cada grupo tiene a
+        lo sumo MAX_BATCH_ITEMS, cacheados o no).
+
+        Args:
+            newsletters: Iterable de newsletters (p.ej. GmailClient.iter_newsletters)
+            total: Cantidad esperada, solo para mostrar el progreso
+        """
+        self._batch_num = 0
+        self.unclassified = []
+        in_flight: deque[Future] = deque()
+        group = []
+        pending_tokens = 0
+        pending_items = 0
+        start_idx = 0
+
+        def flush():
+            in_flight.append(self._submit(self._run_batch(group, start_idx, total)))
+
+        for nl in newsletters:
+            cached = self.cache.get(self._cache_key(nl)) if self.cache is not None else None
+            metrics.inc("llm.cache_hits", cached is not None)
+            item_tokens = self._item_tokens(nl) if cached is None else 0
+            # Llenar el request hasta el presupuesto de tokens (no por cantidad
+            # fija); el tope de items cuenta también los cacheados, así una
+            # corrida toda en cache sigue produciendo resultados de a poco
+            if group and (len(group) >= MAX_BATCH_ITEMS
+                          or (pending_items and pending_tokens + item_tokens > BATCH_TARGET_TOKENS)):
+                flush()
+                start_idx += len(group)
+                group = []
+                pending_tokens = 0
+                pending_items = 0
+
+                # Hasta `concurrency` requests en vuelo; resultados en orden de entrada
+                while in_flight and (in_flight[0].done() or len(in_flight) >= self.concurrency):
+                    yield in_flight.popleft().result()
+            if cached is None:
+                pending_tokens += item_tokens
+                pending_items += 1
+            group.append((nl, cached))
+
+        if group:
+            flush()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    async def _run_batch(self, group: list[tuple[dict, dict | None]], start_idx: int,
+                         total: int | None) -> list[dict]:
+        """
+        Procesar un grupo de newsletters: los que no están en cache van a
+        Groq en un solo request, los cacheados se completan localmente.
+        """
+        pending = [nl for nl, cached in group if cached is None]
+        end_idx = start_idx + len(group)
+        of_total = f" de {total}" if total else ""
+
+        results = [None] * len(pending)
+        if pending:
+            self._batch_num += 1
+            batch_num = self._batch_num
+            in_cache = len(group) - len(pending)
+            cache_note = f", {in_cache} en cache" if in_cache else ""
+            print(f"  📦 Batch {batch_num} ({start_idx + 1}-{end_idx}{of_total}{cache_note})")
+            print(f"     Enviando a {self.backend.label}...")
 
             try:
-                results = self._process_batch(batch, start_idx)
-                all_results.extend(results)
-                print(f"     ✅ {len(results)} procesados")
+                results = await self._process_batch(pending, start_idx)
+                ok = sum(result is not None for result in results)
+                print(f"     ✅ Batch {batch_num}: {ok}/{len(pending)} procesados")
             except Exception as e:
-                print(f"     ❌ Error en batch: {e}")
-
-            # Esperar entre batches (excepto el último)
-            if batch_num < num_batches - 1:
-                print(f"     ⏳ Esperando {BATCH_DELAY_SECONDS}s (rate limit)...")
-                time.sleep(BATCH_DELAY_SECONDS)
-
-        return {"newsletters": all_results}
+                print(f"     ❌ Error en batch {batch_num}: {e}")
+        else:
+            print(f"  💾 {len(group)} en cache ({start_idx + 1}-{end_idx}{of_total})")
+
+        # Intercalar en el orden original; los que fallaron quedan en self.unclassified
+        merged = []
+        fresh = iter(results)
+        for nl, cached in group:
+            result = self._attach_metadata(dict(cached), nl) if cached is not None else next(fresh)
+            if result is not None:
+                merged.append(result)
+            else:
+                self.unclassified.append((nl['id'], nl['subject']))
+        return merged
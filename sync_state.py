@@ -0,0 +1,50 @@
+"""
+Estado de sincronización incremental por label de Gmail.
+
+Guarda, para cada label, el UIDVALIDITY del buzón y el UID más alto ya
+procesado. Con eso la siguiente ejecución solo pide mensajes nuevos
+(UID SEARCH UID n:*) en lugar de re-escanear toda la ventana de días.
+"""
+
+import json
+import os
+from pathlib import Path
+
+DEFAULT_SYNC_STATE_FILE = ".sync_state.json"
+
+
+class SyncState:
+    def __init__(self, path: str | None = None):
+        self.path = Path(path or os.getenv("SYNC_STATE_FILE", DEFAULT_SYNC_STATE_FILE))
+        self._state = self._load()
+
+    def _load(self) -> dict:
+        """Leer el archivo de estado (vacío si no existe o está corrupto)."""
+        if not self.path.exists():
+            return {}
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, json.JSONDecodeError):
+            print(f"⚠️  Estado de sync ilegible en {self.path}, se hará un escaneo completo")
+            return {}
+
+    def get(self, label: str) -> tuple[int, int] | None:
+        """Retorna (uidvalidity, last_uid) del label, o None si no hay estado."""
+        entry = self._state.get(label)
+        if not entry:
+            return None
+        return int(entry["uidvalidity"]), int(entry["last_uid"])
+
+    def update(self, label: str, uidvalidity: int, last_uid: int):
+        """Registrar el watermark del label y persistirlo."""
+        previous = self.get(label)
+        if previous and previous[0] == uidvalidity:
+            last_uid = max(last_uid, previous[1])
+        self._state[label] = {"uidvalidity": uidvalidity, "last_uid": last_uid}
+        self.save()
+
+    def save(self):
+        """Escribir el estado de forma atómica."""
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self._state, indent=2))
+        os.replace(tmp, self.path)
@@ -0,0 +1,124 @@
+"""
+Modo --watch: procesar newsletters a medida que llegan.
+
+La conexión IMAP queda en IDLE sobre el label; cuando Gmail avisa que
+llegaron mensajes se juntan en micro-batches y se procesan (descarga,
+clasificación y envío a Notion) cuando se cumple lo primero de:
+
+- WATCH_MAX_BATCH mensajes pendientes, o
+- WATCH_MAX_LATENCY segundos desde el primero que llegó.
+
+Gmail corta las sesiones IDLE a los ~29 minutos, así que el IDLE se
+renueva antes y ante cualquier corte se reconecta. La conexión, el
+cliente del LLM y el índice de Notion quedan calientes entre batches.
+"""
+
+import imaplib
+import os
+import time
+from typing import Callable
+
+# Renovar el IDLE antes del corte de Gmail (~29 minutos)
+IDLE_RENEW_SECONDS = 25 * 60
+
+# Política de micro-batches
+WATCH_MAX_BATCH = int(os.getenv("WATCH_MAX_BATCH", "10"))
+WATCH_MAX_LATENCY = float(os.getenv("WATCH_MAX_LATENCY", "60"))
+
+# Espera entre reconexiones fallidas (se duplica hasta el máximo)
+RECONNECT_MIN_SECONDS = 5
+RECONNECT_MAX_SECONDS = 300
+
+
+class MicroBatcher:
+    """Decide cuándo procesar los mensajes que fueron llegando."""
+
+    def __init__(self, max_size: int | None = None, max_latency: float | None = None):
+        self.max_size = max(1, max_size or WATCH_MAX_BATCH)
+        self.max_latency = max_latency if max_latency is not None else WATCH_MAX_LATENCY
+        self.pending = 0
+        self._first_at = None
+
+    def add(self, count: int):
+        """Registrar `count` mensajes nuevos."""
+        if count <= 0:
+            return
+        if self._first_at is None:
+            self._first_at = time.monotonic()
+        self.pending += count
+
+    def wait_time(self, limit: float) -> float:
+        """Segundos que se puede esperar en IDLE antes de tener que procesar."""
+        if self._first_at is None:
+            return limit
+        remaining = self._first_at + self.max_latency - time.monotonic()
+        return max(0.0, min(limit, remaining))
+
+    def due(self) -> bool:
+        """True si ya hay que procesar lo pendiente."""
+        if not self.pending:
+            return False
+        return (self.pending >= self.max_size
+                or time.monotonic() - self._first_at >= self.max_latency)
+
+    def reset(self):
+        self.pending = 0
+        self._first_at = None
+
+
+def watch(gmail, label_name: str, process: Callable[[], None],
+          batcher: MicroBatcher | None = None, renew_seconds: float = IDLE_RENEW_SECONDS):
+    """
+    Esperar mensajes nuevos en IDLE y llamar a `process` por cada micro-batch.
+
+    `process` busca y procesa lo que haya desde el último watermark
+    (búsqueda incremental), así que no importa si el conteo de EXISTS se
+    desfasa: solo decide cuándo llamar. Si `process` levanta una excepción
+    (también cuando algún newsletter no llegó a Notion) el mismo batch se
+    reintenta con backoff. Corre hasta Ctrl+C o SIGTERM.
+    """
+    batcher = batcher or MicroBatcher()
+    gmail.select(label_name)
+    known = gmail.exists
+    # Lo primero es ponerse al día con lo que llegó desde la última ejecución
+    catch_up = True
+    backoff = RECONNECT_MIN_SECONDS
+
+    while True:
+        try:
+            if catch_up or batcher.due():
+                if batcher.pending:
+                    print(f"\n📨 {batcher.pending} mensajes nuevos")
+                process()
+                batcher.reset()
+                # El SELECT de la búsqueda deja el conteo al día; lo que llegue
+                # durante la descarga lo reporta el próximo idle()
+                known = gmail.exists
+                backoff = RECONNECT_MIN_SECONDS
+                if catch_up:
+                    catch_up = False
+                    print(f"\n👀 Esperando newsletters en '{label_name}' (hasta "
+                          f"{batcher.max_size} mensajes o {batcher.max_latency:g}s por batch)...")
+                continue
+
+            if gmail.idle(batcher.wait_time(renew_seconds)):
+                batcher.add(gmail.exists - known)
+                known = gmail.exists
+        except (imaplib.IMAP4.abort, OSError) as e:
+            print(f"⚠️  Conexión caída ({e}), reconectando...")
+            try:
+                gmail.reconnect()
+            except (imaplib.IMAP4.error, OSError) as e:
+                print(f"   Reconexión fallida ({e}), reintento en {backoff}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, RECONNECT_MAX_SECONDS)
+                continue
+            # Lo que llegó mientras la conexión estaba caída
+            batcher.add(gmail.exists - known)
+            known = gmail.exists
+        except Exception as e:
+            # LLM o Notion con problemas (process levanta si algo no llegó a
+            # Notion): el watermark no avanzó, se reintenta
+            print(f"❌ Error procesando el batch ({e}), reintento en {backoff}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_MAX_SECONDS)